@@ -1,30 +1,17 @@
 import os
 import asyncio
 import logging
-import requests
+import functools
+from typing import Dict, List, Tuple
 import pandas as pd
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
+from . import query_engine, mistral_client, ai_session, media_group, readers, parse_pool, tracing, progress
+from .mistral_client import CircuitOpenError
+from .report_store import get_report
 
 logger = logging.getLogger(__name__)
 
-# mistral API конфиг
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY") or "r7JuVl8YKk8pfNPjCxnWzaPw6uNxYmdy"
-MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-large-latest")
-MISTRAL_ENDPOINT = os.getenv(
-    "MISTRAL_ENDPOINT",
-    "https://api.mistral.ai/v1/chat/completions",
-)
-
-# Кэш для сессии requests (переиспользуем HTTP connection)
-_requests_session = None
-
-def get_requests_session():
-    """Возвращает кэшированную сессию requests для повторного использования соединений."""
-    global _requests_session
-    if _requests_session is None:
-        _requests_session = requests.Session()
-    return _requests_session
 
 async def start_ai_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Triggered when user clicks the AI button. Ask for a question/prompt."""
@@ -42,6 +29,12 @@ async def start_ai_report(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # mark the conversation state so file_handler or other handlers know we're in AI mode
     context.user_data["report_type"] = "ai"
 
+    session = ai_session.get(update.effective_chat.id if update.effective_chat else None)
+    if session and session.filename:
+        await update.effective_message.reply_text(
+            f"📎 В памяти остаётся файл «{session.filename}» — можно задавать вопросы по нему без повторной загрузки."
+        )
+
 async def process_ai_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """Process the user's text prompt and forward it to Mistral API."""
     user_text = update.message.text.strip() if update.message and update.message.text else ""
@@ -49,129 +42,62 @@ async def process_ai_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await update.message.reply_text("❗ Пожалуйста, напишите запрос текстом.")
         return "ai"
 
-    # If the user replied to a message, try to parse the replied text on the fly
+    # Уточняющие вопросы по отчёту: сначала пытаемся ответить локально по строкам отчёта
+    chat_id = update.effective_chat.id if update.effective_chat else None
     reply_to = update.message.reply_to_message if update.message else None
+    replied_text = ''
     if reply_to:
-        replied_text = ''
-        if getattr(reply_to, 'text', None):
-            replied_text = reply_to.text
-        elif getattr(reply_to, 'caption', None):
-            replied_text = reply_to.caption
-
-        # try to parse 'homework_check' style report from replied_text
-        problems = []
-        if replied_text:
-            import re
-
-            # pattern to match lines like:
-            # • Name: Получено 10 | Проверено 7 | 70.0%
-            pattern = re.compile(
-                r"^[\u2022\-\*\•]?\s*(?P<name>[^:\n]+):\s*[Пп]олучено\s*(?P<issued>[0-9]+)\s*\|\s*[Пп]роверено\s*(?P<checked>[0-9]+)\s*\|\s*(?P<pct>[0-9.,]+)%",
-                re.MULTILINE,
-            )
-
-            for m in pattern.finditer(replied_text):
-                try:
-                    name = m.group('name').strip()
-                    issued = int(m.group('issued'))
-                    checked = int(m.group('checked'))
-                    pct = float(m.group('pct').replace(',', '.'))
-                    problems.append({'name': name, 'issued': issued, 'checked': checked, 'percentage': pct})
-                except Exception:
-                    continue
-
-        # If parsed problems from text, answer locally
-        if problems:
-            q = user_text.lower()
-            # who checked the least
-            if any(w in q for w in ['кто меньше', 'кто меньше всех', 'кто наименее', 'least', 'меньше всех провер']):
-                worst = min(problems, key=lambda x: x.get('percentage', 100.0))
-                await update.message.reply_text(
-                    f"👎 Наименее проверял: {worst['name']} — {worst['checked']}/{worst['issued']} ({worst['percentage']:.1f}%)"
-                )
-                return 'ai'
-
-            # top/bottom N
-            if 'топ' in q or 'первые' in q or 'наиб' in q or 'лучше' in q:
-                sorted_p = sorted(problems, key=lambda x: x.get('percentage', 0.0), reverse=True)
-                n = 5
-                lines = [f"Топ {n} преподавателей по % проверки:"]
-                for t in sorted_p[:n]:
-                    lines.append(f"• {t['name']}: {t['checked']}/{t['issued']} ({t['percentage']:.1f}%)")
-                await update.message.reply_text('\n'.join(lines))
-                return 'ai'
-
-            # count of problem teachers
-            if 'сколько' in q and ('преподав' in q or 'преподавателей' in q or 'сколько' in q):
-                await update.message.reply_text(f"⚠️ Преподавателей с проблемой: {len(problems)}")
-                return 'ai'
-
-            # fallback: send parsed summary + user question to LLM
-            sb = [f"Parsed report (from message):"]
-            sb.append('Teachers with issues:')
-            for t in problems[:50]:
-                sb.append(f"{t['name']}: issued={t['issued']}, checked={t['checked']}, pct={t['percentage']:.1f}")
-            sb.append('\nUser question: ' + user_text)
-            prompt = '\n'.join(sb)
-
-            await update.message.reply_text('🔎 Отправляю запрос в AI с контекстом отчёта...')
-            try:
-                loop = asyncio.get_event_loop()
-                ai_reply = await loop.run_in_executor(None, _call_mistral, prompt)
-            except Exception:
-                logger.exception('Error calling Mistral API')
-                await update.message.reply_text('❌ Ошибка при обращении к AI. Попробуйте позже.')
-                return 'ai'
-
-            if not ai_reply:
-                await update.message.reply_text('❌ AI вернул пустой ответ.')
-                return 'ai'
-
-            max_len = 4000
-            if len(ai_reply) > max_len:
-                ai_reply = ai_reply[: max_len - 20] + '...'
-
-            await update.message.reply_text(ai_reply)
-            await update.message.reply_text(
-                'Готово — выберите следующую опцию:', reply_markup=context.application.bot_data.get('main_keyboard')
-            )
-            context.user_data.clear()
-            return ConversationHandler.END
-
-        # if no structured parsing succeeded, but there is replied_text, forward it as context to LLM
-        if replied_text:
-            prompt = f"Контекст (сообщение):\n{replied_text}\n\nВопрос пользователя: {user_text}"
-            await update.message.reply_text('🔎 Отправляю запрос в AI с контекстом сообщения...')
-            try:
-                loop = asyncio.get_event_loop()
-                ai_reply = await loop.run_in_executor(None, _call_mistral, prompt)
-            except Exception:
-                logger.exception('Error calling Mistral API')
-                await update.message.reply_text('❌ Ошибка при обращении к AI. Попробуйте позже.')
-                return 'ai'
-
-            if not ai_reply:
-                await update.message.reply_text('❌ AI вернул пустой ответ.')
-                return 'ai'
-
-            max_len = 4000
-            if len(ai_reply) > max_len:
-                ai_reply = ai_reply[: max_len - 20] + '...'
-
-            await update.message.reply_text(ai_reply)
-            await update.message.reply_text(
-                'Готово — выберите следующую опцию:', reply_markup=context.application.bot_data.get('main_keyboard')
-            )
-            context.user_data.clear()
-            return ConversationHandler.END
-
-    # General fallback: send the plain text user query to Mistral
-    await update.message.reply_text('🔎 Отправляю запрос в AI, ожидайте...')
+        replied_text = reply_to.text or reply_to.caption or ''
+        report = get_report(chat_id, reply_to.message_id) or query_engine.parse_report_text(replied_text)
+    elif query_engine.names_report(user_text):
+        # без reply — последний отчёт чата, но только если вопрос явно про отчёт
+        report = get_report(chat_id)
+    else:
+        report = None
+
+    if report:
+        intent = query_engine.parse_intent(user_text)
+        local_answer = query_engine.answer(intent, report) if intent else None
+        if local_answer:
+            await update.message.reply_text(local_answer)
+            return 'ai'
+
+    if reply_to and report:
+        # fallback: send structured report rows + user question to LLM
+        prompt = query_engine.report_to_prompt(report) + '\n\nUser question: ' + user_text
+        return await _answer_with_ai(update, context, prompt, '🔎 Отправляю запрос в AI с контекстом отчёта...', question=user_text)
+
+    # if no structured report is known, but there is replied_text, forward it as context to LLM
+    if replied_text:
+        prompt = f"Контекст (сообщение):\n{replied_text}\n\nВопрос пользователя: {user_text}"
+        return await _answer_with_ai(update, context, prompt, '🔎 Отправляю запрос в AI с контекстом сообщения...', question=user_text)
+
+    # General fallback: send the user query to Mistral, with the chat's AI session context if any
+    session = ai_session.get(chat_id)
+    prompt = session.build_prompt(user_text) if session else user_text
+    return await _answer_with_ai(update, context, prompt, '🔎 Отправляю запрос в AI, ожидайте...', question=user_text)
+
+
+def _unavailable_text(e: CircuitOpenError) -> str:
+    return f"⏳ AI временно недоступен (сервис перегружен). Попробуйте через {max(1, round(e.retry_in))} сек."
+
+
+async def _answer_with_ai(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str, notice: str,
+                          question: str) -> str:
+    """Send the prompt to Mistral, reply with the answer and keep the chat's AI session for follow-ups."""
+    status = await update.message.reply_text(notice, reply_markup=progress.cancel_keyboard())
 
     try:
         # asyncio.to_thread is available in Python 3.9+; use run_in_executor for compatibility
         loop = asyncio.get_event_loop()
-        ai_reply = await loop.run_in_executor(None, _call_mistral, user_text)
+        # /cancel или кнопка «Отменить» — ответ AI больше не ждём и не отправляем
+        ai_reply = await progress.track(status, loop.run_in_executor(None, tracing.wrap(_call_mistral), prompt),
+                                        "ожидание ответа AI")
+    except progress.Cancelled:
+        return ConversationHandler.END
+    except CircuitOpenError as e:
+        await update.message.reply_text(_unavailable_text(e))
+        return 'ai'
     except Exception as e:
         logger.exception('Error calling Mistral API')
         await update.message.reply_text('❌ Ошибка при обращении к AI. Попробуйте позже.')
@@ -188,144 +114,220 @@ async def process_ai_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     await update.message.reply_text(ai_reply)
 
-    # Return to main menu
+    if update.effective_chat:
+        session = ai_session.get_or_create(update.effective_chat.id)
+        session.add_turn(question, ai_reply)
+        ai_session.commit(session)
+
+    return await _finish_ai_answer(update, context)
+
+
+async def _finish_ai_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Stay in AI mode so follow-up questions reuse the session, and offer the main menu."""
     await update.message.reply_text(
-        "Готово — выберите следующую опцию:", reply_markup=context.application.bot_data.get("main_keyboard")
+        "Готово — задайте уточняющий вопрос или выберите следующую опцию:",
+        reply_markup=context.application.bot_data.get("main_keyboard"),
     )
-    context.user_data.clear()
-    return ConversationHandler.END
+    context.user_data["report_type"] = "ai"
+    return "ai"
+
+
+AI_BATCH_MODE = os.getenv("AI_BATCH_MODE", "combined")  # combined | per_file
+
+EXCEL_INSTRUCTION = (
+    "Пользователь загрузил Excel-файл. Проанализируй таблицы и дай краткое резюме, "
+    "выдели ключевые столбцы/строки, возможные аномалии, агрегаты и рекомендации.\n\n"
+)
+BATCH_INSTRUCTION = (
+    "Пользователь загрузил несколько Excel-файлов одним альбомом. Проанализируй их вместе: "
+    "дай краткое резюме по каждому, сравни файлы между собой, выдели расхождения, аномалии и рекомендации.\n\n"
+)
+
+
+def _is_excel(filename: str) -> bool:
+    return filename.lower().endswith(readers.SUPPORTED_EXTENSIONS)
+
+
+def _excel_prompt(instruction: str, content: str, user_caption: str) -> str:
+    doc_label = "Excel"
+    prompt = instruction + f"{doc_label} START:\n" + content + f"\n{doc_label} END:\nОтвечай подробно, но лаконично."
+    # Prepend user caption to the prompt so the user can give instructions via file caption
+    if user_caption:
+        prompt = f"Задача от пользователя: {user_caption}\n\n" + prompt
+    return prompt
+
+
+async def _download_and_parse(document) -> Dict[str, pd.DataFrame]:
+    """Download a document to a temp file and read all its sheets (parsing runs in the executor)."""
+    filename = document.file_name or "file"
+    temp_path = f"temp_{document.file_id}_{filename}"
+    try:
+        with tracing.span("telegram.download", file_size=document.file_size):
+            file_obj = await document.get_file()
+            await file_obj.download_to_drive(temp_path)
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                None, tracing.wrap(functools.partial(parse_pool.read_excel, temp_path, sheet_name=None)))
+        except Exception as e:
+            raise RuntimeError(f"Не удалось прочитать Excel: {e}")
+    finally:
+        try:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        except Exception:
+            pass
 
 
 async def process_ai_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
-    """Handle uploaded Excel documents (.xls/.xlsx), extract tables and send to Mistral."""
+    """Handle uploaded Excel documents (.xls/.xlsx/.ods), extract tables and send to Mistral."""
     document = update.message.document if update.message else None
     if not document:
-        await update.message.reply_text("❗ Пожалуйста, загрузите файл Excel (.xls или .xlsx).")
+        await update.message.reply_text("❗ Пожалуйста, загрузите файл Excel (.xls, .xlsx, .ods) или CSV.")
         return "ai"
 
     filename = document.file_name or "file"
-    lower = filename.lower()
-    if not lower.endswith((".xls", ".xlsx")):
-        await update.message.reply_text("❗ Поддерживаются только файлы .xls или .xlsx для анализа.")
+    if not _is_excel(filename):
+        await update.message.reply_text("❗ Поддерживаются только файлы .xls, .xlsx, .ods или .csv для анализа.")
+        return "ai"
+
+    # файлы одного альбома собираем вместе и анализируем одним ответом
+    if update.message.media_group_id:
+        first = media_group.collect(update.message.media_group_id, (update, context), _process_ai_batch)
+        if first:
+            await update.message.reply_text("📥 Получаю файлы альбома, проанализирую их вместе...")
         return "ai"
 
-    await update.message.reply_text("📥 Файл получен, скачиваю и анализирую...")
+    status = await update.message.reply_text("📥 Файл получен, скачиваю и анализирую...",
+                                             reply_markup=progress.cancel_keyboard())
 
     # Use caption (if provided) as user's instruction/prompt for the analysis
     user_caption = update.message.caption.strip() if update.message and update.message.caption else ""
 
-    try:
-        file_obj = await document.get_file()
-        temp_path = f"temp_{document.file_id}_{filename}"
-        await file_obj.download_to_drive(temp_path)
-
-        try:
-            xls = pd.read_excel(temp_path, sheet_name=None)
-        except Exception as e:
-            raise RuntimeError(f"Не удалось прочитать Excel: {e}")
-
-        parts = []
-        for sheet_name, df in xls.items():
-            parts.append(f"--- Sheet: {sheet_name} ---")
-            try:
-                csv = df.to_csv(index=False)
-            except Exception:
-                csv = df.astype(str).to_csv(index=False)
-            parts.append(csv)
-
-        content = "\n".join(parts)
-        instruction = (
-            "Пользователь загрузил Excel-файл. Проанализируй таблицы и дай краткое резюме, "
-            "выдели ключевые столбцы/строки, возможные аномалии, агрегаты и рекомендации.\n\n"
-        )
-        doc_label = "Excel"
+    async def analyze() -> Tuple[ai_session.AISession, str]:
+        xls = await _download_and_parse(document)
 
-        # Truncate content if too large
-        max_content = 15000
-        if len(content) > max_content:
-            content_snippet = content[: max_content - 200] + "\n... (truncated)"
-        else:
-            content_snippet = content
+        # разобранная книга остаётся в сессии чата для уточняющих вопросов
+        session = ai_session.get_or_create(update.effective_chat.id)
+        session.set_workbook(filename, xls)
+        ai_session.commit(session)
 
-        # Prepend user caption to the prompt so the user can give instructions via file caption
-        if user_caption:
-            prompt = f"Задача от пользователя: {user_caption}\n\n" + instruction + f"{doc_label} START:\n" + content_snippet + f"\n{doc_label} END:\nОтвечай подробно, но лаконично."
-        else:
-            prompt = instruction + f"{doc_label} START:\n" + content_snippet + f"\n{doc_label} END:\nОтвечай подробно, но лаконично."
+        prompt = _excel_prompt(EXCEL_INSTRUCTION, session.content, user_caption)
 
+        progress.stage("ожидание ответа AI")
         loop = asyncio.get_event_loop()
-        ai_reply = await loop.run_in_executor(None, _call_mistral, prompt)
+        return session, await loop.run_in_executor(None, tracing.wrap(_call_mistral), prompt)
+
+    try:
+        session, ai_reply = await progress.track(status, analyze(), "чтение файла")
 
         if not ai_reply:
             await update.message.reply_text("❌ AI вернул пустой ответ.")
             return "ai"
 
         await update.message.reply_text(ai_reply)
+        session.add_turn(user_caption or f"Анализ файла {filename}", ai_reply)
+        ai_session.commit(session)
 
+    except progress.Cancelled:
+        return ConversationHandler.END
+    except CircuitOpenError as e:
+        await update.message.reply_text(_unavailable_text(e))
+        return "ai"
     except Exception as e:
         logger.exception("Error calling Mistral API for file")
         await update.message.reply_text(f"❌ Ошибка при анализе файла: {e}")
         return "ai"
-    finally:
-        try:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        except Exception:
-            pass
 
-    await update.message.reply_text(
-        "Готово — выберите следующую опцию:", reply_markup=context.application.bot_data.get("main_keyboard")
-    )
-    context.user_data.clear()
-    return ConversationHandler.END
+    return await _finish_ai_answer(update, context)
 
-def _call_mistral(prompt: str) -> str:
-    """Blocking call to Mistral HTTP API. Returns text or empty string on failure."""
-    session = get_requests_session()
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    data = {
-        "model": MISTRAL_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.6,
-        "max_tokens": 512,
-    }
 
-    try:
-        resp = session.post(MISTRAL_ENDPOINT, json=data, headers=headers, timeout=30)
-    except requests.RequestException as e:
-        raise RuntimeError(f"Network error when calling Mistral API: {e}")
-
-    # Handle 404 specifically
-    if resp.status_code == 404:
-        body = resp.text.strip()
-        raise RuntimeError(
-            f"Mistral API returned 404 Not Found for URL {MISTRAL_ENDPOINT}. "
-            "This usually means the model name or endpoint is incorrect. "
-            "Please verify `MISTRAL_MODEL` or set a correct `MISTRAL_ENDPOINT` environment variable." +
-            (f" Response: {body}" if body else "")
-        )
+async def _process_ai_batch(items: List[Tuple[Update, ContextTypes.DEFAULT_TYPE]]) -> None:
+    """Analyze all documents of one media group: concurrent download/parse, one consolidated reply."""
+    update, context = items[0]
+    message = update.message
+    documents = [u.message.document for u, _ in items]
+    names = [d.file_name or "file" for d in documents]
+    user_caption = next((u.message.caption.strip() for u, _ in items if u.message.caption), "")
 
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        body = resp.text.strip()
-        raise RuntimeError(f"Mistral API error {resp.status_code}: {body or str(e)}")
+    await message.reply_text(f"📚 Получено файлов: {len(documents)}. Скачиваю и анализирую параллельно...")
 
-    try:
-        j = resp.json()
-    except Exception:
-        return resp.text or ""
+    results = await asyncio.gather(*(_download_and_parse(d) for d in documents), return_exceptions=True)
+    parsed: Dict[str, Dict[str, pd.DataFrame]] = {}
+    lines = []
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.warning("Не удалось разобрать файл альбома %s: %s", name, result)
+            lines.append(f"⚠️ {name}: {result}")
+        else:
+            parsed[name] = result
+
+    if not parsed:
+        await _reply_long(message, "\n".join(lines) or "❌ Не удалось прочитать файлы альбома.")
+        return
 
-    # Parse standard Mistral response
-    if isinstance(j, dict) and "choices" in j and isinstance(j["choices"], list) and j["choices"]:
-        choice = j["choices"][0]
-        if isinstance(choice, dict) and "message" in choice and isinstance(choice["message"], dict):
-            return choice["message"].get("content", "")
+    # все книги альбома — в сессию чата, листы подписаны именем файла
+    session = ai_session.get_or_create(update.effective_chat.id)
+    session.set_workbook(", ".join(parsed), {
+        f"{name}: {sheet}": df for name, sheets in parsed.items() for sheet, df in sheets.items()
+    })
+    ai_session.commit(session)
 
-    # Fallback
+    budget = ai_session.MAX_CONTENT_CHARS // len(parsed)
+    contents = {name: ai_session.workbook_to_text(sheets, max_chars=budget) for name, sheets in parsed.items()}
 
-    return j.get("message") if isinstance(j, dict) and "message" in j else ""
+    loop = asyncio.get_event_loop()
+    try:
+        if AI_BATCH_MODE == "per_file":
+            prompts = [_excel_prompt(EXCEL_INSTRUCTION, content, user_caption) for content in contents.values()]
+            replies = await asyncio.gather(*(loop.run_in_executor(None, tracing.wrap(_call_mistral), p) for p in prompts))
+            answer = "\n\n".join(f"📄 {name}\n{reply or '— пустой ответ —'}" for name, reply in zip(contents, replies))
+        else:
+            content = "\n".join(f"=== File: {name} ===\n{text}" for name, text in contents.items())
+            answer = await loop.run_in_executor(None, tracing.wrap(_call_mistral), _excel_prompt(BATCH_INSTRUCTION, content, user_caption))
+    except CircuitOpenError as e:
+        await message.reply_text(_unavailable_text(e))
+        return
+    except Exception as e:
+        logger.exception("Error calling Mistral API for media group")
+        await message.reply_text(f"❌ Ошибка при анализе файлов: {e}")
+        return
+
+    if not answer:
+        await message.reply_text("❌ AI вернул пустой ответ.")
+        return
+
+    lines.append(answer)
+    text = "\n\n".join(lines)
+    await _reply_long(message, text)
+    session.add_turn(user_caption or f"Анализ файлов {', '.join(parsed)}", answer)
+    ai_session.commit(session)
+    await _finish_ai_answer(update, context)
+
+
+async def _reply_long(message, text: str, max_len: int = 4000) -> None:
+    """Send text as few messages as possible, splitting on line boundaries."""
+    chunk = ""
+    for line in text.split("\n"):
+        while len(line) > max_len:
+            if chunk:
+                await message.reply_text(chunk)
+                chunk = ""
+            await message.reply_text(line[:max_len])
+            line = line[max_len:]
+        if len(chunk) + len(line) + 1 > max_len:
+            await message.reply_text(chunk)
+            chunk = line
+        else:
+            chunk = f"{chunk}\n{line}" if chunk else line
+    if chunk:
+        await message.reply_text(chunk)
+
+
+def _call_mistral(prompt: str) -> str:
+    """Blocking call to Mistral HTTP API with retries, circuit breaker and fallback model."""
+    with tracing.span("mistral.call", prompt_chars=len(prompt)) as span:
+        reply = mistral_client.call(prompt)
+        span.set(reply_chars=len(reply or ""))
+        return reply
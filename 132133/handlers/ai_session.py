@@ -0,0 +1,207 @@
+"""Сессии AI-помощника по чатам: разобранная книга Excel + краткая история диалога.
+
+После анализа файла книга (листы и их профиль) остаётся в памяти, и уточняющие
+вопросы используют её без повторной загрузки и разбора. Сессия живёт
+AI_SESSION_TTL секунд с последнего обращения; суммарный размер всех сессий
+ограничен AI_SESSION_MAX_MB — при превышении вытесняются самые давние.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+AI_SESSION_TTL = float(os.getenv("AI_SESSION_TTL", "1800"))
+AI_SESSION_MAX_MB = float(os.getenv("AI_SESSION_MAX_MB", "64"))
+# бюджет токенов на историю диалога, которая добавляется к каждому вопросу
+AI_HISTORY_TOKENS = int(os.getenv("AI_HISTORY_TOKENS", "800"))
+# сколько символов данных книги отправляем в AI (как и раньше в process_ai_file)
+MAX_CONTENT_CHARS = 15000
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка: ~3 символа на токен для смеси кириллицы и цифр."""
+    return len(text) // 3 + 1
+
+
+def profile_workbook(sheets: Dict[str, pd.DataFrame]) -> str:
+    """Компактный профиль книги: размеры листов, типы колонок, пропуски, min/mean/max."""
+    lines = []
+    for sheet_name, df in sheets.items():
+        lines.append(f"Sheet '{sheet_name}': {df.shape[0]} rows x {df.shape[1]} cols")
+        for col in df.columns[:40]:
+            s = df[col]
+            info = f"  - {col}: {s.dtype}, non-null {int(s.notna().sum())}, unique {int(s.nunique(dropna=True))}"
+            if pd.api.types.is_numeric_dtype(s) and s.notna().any():
+                info += f", min {s.min():g}, mean {s.mean():.2f}, max {s.max():g}"
+            lines.append(info)
+        if df.shape[1] > 40:
+            lines.append(f"  ... и ещё {df.shape[1] - 40} колонок")
+    return "\n".join(lines)
+
+
+def workbook_to_text(sheets: Dict[str, pd.DataFrame], max_chars: int = MAX_CONTENT_CHARS) -> str:
+    parts = []
+    for sheet_name, df in sheets.items():
+        parts.append(f"--- Sheet: {sheet_name} ---")
+        try:
+            csv = df.to_csv(index=False)
+        except Exception:
+            csv = df.astype(str).to_csv(index=False)
+        parts.append(csv)
+
+    content = "\n".join(parts)
+    # Truncate content if too large
+    if len(content) > max_chars:
+        content = content[: max(0, max_chars - 200)] + "\n... (truncated)"
+    return content
+
+
+class AISession:
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.filename: Optional[str] = None
+        self.sheets: Dict[str, pd.DataFrame] = {}
+        self.profile = ""
+        self.content = ""
+        self.summary = ""                       # сжатая старая часть диалога
+        self.turns: List[Tuple[str, str]] = []  # последние (вопрос, ответ)
+        self.last_used = time.monotonic()
+        self.size_bytes = 0
+
+    def set_workbook(self, filename: str, sheets: Dict[str, pd.DataFrame]) -> None:
+        self.filename = filename
+        self.sheets = sheets
+        self.profile = profile_workbook(sheets)
+        self.content = workbook_to_text(sheets)
+        self.summary = ""
+        self.turns = []
+        self._resize()
+
+    def add_turn(self, question: str, answer: str) -> None:
+        """Добавить обмен репликами и ужать историю до AI_HISTORY_TOKENS."""
+        self.turns.append((question.strip(), answer.strip()))
+        # старые реплики сворачиваются в сводку по одной строке
+        while len(self.turns) > 1 and self._history_tokens() > AI_HISTORY_TOKENS:
+            q, a = self.turns.pop(0)
+            self.summary = (self.summary + f"\n- Q: {_first_sentence(q)} → A: {_first_sentence(a)}").strip()
+            while estimate_tokens(self.summary) > AI_HISTORY_TOKENS // 2 and "\n" in self.summary:
+                self.summary = self.summary.split("\n", 1)[1]
+        # одна реплика сама больше бюджета — обрезаем ответ
+        if self._history_tokens() > AI_HISTORY_TOKENS:
+            q, a = self.turns[-1]
+            self.turns[-1] = (q[:300], a[: AI_HISTORY_TOKENS * 3 // 2] + "...")
+        self._resize()
+
+    def build_prompt(self, question: str) -> str:
+        parts = []
+        if self.filename:
+            parts.append(f"Пользователь ранее загрузил Excel-файл «{self.filename}».")
+            parts.append("Профиль таблиц:\n" + self.profile)
+            parts.append("Excel START:\n" + self.content + "\nExcel END:")
+        history = self.history_text()
+        if history:
+            parts.append("История диалога:\n" + history)
+        parts.append(f"Вопрос пользователя: {question}")
+        return "\n\n".join(parts)
+
+    def history_text(self) -> str:
+        lines = []
+        if self.summary:
+            lines.append("Ранее:\n" + self.summary)
+        for q, a in self.turns:
+            lines.append(f"Q: {q}\nA: {a}")
+        return "\n".join(lines)
+
+    def _history_tokens(self) -> int:
+        return estimate_tokens(self.history_text())
+
+    def _resize(self) -> None:
+        size = sys.getsizeof(self.profile) + sys.getsizeof(self.content) + sys.getsizeof(self.history_text())
+        for df in self.sheets.values():
+            size += int(df.memory_usage(index=True, deep=True).sum())
+        self.size_bytes = size
+
+
+def _first_sentence(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    for sep in ('. ', '! ', '? ', '\n'):
+        if sep in text:
+            text = text.split(sep, 1)[0]
+            break
+    return text[:limit]
+
+
+_sessions: "OrderedDict[int, AISession]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def get(chat_id: Optional[int]) -> Optional[AISession]:
+    """Живая сессия чата (продлевает TTL) или None."""
+    if chat_id is None:
+        return None
+    with _lock:
+        _expire()
+        session = _sessions.get(chat_id)
+        if session is not None:
+            session.last_used = time.monotonic()
+            _sessions.move_to_end(chat_id)
+        return session
+
+
+def get_or_create(chat_id: int) -> AISession:
+    with _lock:
+        _expire()
+        session = _sessions.get(chat_id)
+        if session is None:
+            session = AISession(chat_id)
+            _sessions[chat_id] = session
+        session.last_used = time.monotonic()
+        _sessions.move_to_end(chat_id)
+        return session
+
+
+def commit(session: AISession) -> None:
+    """Пересчитать общий объём после изменения сессии и вытеснить лишнее."""
+    with _lock:
+        _enforce_cap(keep=session.chat_id)
+
+
+def drop(chat_id: Optional[int]) -> None:
+    with _lock:
+        _sessions.pop(chat_id, None)
+
+
+def total_bytes() -> int:
+    with _lock:
+        return sum(s.size_bytes for s in _sessions.values())
+
+
+def _expire() -> None:
+    now = time.monotonic()
+    for chat_id in [cid for cid, s in _sessions.items() if now - s.last_used > AI_SESSION_TTL]:
+        _sessions.pop(chat_id, None)
+        logger.info("AI session for chat %s expired", chat_id)
+
+
+def _enforce_cap(keep: Optional[int] = None) -> None:
+    limit = int(AI_SESSION_MAX_MB * 1024 * 1024)
+    total = sum(s.size_bytes for s in _sessions.values())
+    for chat_id in list(_sessions.keys()):
+        if total <= limit:
+            break
+        if chat_id == keep:
+            continue
+        total -= _sessions.pop(chat_id).size_bytes
+        logger.info("AI session for chat %s evicted (memory cap %.0f MB)", chat_id, AI_SESSION_MAX_MB)
+    session = _sessions.get(keep)
+    if session is not None and session.size_bytes > limit:
+        # одна книга больше всего лимита: держим только текстовый профиль
+        session.sheets = {}
+        session._resize()
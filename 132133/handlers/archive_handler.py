@@ -0,0 +1,192 @@
+"""Загрузка .zip с выгрузками: каждый файл архива — отдельный отчёт выбранного типа.
+
+Архив не распаковывается целиком: каждый член потоково копируется во временный
+файл непосредственно перед обработкой (в потоке пула report_runner) и удаляется
+сразу после неё. Результат каждого файла отправляется, как только он готов, в
+конце — общая сводка. Размер архива, число файлов и объём распакованных данных
+ограничены (ARCHIVE_MAX_*), в т.ч. по фактически прочитанным байтам — заявленным
+в оглавлении размерам «zip-бомбы» верить нельзя.
+"""
+import os
+import asyncio
+import logging
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from . import tracing, progress
+from .report_runner import PROCESSORS, deliver, executor, run_processor
+from .query_engine import REPORT_SPECS, problem_count
+from .readers import SUPPORTED_EXTENSIONS, sniff
+from .report_store import get_report
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MAX_MB = float(os.getenv("ARCHIVE_MAX_MB", "20"))
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "100"))
+ARCHIVE_MAX_MEMBER_MB = float(os.getenv("ARCHIVE_MAX_MEMBER_MB", "50"))
+ARCHIVE_MAX_TOTAL_MB = float(os.getenv("ARCHIVE_MAX_TOTAL_MB", "300"))
+COPY_CHUNK = 1024 * 1024
+MB = 1024 * 1024
+
+
+class ArchiveError(ValueError):
+    """Архив нельзя обработать; текст показывается пользователю."""
+
+
+@dataclass
+class MemberResult:
+    name: str
+    drafts: List[Tuple[int, str, Optional[str]]]
+    error: Optional[str] = None
+
+
+def _member_name(info: zipfile.ZipInfo) -> str:
+    # без флага UTF-8 имена в zip из Windows записаны в cp866, а zipfile читает их как cp437
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('cp866')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def list_members(zf: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """Таблицы архива (без каталогов и служебных файлов) с проверкой лимитов по оглавлению."""
+    members = []
+    for info in zf.infolist():
+        base = os.path.basename(_member_name(info))
+        if info.is_dir() or not base or base.startswith(('.', '~$')) or info.filename.startswith('__MACOSX/'):
+            continue
+        if not base.lower().endswith(SUPPORTED_EXTENSIONS):
+            continue
+        members.append(info)
+    if not members:
+        raise ArchiveError("❌ В архиве нет таблиц (.xlsx, .xls, .ods, .csv).")
+    if len(members) > ARCHIVE_MAX_MEMBERS:
+        raise ArchiveError(f"❌ В архиве {len(members)} файлов, допускается не больше {ARCHIVE_MAX_MEMBERS}.")
+    too_big = [_member_name(i) for i in members if i.file_size > ARCHIVE_MAX_MEMBER_MB * MB]
+    if too_big:
+        raise ArchiveError(f"❌ Файл {os.path.basename(too_big[0])} больше {ARCHIVE_MAX_MEMBER_MB:g} МБ в распакованном виде.")
+    if sum(i.file_size for i in members) > ARCHIVE_MAX_TOTAL_MB * MB:
+        raise ArchiveError(f"❌ Распакованный архив больше {ARCHIVE_MAX_TOTAL_MB:g} МБ.")
+    return members
+
+
+def _extract(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+    """Скопировать один член архива во временный файл, считая фактически распакованные байты."""
+    suffix = os.path.splitext(_member_name(info))[1].lower()
+    tmp = tempfile.NamedTemporaryFile(prefix="bot_zip_", suffix=suffix, delete=False)
+    written = 0
+    try:
+        with tmp, zf.open(info) as src:
+            while True:
+                chunk = src.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > ARCHIVE_MAX_MEMBER_MB * MB:
+                    raise ArchiveError(f"❌ Файл {os.path.basename(_member_name(info))} больше {ARCHIVE_MAX_MEMBER_MB:g} МБ.")
+                tmp.write(chunk)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+    return tmp.name
+
+
+@tracing.traced("archive.member")
+def process_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, report_type: str, chat_id: int,
+                   user_data: Dict[str, Any]) -> MemberResult:
+    """Распаковать, обработать и удалить один файл архива (выполняется в потоке пула)."""
+    name = os.path.basename(_member_name(info))
+    path = None
+    try:
+        with tracing.span("archive.extract", member=name):
+            path = _extract(zf, info)
+        return MemberResult(name, run_processor(report_type, path, chat_id, user_data))
+    except ArchiveError as e:
+        return MemberResult(name, [], str(e))
+    except Exception:
+        logger.exception("Ошибка обработки %s из архива", name)
+        return MemberResult(name, [], "❌ Ошибка обработки файла. Подробности в логах.")
+    finally:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                logger.warning("Не удалось удалить временный файл: %s", path)
+
+
+def _summary_line(result: MemberResult, chat_id: int) -> str:
+    if result.error:
+        return f"❌ {result.name}: {result.error.lstrip('❌ ')}"
+    # отчёт, сохранённый обработчиком, ищем по id первого подготовленного сообщения
+    report = next((r for r in (get_report(chat_id, d[0]) for d in result.drafts) if r is not None), None)
+    if report is None:
+        return f"⚠️ {result.name}: отчёт не построен"
+    if report['type'] == 'schedule':
+        pairs = sum(r.get('value') or 0 for r in report['rows'])
+        return f"• {result.name}: пар {pairs}, конфликтов {report.get('conflicts', 0)}"
+    return f"• {result.name}: строк {len(report['rows'])}, проблемных {problem_count(report)}"
+
+
+async def process_archive(update: Update, context: ContextTypes.DEFAULT_TYPE, file_path: str, report_type: str) -> None:
+    """Обработать все таблицы архива обработчиком отчёта report_type."""
+    chat_id = update.effective_chat.id
+    if report_type not in PROCESSORS:
+        await update.message.reply_text("❌ Архивы поддерживаются только для отчётов по файлам.")
+        return
+    try:
+        if os.path.getsize(file_path) > ARCHIVE_MAX_MB * MB:
+            raise ArchiveError(f"❌ Архив больше {ARCHIVE_MAX_MB:g} МБ.")
+        if not zipfile.is_zipfile(file_path):
+            raise ArchiveError("❌ Файл не похож на zip-архив.")
+        if sniff(file_path) is not None:
+            # .xlsx и .ods — тоже zip; переименованную таблицу обрабатываем как обычный файл
+            await PROCESSORS[report_type](update, context, file_path)
+            return
+        with zipfile.ZipFile(file_path) as zf:
+            members = list_members(zf)
+            await update.message.reply_text(
+                f"🗂 В архиве {len(members)} файлов, обрабатываю ({REPORT_SPECS[report_type].title})..."
+            )
+            loop = asyncio.get_running_loop()
+            user_data = {k: v for k, v in context.user_data.items() if k == 'hw_check_period'}
+            progress.stage("файлы архива", total=len(members))
+            # файлы архива проверяют отмену, но ход выполнения — по файлам, а не по строкам каждого
+            member = tracing.wrap(progress.wrap(process_member, reports=False))
+            futures = [
+                loop.run_in_executor(executor(), member, zf, info, report_type, chat_id, user_data)
+                for info in members
+            ]
+            summary: List[Tuple[str, str]] = []
+            try:
+                # результат каждого файла отправляем сразу, как он готов
+                for future in asyncio.as_completed(futures):
+                    result = await future
+                    # строку сводки — до отправки: после неё черновики перепривязаны к настоящим сообщениям
+                    summary.append((result.name, _summary_line(result, chat_id)))
+                    if result.error:
+                        await update.message.reply_text(f"📄 {result.name}\n{result.error}")
+                    else:
+                        await deliver(context.bot, chat_id, f"📄 {result.name}", result.drafts)
+                    progress.advance(1)
+            finally:
+                # при отмене ещё не начатые файлы не займут пул
+                for future in futures:
+                    future.cancel()
+
+        ok = sum(1 for _, line in summary if line.startswith('•'))
+        lines = [f"🗂 Итог по архиву: обработано {ok} из {len(summary)}"]
+        lines.extend(line for _, line in sorted(summary))
+        text = "\n".join(lines)
+        for start in range(0, len(text), 4000):
+            await update.message.reply_text(text[start:start + 4000])
+    except ArchiveError as e:
+        await update.message.reply_text(str(e))
+    except zipfile.BadZipFile:
+        await update.message.reply_text("❌ Архив повреждён.")
@@ -1,12 +1,18 @@
 """Обработчик отчета по посещаемости"""
+import re
 import logging
 import pandas as pd
 from telegram import Update
 from telegram.ext import ContextTypes
-from .report_store import send_and_store
+from .report_store import send_and_store, store_report
+from .report_delta import evaluate_incremental, format_delta, chat_scope
+from . import schema, rules
 
 logger = logging.getLogger(__name__)
 
+# всё, кроме цифр, запятой, точки, минуса и знака процента
+NOT_PERCENT_RE = re.compile(r"[^0-9,\.%-]")
+
 async def start_attendance_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Запуск отчета по посещаемости"""
     text = (
@@ -22,69 +28,50 @@ async def start_attendance_report(update: Update, context: ContextTypes.DEFAULT_
 async def process_attendance_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_path: str) -> None:
     """Обработка файла посещаемости"""
     try:
-        df = pd.read_excel(file_path)
-
-        if df.shape[1] < 2:
-            target = update.message if getattr(update, 'message', None) else update.callback_query
-            await (target.reply_text("❌ Файл должен содержать минимум 2 колонки.") if hasattr(target, 'reply_text') else None)
+        try:
+            mapping = schema.infer(file_path, 'attendance')
+        except schema.SchemaError as e:
+            await update.message.reply_text(str(e))
             return
+        df = schema.read(file_path, mapping, roles=('teacher', 'attendance'))
 
-        columns = df.columns.tolist()
-
-        # Ищем колонку с преподавателями и посещаемостью более надёжно
-        teacher_col = None
-        attendance_col = None
-
-        attendance_keywords = ['посещ', 'сред', 'процент', '%', 'присут', 'avg']
-        teacher_keywords = ['преподават', 'учител', 'фио', 'преподав']
-
-        for col in columns:
-            col_lower = str(col).lower()
-            if any(k in col_lower for k in teacher_keywords):
-                teacher_col = col
-            if any(k in col_lower for k in attendance_keywords):
-                attendance_col = col
-
-        # fallback to first two columns
-        if teacher_col is None:
-            teacher_col = columns[0]
-        if attendance_col is None:
-            # try to find a numeric column further right
-            if len(columns) > 1:
-                attendance_col = columns[1]
-            else:
-                attendance_col = columns[0]
+        # колонки преподавателя и посещаемости (см. schema; fallback — первые две колонки)
+        teacher_col = mapping.column('teacher')
+        attendance_col = mapping.column('attendance')
 
         # Попробуем привести колонку посещаемости к числам
         s = df[attendance_col].astype(str).fillna('').str.replace('\xa0', ' ')
         # удалить все кроме цифр, запятой, точек и минуса и процентного знака
-        s_clean = s.str.replace(r"[^0-9,\.%-]", "", regex=True)
+        s_clean = s.str.replace(NOT_PERCENT_RE, "", regex=True)
         # убрать % и привести запятые к точкам
         s_clean = s_clean.str.replace('%', '', regex=False).str.replace(',', '.', regex=False)
         # привести к числу, невалидные -> NaN
         nums = pd.to_numeric(s_clean, errors='coerce')
 
-        problem_teachers = []
-        for idx, row in df.iterrows():
-            try:
-                name = row[teacher_col]
-                if pd.isna(name):
-                    continue
-                name = str(name).strip()
-
-                val = nums.iloc[idx]
-                if pd.isna(val):
-                    # skip rows without numeric attendance
-                    continue
-                attendance = float(val)
-                # if value looks like fraction (0..1), treat as percent
-                if 0.0 <= attendance <= 1.0:
-                    attendance *= 100.0
-
-                if attendance < 40.0:
-                    problem_teachers.append((name, attendance))
-            except Exception:
-                continue
+        def evaluate(row):
+            name = row[teacher_col]
+            if pd.isna(name):
+                return None
+            val = row['__num']
+            if pd.isna(val):
+                # skip rows without numeric attendance
+                return None
+            attendance = float(val)
+            # if value looks like fraction (0..1), treat as percent
+            if 0.0 <= attendance <= 1.0:
+                attendance *= 100.0
+            return {'name': str(name).strip(), 'value': attendance}
+
+        # разбираем заново только строки, изменившиеся с прошлой загрузки (см. report_delta)
+        # правила проблемной строки — свои у каждого чата (см. rules, /rules)
+        ruleset = rules.rules_for(chat_scope(update), 'attendance')
+        frame = pd.DataFrame({teacher_col: df[teacher_col], '__num': nums})
+        rows, delta = evaluate_incremental(
+            chat_scope(update), 'attendance', frame, [teacher_col], evaluate,
+            is_problem=ruleset.row,
+        )
+        flags = ruleset.rows_mask(rows)
+        problem_teachers = [(r['name'], r['value']) for r, bad in zip(rows, flags) if bad]
 
         # Сортировка по посещаемости (от меньшей к большей)
         problem_teachers.sort(key=lambda x: x[1])
@@ -92,16 +79,20 @@ async def process_attendance_file(update: Update, context: ContextTypes.DEFAULT_
         # Формирование простого текстового отчета
         lines = ["📊 Отчет по посещаемости преподавателей:"]
         if problem_teachers:
-            lines.append(f"⚠️ Преподавателей с посещаемостью < 40%: {len(problem_teachers)}")
+            lines.append(f"⚠️ Преподавателей с посещаемостью {ruleset.condition('%')}: {len(problem_teachers)}")
             for name, att in problem_teachers:
                 lines.append(f"• {name}: {att:.1f}%")
         else:
-            lines.append("✅ Все преподаватели имеют посещаемость ≥ 40%.")
+            lines.append(f"✅ Все преподаватели имеют посещаемость {ruleset.passed('%')}.")
+        lines.extend(format_delta(delta, 'attendance'))
 
         text = "\n".join(lines)
 
+        # строки отчёта для уточняющих вопросов (см. query_engine)
+        report = store_report(update, 'attendance', rows, threshold=ruleset.threshold, rules=ruleset)
+
         # Ответить в том же месте, где пришло сообщение
-        await send_and_store(update, context, text, parse_mode=None, metadata={'type': 'attendance'})
+        await send_and_store(update, context, text, parse_mode=None, metadata={'type': 'attendance', 'report': report})
 
     except Exception:
         logger.exception("Ошибка при обработке файла посещаемости")
@@ -0,0 +1,243 @@
+"""Пакетная загрузка: ночные выгрузки LMS из каталога вместо ручной отправки в бот.
+
+Задача JobQueue раз в BATCH_SCAN_INTERVAL секунд просматривает BATCH_DIR. Тип
+каждого нового файла определяется по заголовку (schema.detect_report_type), файл
+обрабатывается тем же обработчиком, что и при ручной загрузке (report_runner), — в
+своём пуле из BATCH_WORKERS потоков (ручные отчёты его не ждут), отдельно для
+каждого подписанного чата (у чатов свои правила, см. rules). Ответ обработчика собирается в память и затем отправляется в чат.
+
+Файлы учитываются по SHA-256 содержимого: одинаковый файл под другим именем второй
+раз не обрабатывается. Хеш пересчитывается только для файлов с новыми размером или
+mtime, поэтому повторный просмотр каталога стоит O(новых файлов). Учёт и подписки
+хранятся в BATCH_STATE_FILE (по умолчанию .batch_state.json в самом каталоге).
+
+Подписка чата: /subscribe, отписка: /unsubscribe; BATCH_CHAT_IDS — постоянные получатели.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+from . import schema, tracing, profiler
+from .query_engine import REPORT_SPECS
+from .readers import SUPPORTED_EXTENSIONS, UnsupportedFormatError
+from .report_runner import deliver, run_processor
+
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = os.getenv("BATCH_DIR", "")
+BATCH_SCAN_INTERVAL = float(os.getenv("BATCH_SCAN_INTERVAL", "300"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_STATE_FILE = os.getenv("BATCH_STATE_FILE", "") or (os.path.join(BATCH_DIR, ".batch_state.json") if BATCH_DIR else "")
+BATCH_CHAT_IDS = {int(x) for x in os.getenv("BATCH_CHAT_IDS", "").replace(';', ',').split(',') if x.strip()}
+# период для отчёта по проверке ДЗ (в ручном режиме его выбирают кнопкой)
+BATCH_HW_CHECK_PERIOD = os.getenv("BATCH_HW_CHECK_PERIOD", "month")
+# файл моложе этого ещё может дописываться — берём его на следующем просмотре
+BATCH_SETTLE_SECONDS = float(os.getenv("BATCH_SETTLE_SECONDS", "30"))
+HASH_CHUNK = 1024 * 1024
+
+_executor: Optional[ThreadPoolExecutor] = None
+_scan_lock = asyncio.Lock()
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class IngestState:
+    """Обработанные файлы (по хешу), кэш stat -> хеш и подписанные чаты."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.seen: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, Tuple[int, int, str]] = {}
+        self.subscribers: Set[int] = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.seen = dict(data.get('seen', {}))
+            self.stats = {p: tuple(v) for p, v in data.get('stats', {}).items()}
+            self.subscribers = set(data.get('subscribers', []))
+        except Exception:
+            logger.exception("Не удалось прочитать состояние пакетной загрузки: %s", self.path)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            data = {'seen': self.seen, 'stats': self.stats, 'subscribers': sorted(self.subscribers)}
+            try:
+                tmp = f"{self.path}.tmp"
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except Exception:
+                logger.exception("Не удалось сохранить состояние пакетной загрузки: %s", self.path)
+
+    def scan(self, directory: str) -> List[Tuple[str, str]]:
+        """Новые файлы каталога: [(путь, хеш)]. Хешируются только файлы с изменившимся stat."""
+        found, batch, alive = [], set(), set()
+        now = time.time()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                if not entry.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    continue
+                st = entry.stat()
+                if now - st.st_mtime < BATCH_SETTLE_SECONDS:
+                    continue
+                alive.add(entry.path)
+                cached = self.stats.get(entry.path)
+                if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                    digest = cached[2]
+                else:
+                    digest = file_digest(entry.path)
+                    self.stats[entry.path] = (st.st_size, st.st_mtime_ns, digest)
+                if digest in self.seen or digest in batch:
+                    continue
+                batch.add(digest)
+                found.append((entry.path, digest))
+        # забываем stat удалённых файлов (хеши в seen остаются — повторная выкладка не обработается)
+        for path in [p for p in self.stats if p not in alive and not os.path.exists(p)]:
+            self.stats.pop(path, None)
+        return sorted(found)
+
+    def mark(self, digest: str, path: str, report_type: Optional[str]) -> None:
+        with self._lock:
+            self.seen[digest] = {'name': os.path.basename(path), 'type': report_type, 'at': int(time.time())}
+
+
+_state: Optional[IngestState] = None
+
+
+def get_state() -> IngestState:
+    global _state
+    if _state is None:
+        _state = IngestState(BATCH_STATE_FILE)
+    return _state
+
+
+def worker_pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+    return _executor
+
+
+def classify(path: str) -> Optional[str]:
+    try:
+        return schema.detect_report_type(schema.probe(path))
+    except UnsupportedFormatError:
+        logger.warning("Batch ingest: %s is not a spreadsheet", path)
+        return None
+    except Exception:
+        logger.exception("Не удалось определить тип файла %s", path)
+        return None
+
+
+@tracing.traced("batch.ingest_file")
+async def _ingest_file(bot, state: IngestState, path: str, digest: str, chats: List[int]) -> None:
+    with profiler.job(f"batch: {os.path.basename(path)}"):
+        await _ingest(bot, state, path, digest, chats)
+
+
+async def _ingest(bot, state: IngestState, path: str, digest: str, chats: List[int]) -> None:
+    loop = asyncio.get_running_loop()
+    name = os.path.basename(path)
+    report_type = await loop.run_in_executor(worker_pool(), tracing.wrap(classify), path)
+    if report_type is None:
+        for chat_id in chats:
+            await deliver(bot, chat_id, f"📂 {name}: не удалось определить тип отчёта, файл пропущен.", [])
+    else:
+        results = await asyncio.gather(
+            *(loop.run_in_executor(worker_pool(), tracing.wrap(run_processor), report_type, path, chat_id,
+                                  {'hw_check_period': BATCH_HW_CHECK_PERIOD})
+              for chat_id in chats),
+            return_exceptions=True,
+        )
+        title = f"📂 Пакетная загрузка: {name} ({REPORT_SPECS[report_type].title})"
+        for chat_id, drafts in zip(chats, results):
+            if isinstance(drafts, BaseException):
+                logger.error("Пакетная обработка %s для чата %s упала", name, chat_id, exc_info=drafts)
+                drafts = [(0, "❌ Ошибка обработки файла. Подробности в логах.", None)]
+            await deliver(bot, chat_id, title, drafts)
+    state.mark(digest, path, report_type)
+    state.save()
+
+
+async def ingest_once(bot, directory: str = BATCH_DIR) -> int:
+    """Один просмотр каталога. Возвращает число обработанных файлов."""
+    state = get_state()
+    chats = sorted(state.subscribers | BATCH_CHAT_IDS)
+    if not chats:
+        # без получателей файлы не помечаем: их получит первый подписавшийся чат
+        return 0
+    loop = asyncio.get_running_loop()
+    new_files = await loop.run_in_executor(None, state.scan, directory)
+    if not new_files:
+        return 0
+    logger.info("Batch ingest: %d new file(s) in %s for %d chat(s)", len(new_files), directory, len(chats))
+    await asyncio.gather(*(_ingest_file(bot, state, path, digest, chats) for path, digest in new_files))
+    return len(new_files)
+
+
+async def scan_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача JobQueue; пропускает запуск, если предыдущий просмотр ещё идёт."""
+    if _scan_lock.locked():
+        return
+    async with _scan_lock:
+        try:
+            await ingest_once(context.bot)
+        except Exception:
+            logger.exception("Ошибка пакетной загрузки из %s", BATCH_DIR)
+
+
+def schedule_jobs(application: Application) -> None:
+    if not BATCH_DIR:
+        return
+    if not os.path.isdir(BATCH_DIR):
+        logger.error("BATCH_DIR does not exist: %s", BATCH_DIR)
+        return
+    if application.job_queue is None:
+        logger.error("Batch ingest needs JobQueue: pip install 'python-telegram-bot[job-queue]'")
+        return
+    application.job_queue.run_repeating(scan_job, interval=BATCH_SCAN_INTERVAL, first=10, name="batch_ingest")
+    logger.info("Batch ingest: watching %s every %.0fs", BATCH_DIR, BATCH_SCAN_INTERVAL)
+
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/subscribe — получать в этот чат результаты пакетной загрузки."""
+    if not BATCH_DIR:
+        await update.message.reply_text("ℹ️ Пакетная загрузка не настроена на сервере (BATCH_DIR).")
+        return
+    state = get_state()
+    state.subscribers.add(update.effective_chat.id)
+    state.save()
+    await update.message.reply_text("✅ Чат подписан на отчёты из пакетной загрузки. Отписаться: /unsubscribe")
+
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/unsubscribe — больше не присылать результаты пакетной загрузки."""
+    state = get_state()
+    state.subscribers.discard(update.effective_chat.id)
+    state.save()
+    await update.message.reply_text("✅ Чат отписан от пакетной загрузки.")
@@ -0,0 +1,117 @@
+"""Сводка по людям из последних отчётов чата (/dashboard).
+
+Посещаемость и проверка ДЗ — по преподавателям, сдача ДЗ и отчёт по студентам —
+по студентам. Имена приводятся к каноническим ключам (см. name_index), записи
+разных отчётов с «тем же» человеком сводятся к одному ключу, после чего все
+отчёты соединяются одним hash-join по ключу (pd.concat по индексу).
+"""
+import logging
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from .name_index import NameIndex, canonical_series
+from .query_engine import REPORT_SPECS
+from .report_store import latest_reports
+
+logger = logging.getLogger(__name__)
+
+# аудитория -> [(тип отчёта, подпись в сводке)]
+DASHBOARD_SOURCES: Dict[str, List[Tuple[str, str]]] = {
+    'Преподаватели': [('attendance', 'посещ.'), ('homework_check', 'проверка ДЗ')],
+    'Студенты': [('homework_submit', 'сдача ДЗ'), ('students', 'классная')],
+}
+MAX_DASHBOARD_LINES = 30
+
+
+def build_dashboard(reports: Dict[str, Dict[str, Any]], sources: List[Tuple[str, str]]) -> pd.DataFrame:
+    """Таблица «человек × отчёт»: индекс — канонический ключ, колонки — значения отчётов.
+
+    Служебные колонки: name (как записано в первом отчёте), group, problems (число просадок),
+    _<подпись>_bad (просадка в этом отчёте).
+    """
+    index = NameIndex()
+    frames, names, groups = [], [], []
+    for report_type, label in sources:
+        report = reports.get(report_type)
+        if not report or not report.get('rows'):
+            continue
+        df = pd.DataFrame(report['rows'])
+        if 'value' not in df.columns or 'name' not in df.columns:
+            continue
+        df['key'] = index.resolve_series(canonical_series(df['name']))
+        df = df[df['key'] != '']
+        if report.get('rules') is not None:
+            # правила чата, с которыми построен отчёт (см. rules)
+            df['bad'] = report['rules'].mask(df)
+        else:
+            df['bad'] = df['value'] < report.get('threshold', REPORT_SPECS[report_type].threshold)
+        by_key = df.groupby('key', sort=False)
+        # у одного человека может быть несколько строк (дубли в выгрузке) — берём худшее значение
+        frames.append(by_key['value'].min().rename(label))
+        frames.append(by_key['bad'].any().rename(f'_{label}_bad'))
+        names.append(by_key['name'].first())
+        if 'group' in df.columns:
+            groups.append(by_key['group'].first())
+
+    if not frames:
+        return pd.DataFrame()
+    table = pd.concat(frames, axis=1)
+    table['name'] = pd.concat(names).groupby(level=0).first()
+    table['group'] = pd.concat(groups).groupby(level=0).first() if groups else ''
+    bad_cols = [c for c in table.columns if str(c).startswith('_')]
+    table['problems'] = table[bad_cols].fillna(False).astype(bool).sum(axis=1)
+    table['sources'] = table[[label for _, label in sources if label in table.columns]].notna().sum(axis=1)
+    table[bad_cols] = table[bad_cols].fillna(False).astype(bool)
+    return table.sort_values(['problems', 'sources', 'name'], ascending=[False, False, True], kind='stable')
+
+
+def format_dashboard(title: str, table: pd.DataFrame, sources: List[Tuple[str, str]]) -> List[str]:
+    labels = [(t, label) for t, label in sources if label in table.columns]
+    lines = [f"👥 {title}: {len(table)}", f"   источники: {', '.join(label for _, label in labels)}"]
+    flagged = table[table['problems'] > 0]
+    lines.append(f"⚠️ С просадками: {len(flagged)} (в нескольких отчётах сразу: {int((flagged['problems'] > 1).sum())})")
+    for key, row in flagged.head(MAX_DASHBOARD_LINES).iterrows():
+        parts = []
+        for report_type, label in labels:
+            value = row[label]
+            if pd.isna(value):
+                parts.append(f"{label} —")
+                continue
+            mark = " ⚠️" if row[f'_{label}_bad'] else ""
+            parts.append(f"{label} {value:.1f}{REPORT_SPECS[report_type].unit}{mark}")
+        group = f" ({row['group']})" if isinstance(row['group'], str) and row['group'] else ""
+        lines.append(f"• {row['name']}{group}: " + " | ".join(parts))
+    if len(flagged) > MAX_DASHBOARD_LINES:
+        lines.append(f"... и ещё {len(flagged) - MAX_DASHBOARD_LINES}")
+    return lines
+
+
+async def dashboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сводка по последним загруженным отчётам чата."""
+    try:
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        reports = latest_reports(chat_id)
+        lines = ["📋 Сводка по последним отчётам", ""]
+        for title, sources in DASHBOARD_SOURCES.items():
+            table = build_dashboard(reports, sources)
+            if table.empty:
+                continue
+            lines.extend(format_dashboard(title, table, sources))
+            lines.append("")
+        if len(lines) == 2:
+            await update.message.reply_text(
+                "ℹ️ Пока нет отчётов для сводки. Загрузите посещаемость, проверку или сдачу ДЗ, "
+                "затем вызовите /dashboard."
+            )
+            return
+
+        text = "\n".join(lines).strip()
+        # Telegram limit is 4096 chars
+        for start in range(0, len(text), 4000):
+            await update.message.reply_text(text[start:start + 4000])
+    except Exception:
+        logger.exception("Ошибка при построении сводки")
+        await update.message.reply_text("❌ Не удалось построить сводку. Подробности в логах.")
@@ -1,14 +1,25 @@
 """Обработчик отчета по темам занятий"""
 import logging
+import numpy as np
 import pandas as pd
 import re
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.helpers import escape_markdown
-from .report_store import send_and_store
+from .report_store import send_and_store, store_report
+from . import schema
 
 logger = logging.getLogger(__name__)
 
+# Регулярное выражение: "Урок № [число]. Тема: [что угодно]"
+# Допускаем: опциональную точку после номера, пробелы вокруг "Тема" и двоеточия.
+# Один проход str.extract: тема корректна, если нашлись и «№», и хвост «Тема: ...»;
+# номер урока берём и из тем в неверном формате ("Урок 10 тема"), чтобы проверить нумерацию
+# (скомпилировано при импорте: prewarm загружает модуль заранее)
+TOPIC_RE = re.compile(r'^Урок\s*(№)?\s*(\d+)(\.?\s*Тема\s*:\s*.)?', re.IGNORECASE)
+# сколько примеров выводить в каждом разделе проверки нумерации
+MAX_NUMBERING_LINES = 30
+
 async def start_lessons_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.callback_query:
         await update.callback_query.edit_message_text(
@@ -16,6 +27,7 @@ async def start_lessons_report(update: Update, context: ContextTypes.DEFAULT_TYP
             "Загрузите файл *Темы уроков.xls*\n\n"
             "Бот проверит формат тем:\n"
             "`Урок № X. Тема: ...`\n"
+            "и нумерацию уроков в каждой группе/дисциплине.\n"
             "Некорректные темы будут перечислены.",
             parse_mode='Markdown'
         )
@@ -27,87 +39,52 @@ async def start_lessons_report(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def process_lessons_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_path: str) -> None:
     try:
-        df = pd.read_excel(file_path, header=0)
-
-        # Находим колонку с темами. По умолчанию 'Тема урока', иначе пытаемся угадать.
-        topic_col = None
-        if 'Тема урока' in df.columns:
-            topic_col = 'Тема урока'
-        else:
-            # Ищем колонку, в имени которой есть 'тема' или похожее, либо первую текстовую колонку
-            for col in df.columns:
-                if isinstance(col, str) and 'тема' in col.lower():
-                    topic_col = col
-                    break
-            if topic_col is None:
-                # Найдём первую колонку с ненулевым количеством строк, которые выглядят как текст
-                for col in df.columns:
-                    sample = df[col].dropna().astype(str).str.strip()
-                    if len(sample) > 0:
-                        topic_col = col
-                        break
-
-        if topic_col is None:
-            await update.message.reply_text("❌ Не удалось определить колонку с темами уроков.")
+        # Находим колонку с темами на каждом листе. По умолчанию 'Тема урока', иначе пытаемся угадать (см. schema).
+        sheets = load_topic_sheets(file_path)
+        if isinstance(sheets, str):
+            await update.message.reply_text(sheets)
             return
 
-        # Берём колонку тем — сохраняем все строки, не удаляя дубликаты, сохраняем исходный порядок
-        topics_series = df[topic_col].astype(str).fillna('').str.strip()
-        if topics_series.dropna().shape[0] == 0 and all(t == '' for t in topics_series):
+        checked = pd.concat([validate_topics(df, sheet) for sheet, df in sheets], ignore_index=True)
+        if (checked['topic'] == '').all():
             await update.message.reply_text("❌ Нет тем уроков в выбранной колонке.")
             return
 
-        # Регулярное выражение: "Урок № [число]. Тема: [что угодно]"
-        # Допускаем: опциональную точку после номера, пробелы вокруг "Тема" и двоеточия
-        pattern = re.compile(r'^Урок\s*№\s*\d+\.?\s*Тема\s*:\s*.+', re.IGNORECASE)
+        multi_sheet = len(sheets) > 1
+        incorrect = checked[~checked['ok']]
+        numbering = numbering_issues(checked)
 
-        correct = []
-        incorrect = []
+        def where(sheet, row_no):
+            return f"[лист {sheet}, строка {row_no}]" if multi_sheet else f"[строка {row_no}]"
 
-        # Собираем все некорректные записи с указанием номера строки в файле
-        for idx, topic in topics_series.items():
-            topic_text = topic if isinstance(topic, str) else str(topic)
-            if pattern.match(topic_text):
-                correct.append(topic_text)
-            else:
-                # номер строки в Excel приблизительно idx + 2 (заголовок + 1)
-                row_no = int(idx) + 2 if hasattr(idx, '__int__') else idx
-                incorrect.append((row_no, topic_text))
+        # строки отчёта для уточняющих вопросов (см. query_engine)
+        rows = checked.rename(columns={'topic': 'name'}).to_dict('records')
 
         report_lines = []
         report_lines.append("📚 Отчет по темам занятий")
         report_lines.append("")
-        report_lines.append(f"✅ Корректных тем: {len(correct)}")
+        report_lines.append(f"✅ Корректных тем: {len(checked) - len(incorrect)}")
         report_lines.append(f"❌ Некорректных тем: {len(incorrect)}")
         report_lines.append("")
 
-        if incorrect:
-            report_lines.append("Примеры некорректных тем (первые 100):")
-            for row_no, topic_text in incorrect[:100]:
-                report_lines.append(f"• [строка {row_no}] {topic_text}")
-            if len(incorrect) > 100:
-                report_lines.append(f"... и ещё {len(incorrect) - 100} некорректных.")
+        # Создаём поток строк с некорректными темами (включая номера строк), затем проверка нумерации
+        if len(incorrect):
+            item_lines = [f"• {where(sheet, row_no)} {topic_text}"
+                          for sheet, row_no, topic_text in zip(incorrect['sheet'], incorrect['row'], incorrect['topic'])]
         else:
-            report_lines.append("🎉 Все темы в правильном формате!")
+            item_lines = ["🎉 Все темы в правильном формате!"]
+        item_lines.extend(format_numbering(numbering, where))
 
-        report = "\n".join(report_lines)
+        # строки отчёта для уточняющих вопросов (см. query_engine)
+        stored = store_report(update, 'lessons', rows)
+        metadata = {'type': 'lessons', 'report': stored}
 
-        # Всегда отправляем ответ в чат. Если список некорректных тем большой — разбиваем на части.
+        # Всегда отправляем ответ в чат. Если список большой — разбиваем на части.
         # Telegram ограничивает длину сообщения ~4096 символов; используем безопасный порог 4000.
         MAX_LEN = 4000
 
-        if not incorrect:
-            # Ничего большого — просто отправляем итог
-            escaped = escape_markdown(report, version=2)
-            await update.message.reply_text(escaped, parse_mode='MarkdownV2')
-            return
-
         # Формируем заголовок (первые строки отчёта)
-        header_lines = report_lines[:5]  # заголовок, пустая строка, 2 строки с подсчётом и пустая
-        header = "\n".join(header_lines) + "\n"
-
-        # Создаём поток строк с некорректными темами (включая номера строк)
-        item_lines = [f"• [строка {row_no}] {topic_text}" for row_no, topic_text in incorrect]
+        header = "\n".join(report_lines) + "\n"
 
         # Собираем и отправляем чанки
         cur = header
@@ -116,7 +93,7 @@ async def process_lessons_file(update: Update, context: ContextTypes.DEFAULT_TYP
             if len(candidate) > MAX_LEN:
                 # отправляем текущий буфер
                 escaped = escape_markdown(cur, version=2)
-                await send_and_store(update, context, escaped, parse_mode='MarkdownV2', metadata={'type': 'lessons'})
+                await send_and_store(update, context, escaped, parse_mode='MarkdownV2', metadata=metadata)
                 # начать новый буфер with header removed
                 cur = line + "\n"
             else:
@@ -125,11 +102,142 @@ async def process_lessons_file(update: Update, context: ContextTypes.DEFAULT_TYP
         # отправляем остаток
         if cur.strip():
             escaped = escape_markdown(cur, version=2)
-            await send_and_store(update, context, escaped, parse_mode='MarkdownV2', metadata={'type': 'lessons'})
+            await send_and_store(update, context, escaped, parse_mode='MarkdownV2', metadata=metadata)
 
     except Exception:
         logger.exception("Ошибка при обработке тем занятий")
         try:
             await update.message.reply_text("❌ Ошибка при чтении файла.")
         except Exception:
-            pass
\ No newline at end of file
+            pass
+
+
+def load_topic_sheets(file_path: str):
+    """[(лист, DataFrame)] со всех листов, где нашлась колонка тем, или текст ошибки.
+
+    Колонки приводятся к 'topic' / 'group' / 'discipline'; листы без колонки тем
+    пропускаются (ошибка — только если таких нет ни одного).
+    """
+    probes = schema.probe(file_path, sheet_name=None)
+    sheets = []
+    first_error = None
+    for sheet, raw in probes.items():
+        if raw.empty:
+            continue
+        try:
+            mapping = schema.infer(file_path, 'lessons', raw=raw)
+        except schema.SchemaError as e:
+            first_error = first_error or str(e)
+            continue
+        # «первая непустая колонка» годится только для первого листа; на остальных нужен заголовок с темой
+        if sheets and not schema.TOPIC_RE.search(mapping.column('topic').lower()):
+            continue
+        roles = ('topic', 'group', 'discipline')
+        df = schema.read(file_path, mapping, roles=roles, sheet_name=sheet)
+        df = df.rename(columns={mapping.column(r): r for r in roles if mapping.column(r) is not None})
+        sheets.append((sheet, df))
+    if not sheets:
+        return first_error or "❌ Не удалось определить колонку с темами уроков."
+    return sheets
+
+
+def validate_topics(df: pd.DataFrame, sheet: str) -> pd.DataFrame:
+    """Проверка формата тем и номер урока — векторно, без цикла по строкам.
+
+    Возвращает колонки: sheet, row (номер строки в файле), topic, ok, number, group, discipline.
+    """
+    # одна и та же программа идёт у многих групп — строки чистим и гоняем через регулярку
+    # только по уникальным темам, затем раскладываем результат обратно по кодам
+    codes, uniques = pd.factorize(df['topic'], use_na_sentinel=False)
+    texts = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    parts = texts.str.extract(TOPIC_RE)
+    ok = parts[0].notna().to_numpy() & parts[2].notna().to_numpy()
+    number = pd.to_numeric(parts[1], errors='coerce').to_numpy()
+
+    # сохраняем все строки, не удаляя дубликаты, в исходном порядке
+    out = pd.DataFrame({
+        'sheet': sheet,
+        # номер строки в Excel: индекс + 2 (заголовок + 1)
+        'row': df.index.to_numpy() + 2,
+        'topic': texts.to_numpy()[codes],
+        'ok': ok[codes],
+        'number': number[codes],
+    })
+    for col in ('group', 'discipline'):
+        if col in df.columns:
+            codes, uniques = pd.factorize(df[col])
+            labels = np.array([str(u).strip() for u in uniques] + [''], dtype=object)
+            out[col] = labels[codes]   # код -1 (пусто) -> последний элемент ''
+        else:
+            out[col] = ''
+    return out
+
+
+def numbering_issues(checked: pd.DataFrame) -> dict:
+    """Дубли, пропуски и нарушение порядка номеров уроков по (лист, группа, дисциплина) за один проход."""
+    keys = ['sheet', 'group', 'discipline']
+    numbered = checked[checked['number'].notna()]
+    if numbered.empty:
+        return {'duplicates': numbered, 'out_of_order': numbered, 'gaps': [], 'gap_count': 0}
+
+    grouped = numbered.groupby(keys, sort=False)['number']
+    # урок с номером меньше уже встречавшегося в этой группе — стоит не по порядку
+    prev_max = grouped.cummax().groupby([numbered[k] for k in keys], sort=False).shift()
+    out_of_order = numbered[numbered['number'] < prev_max]
+    duplicates = numbered[numbered.duplicated(keys + ['number'], keep=False)]
+
+    stats = grouped.agg(['min', 'max', 'nunique'])
+    # номера вроде «Урок 2023» не разворачиваем в тысячи пропусков
+    with_gaps = stats[(stats['max'] - stats['min'] + 1 > stats['nunique']) & (stats['max'] - stats['min'] <= 1000)]
+    gaps = []
+    # списки пропущенных номеров нужны только для групп, которые попадут в отчёт
+    for key, st in with_gaps.head(MAX_NUMBERING_LINES).iterrows():
+        present = grouped.get_group(key).to_numpy()
+        missing = np.setdiff1d(np.arange(int(st['min']), int(st['max']) + 1), present)
+        gaps.append((key, missing.tolist()))
+    return {'duplicates': duplicates, 'out_of_order': out_of_order, 'gaps': gaps, 'gap_count': len(with_gaps)}
+
+
+def _scope(sheet: str, group: str, discipline: str, multi_sheet: bool) -> str:
+    parts = [p for p in (group, discipline) if p]
+    if multi_sheet:
+        parts.insert(0, f"лист {sheet}")
+    return ", ".join(parts)
+
+
+def format_numbering(issues: dict, where) -> list:
+    """Раздел отчёта «Нумерация уроков» (пустой, если нарушений нет)."""
+    duplicates, out_of_order, gaps = issues['duplicates'], issues['out_of_order'], issues['gaps']
+    if duplicates.empty and out_of_order.empty and not gaps:
+        return []
+    multi_sheet = duplicates['sheet'].nunique() > 1 or out_of_order['sheet'].nunique() > 1 or \
+        len({key[0] for key, _ in gaps}) > 1
+    lines = ["", "🔢 Нумерация уроков:"]
+
+    def section(title, items, total=None):
+        total = len(items) if total is None else total
+        if not total:
+            return
+        lines.append(f"{title}: {total}")
+        lines.extend(items[:MAX_NUMBERING_LINES])
+        if total > MAX_NUMBERING_LINES:
+            lines.append(f"... и ещё {total - MAX_NUMBERING_LINES}")
+
+    dup_items = []
+    dup_groups = duplicates.groupby(['sheet', 'group', 'discipline', 'number'], sort=False)['row']
+    for (sheet, group, discipline, number), rows in dup_groups.agg(list).head(MAX_NUMBERING_LINES).items():
+        scope = _scope(sheet, group, discipline, multi_sheet)
+        dup_items.append(f"• Урок {int(number)}{f' ({scope})' if scope else ''}: строки {', '.join(map(str, rows))}")
+    section("🔁 Повторяющиеся номера", dup_items, dup_groups.ngroups)
+
+    gap_items = []
+    for (sheet, group, discipline), missing in gaps:
+        scope = _scope(sheet, group, discipline, multi_sheet)
+        shown = ", ".join(str(n) for n in missing[:20]) + (" ..." if len(missing) > 20 else "")
+        gap_items.append(f"• {scope + ': ' if scope else ''}нет уроков {shown}")
+    section("🕳 Пропуски в нумерации", gap_items, issues['gap_count'])
+
+    order_items = [f"• {where(r.sheet, r.row)} урок {int(r.number)} после урока с большим номером"
+                   for r in out_of_order.head(MAX_NUMBERING_LINES).itertuples(index=False)]
+    section("↕️ Нарушен порядок", order_items, len(out_of_order))
+    return lines
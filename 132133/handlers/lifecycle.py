@@ -0,0 +1,197 @@
+"""Жизненный цикл webhook-процесса: health/readiness и плавная остановка при деплое.
+
+Render при деплое шлёт SIGTERM и через ~30 секунд убивает процесс. Вместо
+Application.run_webhook main запускает свой tornado-сервер (serve_webhook), где
+кроме пути вебхука есть:
+  * GET /healthz — процесс жив (200) и счётчики: обрабатываемые апдейты, очередь
+    апдейтов, клиент Mistral, очередь задач (QUEUE_DB);
+  * GET /readyz — 200, пока бот принимает апдейты, 503 во время остановки.
+
+По SIGTERM процесс перестаёт принимать апдейты: вебхук отвечает 503, и Telegram
+повторит доставку уже новому инстансу. Принятые апдейты и начатая обработка
+доделываются не дольше DRAIN_SECONDS; что не успело — «чекпоинт»: пользователю
+уходит сообщение, что обработка прервана и файл/вопрос надо отправить ещё раз
+(временные файлы удаляют finally-блоки обработчиков при отмене задач). Затем
+сохраняется persistence. Вебхук не удаляется — его перенастроит новый инстанс.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import functools
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# сколько ждать завершения начатой обработки после SIGTERM (Render даёт 30 с)
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", "25"))
+
+CHECKPOINT_TEXT = ("⚠️ Бот перезапускается, обработка прервана. "
+                   "Через минуту отправьте файл или вопрос ещё раз (при необходимости — /start).")
+
+
+@dataclass
+class InFlight:
+    chat_id: Optional[int]
+    what: str
+    started: float = field(default_factory=time.monotonic)
+
+
+_ids = itertools.count(1)
+_inflight: Dict[int, InFlight] = {}
+_draining = False
+_started = time.monotonic()
+
+
+def draining() -> bool:
+    return _draining
+
+
+def tracked(what: str):
+    """Декоратор колбэка PTB: пока он выполняется, апдейт считается «в работе»."""
+    def decorator(callback: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+        @functools.wraps(callback)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            chat = getattr(update, 'effective_chat', None)
+            key = next(_ids)
+            _inflight[key] = InFlight(chat.id if chat else None, what)
+            try:
+                return await callback(update, context)
+            finally:
+                _inflight.pop(key, None)
+        return wrapper
+    return decorator
+
+
+async def health(application: Application) -> Dict[str, Any]:
+    info: Dict[str, Any] = {
+        'status': 'draining' if _draining else 'ok',
+        'uptime_s': round(time.monotonic() - _started, 1),
+        'in_flight': len(_inflight),
+        'oldest_in_flight_s': round(time.monotonic() - min((j.started for j in _inflight.values()),
+                                                           default=time.monotonic()), 1),
+        'updates_queued': application.update_queue.qsize(),
+    }
+    # клиент Mistral — только если уже загружен (не тянем requests ради health-check)
+    mistral = sys.modules.get("handlers.mistral_client")
+    if mistral is not None:
+        info['mistral'] = mistral.get_stats()
+    from . import task_queue, tracing, parse_pool
+    if tracing.enabled():
+        info['tracing'] = tracing.get_stats()
+    if parse_pool.enabled():
+        info['parse_pool'] = parse_pool.get_stats()
+    if task_queue.enabled():
+        try:
+            # SQLite может ждать блокировку воркера — не в цикле событий
+            info['queue'] = await asyncio.to_thread(lambda: task_queue.get_queue().stats())
+        except Exception as e:
+            info['queue'] = {'error': repr(e)}
+    return info
+
+
+async def checkpoint(application: Application) -> None:
+    """Сообщить чатам, чья обработка не успела завершиться до остановки."""
+    chats = {job.chat_id for job in _inflight.values() if job.chat_id is not None}
+    if _inflight:
+        logger.warning("Drain deadline reached, %d updates still in flight: %s", len(_inflight),
+                       ", ".join(sorted({job.what for job in _inflight.values()})))
+    for chat_id in chats:
+        try:
+            await application.bot.send_message(chat_id, CHECKPOINT_TEXT)
+        except Exception:
+            logger.exception("Не удалось предупредить чат %s о перезапуске", chat_id)
+
+
+async def _pending_batches() -> None:
+    # альбомы, ещё ждущие последних файлов, — тоже начатая обработка
+    media_group = sys.modules.get("handlers.media_group")
+    if media_group is not None and media_group.pending():
+        await asyncio.gather(*media_group.pending(), return_exceptions=True)
+
+
+async def drain(application: Application) -> None:
+    """Остановить приём апдейтов и доделать начатое не дольше DRAIN_SECONDS."""
+    global _draining
+    _draining = True
+    started = time.monotonic()
+    logger.info("Draining: %d updates in flight, %d queued", len(_inflight), application.update_queue.qsize())
+    try:
+        # stop() дообрабатывает принятые апдейты, ждёт задачи create_task, останавливает JobQueue
+        # и сохраняет persistence
+        await asyncio.wait_for(asyncio.gather(application.stop(), _pending_batches()), DRAIN_SECONDS)
+        logger.info("Drained in %.1f s", time.monotonic() - started)
+    except asyncio.TimeoutError:
+        await checkpoint(application)
+        if application.persistence:
+            await application.update_persistence()
+
+
+def _web_app(application: Application, url_path: str):
+    import tornado.web
+
+    class WebhookHandler(tornado.web.RequestHandler):
+        async def post(self):
+            if _draining:
+                # Telegram повторит доставку — её примет уже новый инстанс
+                self.set_status(503)
+                return
+            try:
+                update = Update.de_json(json.loads(self.request.body), application.bot)
+            except Exception:
+                logger.exception("Некорректный апдейт в вебхуке")
+                self.set_status(400)
+                return
+            await application.update_queue.put(update)
+
+    class HealthHandler(tornado.web.RequestHandler):
+        async def get(self):
+            self.write(await health(application))
+
+    class ReadyHandler(tornado.web.RequestHandler):
+        def get(self):
+            ready = application.running and not _draining
+            self.set_status(200 if ready else 503)
+            self.write({'ready': ready})
+
+    return tornado.web.Application([
+        (url_path, WebhookHandler),
+        (r"/healthz", HealthHandler),
+        (r"/readyz", ReadyHandler),
+    ])
+
+
+async def serve_webhook(application: Application, listen: str, port: int, url_path: str, webhook_url: str) -> None:
+    """Аналог Application.run_webhook с /healthz, /readyz и плавной остановкой по SIGTERM."""
+    from tornado.httpserver import HTTPServer
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:  # initialize() / shutdown()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        server = HTTPServer(_web_app(application, url_path))
+        server.listen(port, listen)
+        await application.bot.set_webhook(webhook_url, allowed_updates=Update.ALL_TYPES)
+        logger.info("Webhook server listening on %s:%d", listen, port)
+
+        await stop.wait()
+        logger.info("Shutdown signal received")
+        await drain(application)
+        server.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,196 @@
+"""Логирование без форматирования и вывода в цикле событий.
+
+configure() вешает на корневой логгер единственный QueueHandler: вызов logger.info()
+в обработчике только кладёт запись в очередь, а форматирование (включая подстановку
+аргументов) и запись в stdout выполняет поток QueueListener. Каждая запись получает
+контекст текущего апдейта (update_id, chat_id, report_type, у воркера — job_id; см. bind и
+bind_update), при LOG_FORMAT=json выводится одной JSON-строкой.
+
+Подробная диагностика (DEBUG/INFO) отдельных логгеров сэмплируется: LOG_SAMPLE —
+"логгер=доля" через запятую, например
+    LOG_SAMPLE=handlers.homework_submit_handler=0.05,handlers.schema=0.2
+пропускает каждую 20-ю и каждую 5-ю запись этих логгеров (и их потомков).
+WARNING и выше не сэмплируются. Дорогие аргументы (DataFrame.to_string и т.п.)
+оборачиваются в lazy(...) и вычисляются, только если запись действительно выводится, —
+в потоке вызова, когда запись прошла уровень и сэмплирование: объект, на который
+ссылается lazy, обработчик может менять сразу после вызова лога.
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+CONTEXT_FIELDS = ("update_id", "chat_id", "report_type", "job_id")
+
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class lazy:
+    """Аргумент лога, который вычисляется, только если запись выводится (см. _DeferredQueueHandler)."""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn: Callable[[], Any]):
+        self.fn = fn
+
+    def __str__(self) -> str:
+        return str(self.fn())
+
+
+def bind(**fields: Any) -> None:
+    """Добавить поля к контексту записей текущей задачи/потока."""
+    _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def clear() -> None:
+    _context.set({})
+
+
+async def bind_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """TypeHandler (группа -1): контекст логов для всех обработчиков этого апдейта."""
+    if not isinstance(update, Update):
+        return
+    chat = update.effective_chat
+    user_data = context.user_data if update.effective_user else None
+    _context.set({
+        "update_id": update.update_id,
+        "chat_id": chat.id if chat else None,
+        "report_type": user_data.get("report_type") if user_data else None,
+    })
+
+
+class _ContextFilter(logging.Filter):
+    # выполняется в потоке вызова — только там доступен contextvar
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class _SampleFilter(logging.Filter):
+    """Пропускает 1 из N записей DEBUG/INFO логгеров из LOG_SAMPLE."""
+
+    def __init__(self, spec: str):
+        super().__init__()
+        self.every: Dict[str, int] = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, share = item.partition("=")
+            try:
+                rate = float(share)
+            except ValueError:
+                continue
+            self.every[name.strip()] = 0 if rate <= 0 else max(1, round(1 / rate))
+        self.counters: Dict[str, int] = {}
+
+    def _every(self, name: str) -> Optional[int]:
+        while name:
+            if name in self.every:
+                return self.every[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.every:
+            return True
+        every = self._every(record.name)
+        if every is None:
+            return True
+        if every == 0:
+            return False
+        count = self.counters.get(record.name, 0)
+        self.counters[record.name] = count + 1
+        return count % every == 0
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не форматирует запись: это сделает поток слушателя.
+
+    Очередь в памяти процесса, поэтому запись передаётся как есть (args не
+    сериализуются); копия — чтобы фильтры слушателя не меняли чужой объект.
+    Исключение — lazy-аргументы: prepare вызывается в потоке вызова уже после
+    уровня и фильтров, и lazy вычисляется здесь, пока данные ещё не изменились.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        args = record.args
+        if isinstance(args, tuple) and any(isinstance(a, lazy) for a in args):
+            record.args = tuple(str(a) if isinstance(a, lazy) else a for a in args)
+        elif isinstance(args, dict) and any(isinstance(a, lazy) for a in args.values()):
+            record.args = {k: str(a) if isinstance(a, lazy) else a for k, a in args.items()}
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extra = " ".join(f"{k}={getattr(record, k)}" for k in CONTEXT_FIELDS if getattr(record, k, None) is not None)
+        return f"{text} [{extra}]" if extra else text
+
+
+def configure(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, sample: str = LOG_SAMPLE) -> None:
+    """Настроить корневой логгер (один раз на процесс; повторный вызов ничего не делает)."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    # сначала сэмплирование: отброшенной записи контекст не нужен
+    handler.addFilter(_SampleFilter(sample))
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # httpx пишет INFO на каждый запрос к Bot API
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Дописать очередь и остановить поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,55 @@
+"""Сбор документов одного альбома (media_group_id) в одну пачку.
+
+Telegram присылает каждый файл альбома отдельным апдейтом. `collect` складывает
+их по media_group_id и через MEDIA_GROUP_WINDOW секунд после последнего файла
+вызывает обработчик один раз со всей пачкой.
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.5"))
+
+_pending: Dict[str, Dict[str, Any]] = {}
+# ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_tasks: Set[asyncio.Task] = set()
+
+
+def collect(group_id: str, item: Any, on_complete: Callable[[List[Any]], Awaitable[None]]) -> bool:
+    """Добавить элемент в пачку. True — это первый элемент альбома (обработка запланирована)."""
+    loop = asyncio.get_running_loop()
+    entry = _pending.get(group_id)
+    if entry is not None:
+        entry['items'].append(item)
+        entry['deadline'] = loop.time() + MEDIA_GROUP_WINDOW
+        return False
+
+    _pending[group_id] = {'items': [item], 'deadline': loop.time() + MEDIA_GROUP_WINDOW}
+    task = loop.create_task(_flush(group_id, on_complete))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return True
+
+
+def pending() -> Set[asyncio.Task]:
+    """Запланированные обработки альбомов (их ждёт lifecycle.drain при остановке)."""
+    return set(_tasks)
+
+
+async def _flush(group_id: str, on_complete: Callable[[List[Any]], Awaitable[None]]) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        delay = _pending[group_id]['deadline'] - loop.time()
+        if delay <= 0:
+            break
+        await asyncio.sleep(delay)
+
+    items = _pending.pop(group_id)['items']
+    logger.info("Media group %s complete: %d items", group_id, len(items))
+    try:
+        await on_complete(items)
+    except Exception:
+        logger.exception("Ошибка при обработке альбома %s", group_id)
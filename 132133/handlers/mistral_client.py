@@ -0,0 +1,317 @@
+"""HTTP-клиент Mistral: повторы с джиттером, circuit breaker, hedged-запросы и резервная модель.
+
+Все функции блокирующие — вызывать из executor'а (см. `ai_handler._call_mistral`).
+Счётчики и состояние breaker'а доступны через `get_stats()` (в /healthz — lifecycle.health)
+и пишутся в лог при каждой смене состояния breaker'а.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# mistral API конфиг
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY") or "r7JuVl8YKk8pfNPjCxnWzaPw6uNxYmdy"
+MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-large-latest")
+# резервная модель: используется, когда основная недоступна (429/5xx/404 после всех повторов)
+MISTRAL_FALLBACK_MODEL = os.getenv("MISTRAL_FALLBACK_MODEL", "")
+MISTRAL_ENDPOINT = os.getenv(
+    "MISTRAL_ENDPOINT",
+    "https://api.mistral.ai/v1/chat/completions",
+)
+
+MISTRAL_TIMEOUT = float(os.getenv("MISTRAL_TIMEOUT", "30"))
+# общий бюджет времени на один вопрос пользователя (все попытки и паузы)
+MISTRAL_DEADLINE = float(os.getenv("MISTRAL_DEADLINE", "60"))
+MISTRAL_MAX_RETRIES = int(os.getenv("MISTRAL_MAX_RETRIES", "3"))
+MISTRAL_BACKOFF_BASE = float(os.getenv("MISTRAL_BACKOFF_BASE", "0.5"))
+MISTRAL_BACKOFF_MAX = float(os.getenv("MISTRAL_BACKOFF_MAX", "8"))
+# подряд идущих сбоев до размыкания и сколько секунд держать breaker открытым
+MISTRAL_BREAKER_THRESHOLD = int(os.getenv("MISTRAL_BREAKER_THRESHOLD", "5"))
+MISTRAL_BREAKER_COOLDOWN = float(os.getenv("MISTRAL_BREAKER_COOLDOWN", "30"))
+# через сколько секунд без ответа отправлять дублирующий запрос (0 — выключено)
+MISTRAL_HEDGE_AFTER = float(os.getenv("MISTRAL_HEDGE_AFTER", "0"))
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryableError(RuntimeError):
+    """Временный сбой провайдера (сеть, 429, 5xx) — имеет смысл повторить."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelNotFoundError(RuntimeError):
+    """404: неверная модель или endpoint — повторять бессмысленно, но можно сменить модель."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Breaker разомкнут: провайдер недавно падал, запросы не отправляются."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Mistral API temporarily disabled, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Классический breaker closed → open → half_open (одна пробная попытка) → closed."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.retry_in() <= 0:
+                self._set_state('half_open')
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            if self.state != 'closed':
+                self._set_state('closed')
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.opened_total += 1
+                self._set_state('open')
+
+    def _set_state(self, state: str) -> None:
+        with _stats_lock:
+            counters = ", ".join(f"{k}={v}" for k, v in _stats.items())
+        logger.warning("Mistral circuit breaker: %s -> %s (failures=%d, opened_total=%d; %s)",
+                       self.state, state, self.failures, self.opened_total, counters)
+        self.state = state
+
+
+breaker = CircuitBreaker(MISTRAL_BREAKER_THRESHOLD, MISTRAL_BREAKER_COOLDOWN)
+
+_stats = {
+    'calls': 0,
+    'attempts': 0,
+    'retries': 0,
+    'failures': 0,
+    'fallbacks': 0,
+    'hedged': 0,
+    'short_circuited': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _inc(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+
+def get_stats() -> Dict[str, Any]:
+    """Снимок счётчиков и состояния breaker'а (для логов/health-эндпоинта)."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        'breaker_state': breaker.state,
+        'breaker_failures': breaker.failures,
+        'breaker_opened_total': breaker.opened_total,
+        'breaker_retry_in': round(breaker.retry_in(), 1) if breaker.state == 'open' else 0.0,
+    })
+    return stats
+
+
+# Сессия requests на поток: hedged-запросы идут параллельно из разных потоков
+_local = threading.local()
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mistral-hedge")
+
+
+def get_requests_session():
+    """Возвращает кэшированную (на поток) сессию requests для повторного использования соединений."""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _post_once(model: str, prompt: str, timeout: float) -> str:
+    """Одна попытка запроса. Бросает RetryableError / ModelNotFoundError / RuntimeError."""
+    _inc('attempts')
+    session = get_requests_session()
+    headers = {
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.6,
+        "max_tokens": 512,
+    }
+
+    try:
+        resp = session.post(MISTRAL_ENDPOINT, json=data, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        raise RetryableError(f"Network error when calling Mistral API: {e}")
+
+    # Handle 404 specifically
+    if resp.status_code == 404:
+        body = resp.text.strip()
+        raise ModelNotFoundError(
+            f"Mistral API returned 404 Not Found for URL {MISTRAL_ENDPOINT} (model {model}). "
+            "This usually means the model name or endpoint is incorrect. "
+            "Please verify `MISTRAL_MODEL` or set a correct `MISTRAL_ENDPOINT` environment variable." +
+            (f" Response: {body}" if body else "")
+        )
+
+    if resp.status_code in RETRYABLE_STATUSES:
+        raise RetryableError(
+            f"Mistral API error {resp.status_code}: {resp.text.strip()[:200]}",
+            retry_after=_parse_retry_after(resp.headers.get("Retry-After")),
+        )
+
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError as e:
+        body = resp.text.strip()
+        raise RuntimeError(f"Mistral API error {resp.status_code}: {body or str(e)}")
+
+    try:
+        j = resp.json()
+    except Exception:
+        return resp.text or ""
+
+    # Parse standard Mistral response
+    if isinstance(j, dict) and "choices" in j and isinstance(j["choices"], list) and j["choices"]:
+        choice = j["choices"][0]
+        if isinstance(choice, dict) and "message" in choice and isinstance(choice["message"], dict):
+            return choice["message"].get("content", "")
+
+    # Fallback
+    return j.get("message") if isinstance(j, dict) and "message" in j else ""
+
+
+def _post_hedged(model: str, prompt: str, timeout: float) -> str:
+    """Если ответа нет дольше MISTRAL_HEDGE_AFTER секунд — отправить дубль и взять первый успешный."""
+    if MISTRAL_HEDGE_AFTER <= 0 or MISTRAL_HEDGE_AFTER >= timeout:
+        return _post_once(model, prompt, timeout)
+
+    first = _hedge_pool.submit(_post_once, model, prompt, timeout)
+    done, _ = wait([first], timeout=MISTRAL_HEDGE_AFTER)
+    if done:
+        return first.result()
+
+    _inc('hedged')
+    second = _hedge_pool.submit(_post_once, model, prompt, timeout)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                return fut.result()
+            except Exception as e:
+                error = e
+    raise error
+
+
+def _backoff(attempt: int, retry_after: Optional[float]) -> float:
+    """Экспоненциальная пауза с full jitter; Retry-After от сервера имеет приоритет."""
+    delay = random.uniform(0, min(MISTRAL_BACKOFF_MAX, MISTRAL_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, MISTRAL_BACKOFF_BASE)
+    return delay
+
+
+def call(prompt: str) -> str:
+    """Запрос к Mistral с повторами, breaker'ом и переключением на резервную модель."""
+    _inc('calls')
+    deadline = time.monotonic() + MISTRAL_DEADLINE
+
+    models = [MISTRAL_MODEL]
+    if MISTRAL_FALLBACK_MODEL and MISTRAL_FALLBACK_MODEL != MISTRAL_MODEL:
+        models.append(MISTRAL_FALLBACK_MODEL)
+
+    last_error: Optional[Exception] = None
+    for model_no, model in enumerate(models):
+        if model_no > 0:
+            _inc('fallbacks')
+            logger.warning("Switching to fallback Mistral model %s after: %s", model, last_error)
+
+        for attempt in range(MISTRAL_MAX_RETRIES + 1):
+            if not breaker.allow():
+                _inc('short_circuited')
+                raise CircuitOpenError(breaker.retry_in())
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 1:
+                raise last_error or RetryableError("Mistral API deadline exceeded")
+
+            try:
+                text = _post_hedged(model, prompt, min(MISTRAL_TIMEOUT, remaining))
+            except RetryableError as e:
+                _inc('failures')
+                breaker.record_failure()
+                last_error = e
+                if attempt == MISTRAL_MAX_RETRIES:
+                    break
+                delay = _backoff(attempt, e.retry_after)
+                if time.monotonic() + delay >= deadline:
+                    break
+                _inc('retries')
+                logger.info("Mistral attempt %d failed (%s), retrying in %.1fs", attempt + 1, e, delay)
+                time.sleep(delay)
+                continue
+            except ModelNotFoundError as e:
+                # провайдер жив — breaker не трогаем, сразу пробуем резервную модель
+                breaker.record_success()
+                last_error = e
+                break
+            except RuntimeError:
+                # прочие ответы 4xx: провайдер отвечает, проблема в запросе
+                breaker.record_success()
+                raise
+
+            breaker.record_success()
+            return text
+
+    raise last_error
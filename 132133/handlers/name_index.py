@@ -0,0 +1,133 @@
+"""Нормализация ФИО и индекс для сопоставления людей между отчётами.
+
+Одни и те же люди в разных выгрузках записаны по-разному: «Иванов И.И.»,
+«Иванов  Иван Иванович», «ИВАНОВ И. И.», «Иванов Ё.» / «Иванов Е.».
+`canonical` приводит имя к ключу «фамилия инициалы» (ё→е, без точек и лишних
+пробелов). `NameIndex` хранит ключи и блокирующий индекс по n-граммам фамилии:
+нечёткое сравнение (опечатки, обрезанные инициалы) идёт только с кандидатами,
+у которых есть общие n-граммы, а не со всеми ключами подряд.
+"""
+import os
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+NAME_MATCH_THRESHOLD = float(os.getenv("NAME_MATCH_THRESHOLD", "0.85"))
+NGRAM = 3
+# n-граммы вроде «ов » есть у половины фамилий — такие списки кандидатов не раздуваем
+MAX_POSTING = 500
+
+_TRANSLATE = str.maketrans({'ё': 'е', 'Ё': 'Е', '.': ' ', ',': ' ', '\xa0': ' ', '_': ' '})
+
+
+def canonical(name) -> str:
+    """«Иванов Иван Иванович» / «Иванов И.И.» / «И.И. Иванов» -> «иванов ии»."""
+    if name is None or (isinstance(name, float) and pd.isna(name)):
+        return ''
+    tokens = str(name).translate(_TRANSLATE).split()
+    if not tokens:
+        return ''
+    # фамилия — первое слово длиннее одной буквы (инициалы могут стоять впереди)
+    pos = next((i for i, t in enumerate(tokens) if len(t) > 1 and not (t.isupper() and len(t) <= 3)), 0)
+    surname = tokens[pos].casefold()
+    initials = []
+    for t in tokens[:pos] + tokens[pos + 1:]:
+        # «ИИ» без точек — это два инициала, «Иван» — один
+        initials.append(t.casefold() if t.isupper() and len(t) <= 3 else t[0].casefold())
+    return f"{surname} {''.join(initials)}".strip()
+
+
+def canonical_series(names: pd.Series) -> pd.Series:
+    """canonical для колонки: считается по уникальным значениям и раскладывается по кодам."""
+    codes, uniques = pd.factorize(names)
+    keys = pd.Series([canonical(u) for u in uniques] + [''], dtype=object)
+    return pd.Series(keys.to_numpy()[codes], index=names.index)
+
+
+def _split(key: str):
+    surname, _, initials = key.partition(' ')
+    return surname, initials
+
+
+# мужская и женская форма одной фамилии — разные люди: Иванов/Иванова, Бородин/Бородина,
+# Достоевский/Достоевская, Толстой/Толстая
+_GENDER_ENDINGS = (('', 'а'), ('ий', 'ая'), ('ой', 'ая'), ('ый', 'ая'))
+
+
+def _gender_pair(a: str, b: str) -> bool:
+    for male, female in _GENDER_ENDINGS:
+        for x, y in ((a, b), (b, a)):
+            if x.endswith(male) and y.endswith(female) and x[:len(x) - len(male)] == y[:len(y) - len(female)] \
+                    and len(y) > len(female) + 2:
+                return True
+    return False
+
+
+def _initials_compatible(a: str, b: str) -> bool:
+    # полные инициалы с обеих сторон должны совпасть; «и» подходит к «ии», «ип» к «ии» — нет
+    if len(a) >= 2 and len(b) >= 2:
+        return a == b
+    return a.startswith(b) or b.startswith(a)
+
+
+def _grams(surname: str) -> List[str]:
+    padded = f" {surname} "
+    return [padded[i:i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1))]
+
+
+class NameIndex:
+    """Канонические ключи + блокирующий индекс по n-граммам фамилии."""
+
+    def __init__(self, threshold: float = NAME_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.keys: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str) -> str:
+        if key and key not in self._ids:
+            self._ids[key] = len(self.keys)
+            self.keys.append(key)
+            for g in set(_grams(_split(key)[0])):
+                self._postings[g].append(self._ids[key])
+        return key
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Ключ из индекса для того же человека: точное совпадение или единственный нечёткий кандидат."""
+        if not key:
+            return None
+        if key in self._ids:
+            return key
+        surname, initials = _split(key)
+        grams = set(_grams(surname))
+        postings = [self._postings[g] for g in grams if g in self._postings]
+        small = [p for p in postings if len(p) <= MAX_POSTING] or postings
+        hits = Counter(i for p in small for i in p)
+        need = max(1, len(grams) // 2)
+
+        matches = []
+        for idx, count in hits.items():
+            if count < need:
+                continue
+            cand_surname, cand_initials = _split(self.keys[idx])
+            if not _initials_compatible(initials, cand_initials) or _gender_pair(surname, cand_surname):
+                continue
+            if SequenceMatcher(None, surname, cand_surname).ratio() >= self.threshold:
+                matches.append(self.keys[idx])
+        # нечёткое совпадение принимаем, только если кандидат один: из двух похожих не угадываем
+        return matches[0] if len(matches) == 1 else None
+
+    def resolve(self, key: str) -> str:
+        """Ключ существующего человека или новый ключ."""
+        return self.lookup(key) or self.add(key)
+
+    def resolve_series(self, keys: pd.Series) -> pd.Series:
+        """resolve для колонки канонических ключей (каждый уникальный ключ — один раз)."""
+        codes, uniques = pd.factorize(keys)
+        resolved = pd.Series([self.resolve(k) for k in uniques] + [''], dtype=object)
+        return pd.Series(resolved.to_numpy()[codes], index=keys.index)
@@ -0,0 +1,258 @@
+"""Пул процессов для чтения таблиц: разбор xlsx/xls/ods не держит GIL основного процесса.
+
+PARSE_PROCESSES=N (по умолчанию 0 — выключено, файл читается в потоке обработчика)
+включает N постоянных процессов-читателей. Через пул идёт только чтение листа
+(schema.read, чтение файла для AI): сами обработчики отчётов остаются в основном
+процессе — там хранилище отчётов для ответов по reply (report_store), снимки для
+«что изменилось» (report_delta) и правила чатов. Поэтому в процессах пула модули
+обработчиков (их регулярки, очистка колонок) не импортируются: заранее грузятся только
+readers и движки чтения (PRELOAD); PARSE_PRELOAD=handlers.schema,... — добавить свои.
+
+  * Пул создаётся при старте бота (main._post_init → warm()): процессы поднимаются
+    сразу, а не на первом файле. Процессы рождаются от forkserver, в котором уже
+    импортированы pandas и движки чтения (PARSE_START_METHOD=spawn — без этого).
+  * Каждый процесс — отдельный слот (ProcessPoolExecutor на один процесс); чтение
+    уходит в наименее занятый слот. Процесс заменяется новым после
+    PARSE_MAX_TASKS_PER_CHILD чтений или когда его RSS после чтения больше
+    PARSE_MAX_RSS_MB (фрагментация кучи после больших файлов не копится) —
+    заменяется только этот процесс, остальные продолжают работу. Начатые чтения
+    заменённого процесса доделываются.
+  * Раз в PARSE_HEALTH_SECONDS (задача JobQueue) каждый процесс пингуется; не ответил
+    за PARSE_HEALTH_TIMEOUT или сломан (процесс убит OOM killer) — пересоздаётся.
+    Состояние — в /healthz (lifecycle.health).
+
+Отмена (progress) во время чтения освобождает поток сразу, но процесс дочитывает
+файл. Время в процессах пула не попадает в /profile.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import importlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import progress, tracing
+
+logger = logging.getLogger(__name__)
+
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", "0"))
+PARSE_START_METHOD = os.getenv("PARSE_START_METHOD", "forkserver")
+PARSE_MAX_TASKS_PER_CHILD = int(os.getenv("PARSE_MAX_TASKS_PER_CHILD", "50"))
+PARSE_MAX_RSS_MB = float(os.getenv("PARSE_MAX_RSS_MB", "700"))
+PARSE_HEALTH_SECONDS = float(os.getenv("PARSE_HEALTH_SECONDS", "60"))
+PARSE_HEALTH_TIMEOUT = float(os.getenv("PARSE_HEALTH_TIMEOUT", "10"))
+# как часто поток, ждущий чтения, проверяет отмену
+CANCEL_POLL_SECONDS = 0.25
+
+# что импортировать в процессе заранее (в forkserver — один раз на все процессы;
+# отсутствующие модули пропускаются). Движки — см. readers.ENGINE_PREFERENCE
+PRELOAD = ("pandas", "handlers.tracing", "handlers.readers", "handlers.parse_pool", "handlers.logging_setup",
+           "python_calamine", "openpyxl", "xlrd", "odf", "pyxlsb")
+PARSE_PRELOAD = tuple(m.strip() for m in os.getenv("PARSE_PRELOAD", "").split(',') if m.strip())
+
+# слоты: по процессу на слот, busy — сколько чтений сейчас отправлено в слот
+_slots: List[Optional[ProcessPoolExecutor]] = [None] * PARSE_PROCESSES
+_busy: List[int] = [0] * PARSE_PROCESSES
+_lock = threading.Lock()
+_stats: Dict[str, Any] = {'reads': 0, 'recycled': 0, 'failures': 0, 'max_rss_mb': 0.0,
+                          'healthy': None, 'last_ping_ms': None}
+
+
+def enabled() -> bool:
+    return PARSE_PROCESSES > 0
+
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# --- в процессе пула ---
+
+def _init_worker() -> None:
+    from . import logging_setup, readers
+    logging_setup.configure()
+    # движки чтения импортируются лениво внутри pandas — подгружаем их до первого файла;
+    # PARSE_PRELOAD — и при spawn, где forkserver-предзагрузки нет
+    for module in set(readers._ENGINE_MODULES.values()) | set(PARSE_PRELOAD):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def _ping() -> Tuple[int, int]:
+    return os.getpid(), _rss_bytes()
+
+
+def _read(file_path: str, kwargs: Dict[str, Any]) -> Tuple[Any, int]:
+    from . import readers
+    return readers.read_excel(file_path, **kwargs), _rss_bytes()
+
+
+# --- в основном процессе ---
+
+def _context():
+    method = PARSE_START_METHOD
+    if method not in multiprocessing.get_all_start_methods():
+        method = 'spawn'
+    ctx = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        ctx.set_forkserver_preload(list(PRELOAD + PARSE_PRELOAD))
+    return ctx
+
+
+def _new_slot() -> ProcessPoolExecutor:
+    # max_tasks_per_child несовместим с fork — поэтому forkserver/spawn
+    return ProcessPoolExecutor(max_workers=1, mp_context=_context(), initializer=_init_worker,
+                               max_tasks_per_child=PARSE_MAX_TASKS_PER_CHILD or None)
+
+
+def _slot(index: int) -> ProcessPoolExecutor:
+    """Процесс слота index (создаётся при первом обращении); вызывать под _lock."""
+    if _slots[index] is None:
+        _slots[index] = _new_slot()
+    return _slots[index]
+
+
+def _acquire() -> Tuple[int, ProcessPoolExecutor]:
+    """Наименее занятый слот; занятость уменьшает _release."""
+    with _lock:
+        index = min(range(PARSE_PROCESSES), key=lambda i: _busy[i])
+        executor = _slot(index)
+        _busy[index] += 1
+        return index, executor
+
+
+def _release(index: int) -> None:
+    with _lock:
+        _busy[index] = max(0, _busy[index] - 1)
+
+
+def recycle(index: int, old: Optional[ProcessPoolExecutor] = None, reason: str = "") -> None:
+    """Заменить процесс слота index новым (old — только если он всё ещё в слоте)."""
+    with _lock:
+        current = _slots[index]
+        if current is None or (old is not None and current is not old):
+            return  # уже заменён другим потоком
+        _slots[index] = None
+        _stats['recycled'] += 1
+    logger.warning("Parse pool worker %d recycled: %s", index, reason)
+    # без ожидания: начатые чтения доделываются, процесс завершится сам
+    current.shutdown(wait=False)
+
+
+def warm() -> None:
+    """Поднять все процессы пула сразу (в потоке: ждёт, пока процессы импортируют pandas)."""
+    started = time.perf_counter()
+    with _lock:
+        executors = [_slot(i) for i in range(PARSE_PROCESSES)]
+    pids = {f.result()[0] for f in [executor.submit(_ping) for executor in executors]}
+    logger.info("Parse pool warmed: %d processes in %.0f ms", len(pids), (time.perf_counter() - started) * 1000)
+
+
+def check() -> bool:
+    """Пинг каждого процесса; не ответил или сломан — пересоздать только его."""
+    healthy = True
+    for index in range(PARSE_PROCESSES):
+        started = time.perf_counter()
+        with _lock:
+            executor = _slot(index)
+        try:
+            executor, future = _submit(index, executor, _ping)
+            _, rss = future.result(timeout=PARSE_HEALTH_TIMEOUT)
+        except (BrokenProcessPool, TimeoutError) as e:
+            healthy = False
+            recycle(index, executor, f"health check failed: {e!r}")
+            continue
+        _stats['last_ping_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        _note_rss(index, executor, rss)
+    _stats['healthy'] = healthy
+    return healthy
+
+
+async def health_job(context) -> None:
+    await asyncio.to_thread(check)
+
+
+def _note_rss(index: int, executor: ProcessPoolExecutor, rss: int) -> None:
+    mb = rss / 2**20
+    _stats['max_rss_mb'] = round(max(_stats['max_rss_mb'], mb), 1)
+    if PARSE_MAX_RSS_MB and mb > PARSE_MAX_RSS_MB:
+        recycle(index, executor, f"RSS {mb:.0f} MB > {PARSE_MAX_RSS_MB:.0f} MB")
+
+
+def _submit(index: int, executor: ProcessPoolExecutor, fn, *args) -> Tuple[ProcessPoolExecutor, Future]:
+    try:
+        return executor, executor.submit(fn, *args)
+    except RuntimeError:
+        with _lock:
+            if _slots[index] is executor:
+                raise
+            # процесс слота только что заменили из другого потока (recycle) — отправляем в новый
+            executor = _slot(index)
+        return executor, executor.submit(fn, *args)
+def _wait(future: Future) -> Any:
+    # поток обработчика ждёт процесс, но отмену (progress) замечает сразу
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_SECONDS)
+        except TimeoutError:
+            pass
+        except Exception:
+            # после отмены временный файл уже удалён — ошибка чтения тогда не ошибка, а отмена
+            progress.checkpoint()
+            raise
+        try:
+            progress.checkpoint()
+        except progress.Cancelled:
+            future.cancel()
+            raise
+
+
+def read_excel(file_path: str, **kwargs) -> Any:
+    """readers.read_excel в процессе пула (без пула — здесь же)."""
+    from . import readers
+    if not enabled():
+        return readers.read_excel(file_path, **kwargs)
+    index, executor = _acquire()
+    try:
+        with tracing.span("parse_pool.read", nrows=kwargs.get('nrows'), worker=index):
+            try:
+                executor, future = _submit(index, executor, _read, file_path, kwargs)
+                result, rss = _wait(future)
+            except BrokenProcessPool as e:
+                # процесс погиб (OOM killer и т.п.): пересоздаём только его, этот файл читаем здесь
+                with _lock:
+                    _stats['failures'] += 1
+                recycle(index, executor, f"broken: {e}")
+                return readers.read_excel(file_path, **kwargs)
+    finally:
+        _release(index)
+    with _lock:
+        _stats['reads'] += 1
+    _note_rss(index, executor, rss)
+    return result
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        executors = [e for e in _slots if e is not None]
+    alive = sum(1 for e in executors for p in (getattr(e, '_processes', None) or {}).values() if p.is_alive())
+    return dict(_stats, processes=alive, max_processes=PARSE_PROCESSES)
+
+
+def shutdown() -> None:
+    with _lock:
+        executors = [e for e in _slots if e is not None]
+        _slots[:] = [None] * PARSE_PROCESSES
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
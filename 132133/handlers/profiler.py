@@ -0,0 +1,241 @@
+"""Профилирование живого трафика по команде администратора (/profile).
+
+    /profile 5     — следующие 5 обработок отчётов
+    /profile 120s  — все обработки отчётов за 120 секунд
+    /profile stop  — закончить сейчас
+    /profile       — состояние
+
+Команда доступна только пользователям из ADMIN_USER_IDS (id через запятую).
+Пока сеанс активен, каждая обработка отчёта (main.file_handler, файл пакетной
+загрузки) выполняется под cProfile, а в потоках пула (файлы архива, пакетная
+загрузка) — под своим cProfile, статистика складывается в одну. Параллельно
+включён tracemalloc. По окончании в чат администратора приходят документы:
+текстовый отчёт (функции по cumulative time, места выделения памяти по приросту
+и текущему объёму) и .pstats для snakeviz/pstats.
+
+Без активного сеанса job() — одна проверка переменной, профилировщики выключены.
+В раздельном режиме (QUEUE_DB) профилируется только процесс, получивший команду.
+"""
+import io
+import os
+import time
+import marshal
+import pstats
+import asyncio
+import cProfile
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Iterator, List, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+ADMIN_USER_IDS: Set[int] = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if x}
+PROFILE_MAX_JOBS = int(os.getenv("PROFILE_MAX_JOBS", "50"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "1800"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+
+
+@dataclass
+class Session:
+    chat_id: int
+    bot: Any
+    jobs_left: Optional[int]
+    deadline: Optional[float]
+    started: float = field(default_factory=time.monotonic)
+    stats: Optional[pstats.Stats] = None
+    jobs: List[Tuple[str, float]] = field(default_factory=list)
+    baseline: Optional[tracemalloc.Snapshot] = None
+    timer: Optional[asyncio.TimerHandle] = None
+    finishing: bool = False
+
+
+_session: Optional[Session] = None
+_lock = threading.Lock()
+_local = threading.local()
+_tasks: Set[asyncio.Task] = set()
+
+
+def is_admin(update: Update) -> bool:
+    user = update.effective_user
+    return user is not None and user.id in ADMIN_USER_IDS
+
+
+def job(name: str, count: bool = True):
+    """Контекст обработки одного отчёта: под cProfile, если сеанс активен.
+
+    count=False — часть уже учтённой обработки (например, файл архива в потоке пула):
+    статистика добавляется, но в счёт N не идёт.
+    """
+    session = _session
+    if session is None or session.finishing or getattr(_local, 'profiling', False):
+        return nullcontext()
+    if count and session.jobs_left is not None and session.jobs_left <= 0:
+        return nullcontext()  # лимит набран, сеанс вот-вот завершится
+    return _profiled(name, count)
+
+
+@contextmanager
+def _profiled(name: str, count: bool) -> Iterator[None]:
+    profile = cProfile.Profile()
+    _local.profiling = True
+    started = time.perf_counter()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        _local.profiling = False
+        _collect(profile, name, time.perf_counter() - started, count)
+
+
+def _collect(profile: cProfile.Profile, name: str, elapsed: float, count: bool) -> None:
+    with _lock:
+        session = _session
+        if session is None or session.finishing:
+            return
+        if session.stats is None:
+            session.stats = pstats.Stats(profile)
+        else:
+            session.stats.add(profile)
+        if not count:
+            return
+        session.jobs.append((name, elapsed))
+        if session.jobs_left is not None:
+            session.jobs_left -= 1
+            done = session.jobs_left <= 0
+        else:
+            done = False
+    if done:
+        _finish_soon()
+
+
+def _finish_soon() -> None:
+    # счётная обработка всегда идёт в потоке цикла событий (file_handler, пакетная загрузка)
+    try:
+        task = asyncio.get_running_loop().create_task(finish())
+    except RuntimeError:
+        logger.warning("Profiling session reached its job limit outside the event loop")
+        return
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def _parse_args(args: List[str]) -> Tuple[Optional[int], Optional[float]]:
+    """'5' — 5 обработок, '120s' / '2m' — время; по умолчанию 5 обработок."""
+    if not args:
+        return 5, None
+    arg = args[0].lower()
+    if arg.endswith(('s', 'с')):
+        return None, float(arg[:-1])
+    if arg.endswith(('m', 'м')):
+        return None, float(arg[:-1]) * 60
+    return int(arg), None
+
+
+def report(session: Session) -> Tuple[str, Optional[bytes]]:
+    """Текстовый отчёт и дамп .pstats (None, если не было ни одной обработки)."""
+    elapsed = time.monotonic() - session.started
+    lines = [f"Профилирование: {len(session.jobs)} обработок за {elapsed:.0f} с", ""]
+    for name, seconds in session.jobs:
+        lines.append(f"  {name}: {seconds * 1000:.0f} мс")
+    dump = None
+    if session.stats is not None:
+        out = io.StringIO()
+        session.stats.stream = out
+        session.stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP)
+        lines += ["", f"=== Функции по cumulative time (top {PROFILE_TOP}) ===", out.getvalue()]
+        session.stats.stream = None
+        dump = marshal.dumps(session.stats.stats)
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        lines += ["", f"=== Память: сейчас {current / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ ==="]
+        if session.baseline is not None:
+            lines.append("--- Прирост за сеанс по местам выделения ---")
+            for stat in snapshot.compare_to(session.baseline, 'lineno')[:PROFILE_TOP // 2]:
+                lines.append(str(stat))
+        lines.append("--- Крупнейшие места выделения ---")
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP // 2]:
+            lines.append(str(stat))
+    return "\n".join(lines), dump
+
+
+async def finish() -> None:
+    """Остановить сеанс и отправить результаты в чат администратора."""
+    global _session
+    with _lock:
+        session = _session
+        if session is None or session.finishing:
+            return
+        session.finishing = True
+    if session.timer is not None:
+        session.timer.cancel()
+    try:
+        # снимок памяти и форматирование статистики — не в цикле событий
+        text, dump = await asyncio.to_thread(report, session)
+    finally:
+        tracemalloc.stop()
+        with _lock:
+            _session = None
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    try:
+        await session.bot.send_document(session.chat_id, document=text.encode('utf-8'),
+                                        filename=f"profile-{stamp}.txt",
+                                        caption=f"📈 Профиль: {len(session.jobs)} обработок")
+        if dump is not None:
+            await session.bot.send_document(session.chat_id, document=dump, filename=f"profile-{stamp}.pstats")
+    except Exception:
+        logger.exception("Не удалось отправить результаты профилирования")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _session
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+    args = list(context.args or [])
+    if args and args[0].lower() in ('stop', 'стоп'):
+        if _session is None:
+            await update.message.reply_text("ℹ️ Профилирование не запущено.")
+        else:
+            await update.message.reply_text("⏹ Останавливаю, результаты придут сюда.")
+            await finish()
+        return
+    if _session is not None:
+        left = (f"осталось обработок: {_session.jobs_left}" if _session.jobs_left is not None
+                else f"осталось {max(0, _session.deadline - time.monotonic()):.0f} с")
+        await update.message.reply_text(f"⏺ Профилирование уже идёт: собрано {len(_session.jobs)}, {left}. "
+                                        "Остановить: /profile stop")
+        return
+    try:
+        jobs, seconds = _parse_args(args)
+    except ValueError:
+        await update.message.reply_text("Использование: /profile 5 (обработок) | /profile 120s | /profile stop")
+        return
+    if jobs is not None:
+        jobs = max(1, min(jobs, PROFILE_MAX_JOBS))
+    # ограничение по времени есть всегда: сеанс не должен остаться включённым навсегда
+    seconds = max(1.0, min(seconds if seconds is not None else PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS))
+
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    session = Session(update.effective_chat.id, context.bot, jobs, time.monotonic() + seconds,
+                      baseline=tracemalloc.take_snapshot())
+    loop = asyncio.get_running_loop()
+    session.timer = loop.call_later(seconds, _finish_soon)
+    with _lock:
+        _session = session
+    what = f"следующие {jobs} обработок отчётов" if jobs is not None else f"обработки отчётов за {seconds:.0f} с"
+    await update.message.reply_text(f"⏺ Профилирую {what} (cProfile + tracemalloc). Остановить: /profile stop")
+    logger.info("Profiling started by %s: jobs=%s seconds=%.0f", update.effective_user.id, jobs, seconds)
@@ -0,0 +1,214 @@
+"""Отменяемая обработка с ходом выполнения в чате.
+
+Долгая обработка (отчёт по файлу, архив, запрос к AI) выполняется через run() или
+track(): пока она идёт, сообщение «📥 Файл получен, обрабатываю...» раз в
+PROGRESS_EDIT_SECONDS правится — этап, обработано строк из скольких и сколько
+примерно осталось — и под ним кнопка «Отменить». Кнопка или /cancel (main.cancel →
+cancel(chat_id)) отменяет задачу обработчика: он сразу перестаёт ждать результат и
+ничего не отправляет, а код в потоке пула останавливается на ближайшей границе
+порции строк (stage()/advance() поднимают Cancelled) и освобождает поток.
+
+Обработчики отчётов сами про отмену не знают: stage()/advance() вызываются из
+schema.read и report_delta.evaluate_incremental (строки разбираются порциями по
+PROGRESS_CHUNK_ROWS). Вне run()/track() эти вызовы ничего не делают.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EDIT_SECONDS = float(os.getenv("PROGRESS_EDIT_SECONDS", "3"))
+PROGRESS_CHUNK_ROWS = int(os.getenv("PROGRESS_CHUNK_ROWS", "500"))
+
+CANCEL_CALLBACK = "cancel_job"
+CANCELLED_TEXT = "⏹ Обработка отменена."
+BUSY_TEXT = "⏳ Ещё обрабатываю предыдущий запрос. Дождитесь ответа или отмените его: /cancel"
+
+
+class Cancelled(BaseException):
+    """Обработка отменена пользователем.
+
+    BaseException, как и asyncio.CancelledError: обработчики отчётов ловят Exception
+    и отвечают «❌ Ошибка...», а отмена должна пройти сквозь них.
+    """
+
+
+@dataclass(eq=False)
+class Job:
+    chat_id: int
+    status: Any  # сообщение, которое правится ходом выполнения
+    task: Optional[asyncio.Task]
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    by_user: bool = False
+    started: float = field(default_factory=time.monotonic)
+    stage: str = "обработка"
+    stage_started: float = field(default_factory=time.monotonic)
+    done: int = 0
+    total: int = 0
+
+
+# текущая обработка и можно ли из этого места менять её этап (у файлов архива — нельзя)
+_current: contextvars.ContextVar[Optional[Tuple[Job, bool]]] = contextvars.ContextVar("progress_job", default=None)
+_jobs: Dict[int, List[Job]] = {}
+
+
+def cancel_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Отменить", callback_data=CANCEL_CALLBACK)]])
+
+
+def running(chat_id: Optional[int]) -> bool:
+    return bool(_jobs.get(chat_id))
+
+
+def cancel(chat_id: Optional[int]) -> int:
+    """Отменить обработки чата; возвращает, сколько их было."""
+    jobs = _jobs.get(chat_id) or []
+    for job in jobs:
+        job.by_user = True
+        job.cancel_event.set()
+        if job.task is not None:
+            job.task.cancel()
+    if jobs:
+        logger.info("Cancelled %d jobs in chat %s", len(jobs), chat_id)
+    return len(jobs)
+
+
+def checkpoint() -> None:
+    """Поднять Cancelled, если текущую обработку отменили."""
+    current = _current.get()
+    if current is not None and current[0].cancel_event.is_set():
+        raise Cancelled()
+
+
+def stage(name: str, total: int = 0) -> None:
+    """Начать этап обработки (total — сколько строк в нём будет)."""
+    current = _current.get()
+    if current is None:
+        return
+    job, reports = current
+    if job.cancel_event.is_set():
+        raise Cancelled()
+    if reports:
+        job.stage, job.total, job.done, job.stage_started = name, total, 0, time.monotonic()
+
+
+def advance(rows: int) -> None:
+    """Обработано ещё rows строк текущего этапа."""
+    current = _current.get()
+    if current is None:
+        return
+    job, reports = current
+    if job.cancel_event.is_set():
+        raise Cancelled()
+    if reports:
+        job.done += rows
+
+
+def chunks(n: int, size: int = PROGRESS_CHUNK_ROWS) -> Iterator[range]:
+    """Диапазоны позиций 0..n порциями; после каждой порции вызывайте advance(len(part))."""
+    for start in range(0, n, size):
+        yield range(start, min(start + size, n))
+
+
+def wrap(fn: Callable[..., Any], reports: bool = True) -> Callable[..., Any]:
+    """fn для потока пула в контексте текущей обработки (отмена и, если reports, ход выполнения)."""
+    current = _current.get()
+    if current is None:
+        return fn
+    token = _current.set((current[0], reports and current[1]))
+    try:
+        ctx = contextvars.copy_context()
+    finally:
+        _current.reset(token)
+    return functools.partial(ctx.run, fn)
+
+
+def text(job: Job) -> str:
+    elapsed = time.monotonic() - job.started
+    if not job.total:
+        return f"⏳ {job.stage.capitalize()}… {elapsed:.0f} с"
+    done = min(job.done, job.total)
+    line = f"⏳ {job.stage.capitalize()}: {done} из {job.total} ({done * 100 // job.total}%)"
+    spent = time.monotonic() - job.stage_started
+    if 0 < done < job.total and spent > 0:
+        line += f", осталось ~{(job.total - done) * spent / done:.0f} с"
+    return line
+
+
+async def _report(job: Job) -> None:
+    shown = None
+    while True:
+        await asyncio.sleep(PROGRESS_EDIT_SECONDS)
+        current = text(job)
+        if current == shown:
+            continue
+        try:
+            await job.status.edit_text(current, reply_markup=cancel_keyboard())
+            shown = current
+        except Exception as e:
+            # правка — только индикатор; «message is not modified», флуд-лимит и т.п. не мешают обработке
+            logger.debug("Progress edit failed: %s", e)
+
+
+async def _close(job: Job, cancelled: bool) -> None:
+    try:
+        if cancelled:
+            await job.status.edit_text(CANCELLED_TEXT)
+        else:
+            await job.status.edit_reply_markup(reply_markup=None)
+    except Exception as e:
+        logger.debug("Progress close failed: %s", e)
+
+
+async def track(status: Any, awaitable: Awaitable[Any], name: str = "обработка") -> Any:
+    """Дождаться awaitable (в текущей задаче) как отменяемой обработки чата status.chat_id.
+
+    При отмене пользователем поднимает Cancelled (сообщение status уже исправлено на
+    «⏹ Обработка отменена»); отмену самой задачи (остановка бота) пропускает как есть.
+    """
+    job = Job(status.chat_id, status, asyncio.current_task(), stage=name)
+    _jobs.setdefault(job.chat_id, []).append(job)
+    token = _current.set((job, True))
+    reporter = asyncio.create_task(_report(job))
+    cancelled = stopping = False
+    try:
+        return await awaitable
+    except asyncio.CancelledError:
+        job.cancel_event.set()  # код в потоках остановится на ближайшей порции
+        if not job.by_user:
+            stopping = True  # остановка бота: пользователю напишет lifecycle.checkpoint
+            raise
+        job.task.uncancel()
+        cancelled = True
+        raise Cancelled() from None
+    except Cancelled:
+        cancelled = True
+        raise
+    finally:
+        reporter.cancel()
+        _current.reset(token)
+        # до первого await: cancel() уже не найдёт завершённую обработку
+        jobs = _jobs.get(job.chat_id, [])
+        if job in jobs:
+            jobs.remove(job)
+        if not jobs:
+            _jobs.pop(job.chat_id, None)
+        if not stopping:
+            await _close(job, cancelled)
+
+
+async def run(status: Any, executor: Any, fn: Callable[..., Any], *args: Any, name: str = "обработка") -> Any:
+    """Выполнить fn(*args) в потоке executor как отменяемую обработку (см. track)."""
+    async def in_pool():
+        # контекст (текущая обработка, трасса) копируется в поток вместе с вызовом
+        return await asyncio.get_running_loop().run_in_executor(executor, wrap(functools.partial(fn, *args)))
+    return await track(status, in_pool(), name)
@@ -0,0 +1,352 @@
+"""Локальные ответы на уточняющие вопросы по отчётам (без обращения к AI).
+
+Вопрос пользователя разбирается в `Intent` (топ/антитоп N, фильтр по группе или
+имени, новый порог, количество, среднее), после чего `answer` выполняет его над
+структурированными строками отчёта из `report_store`. Если вопрос не распознан,
+`answer` возвращает None и запрос уходит в LLM.
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Callable
+
+# ---------------------------------------------------------------------------
+# Описание типов отчётов
+# ---------------------------------------------------------------------------
+
+
+def _fmt_pct(row: Dict[str, Any]) -> str:
+    group = f" ({row['group']})" if row.get('group') else ""
+    return f"• {row['name']}{group}: {row['value']:.1f}%"
+
+
+def _fmt_check(row: Dict[str, Any]) -> str:
+    return f"• {row['name']}: {row['checked']}/{row['issued']} ({row['value']:.1f}%)"
+
+
+def _fmt_student(row: Dict[str, Any]) -> str:
+    group = f" ({row['group']})" if row.get('group') else ""
+    hw = '-' if row.get('homework') is None else f"{row['homework']:g}"
+    cw = '-' if row.get('classroom') is None else f"{row['classroom']:g}"
+    return f"• {row['name']}{group}: ДЗ {hw} | Класс {cw}"
+
+
+def _fmt_schedule(row: Dict[str, Any]) -> str:
+    return f"• {row['group']} — {row['name']}: {row['value']} пар"
+
+
+def _fmt_lesson(row: Dict[str, Any]) -> str:
+    return f"• [строка {row['row']}] {row['name']}"
+
+
+@dataclass(frozen=True)
+class ReportSpec:
+    title: str
+    entity: str                 # кого перечисляем (для подписи количества)
+    fmt: Callable[[Dict[str, Any]], str]
+    unit: str = '%'
+    threshold: Optional[float] = None   # строка проблемная, если value < threshold
+    has_value: bool = True
+    summable: bool = False      # «сколько» = сумма value, а не число строк
+
+
+REPORT_SPECS: Dict[str, ReportSpec] = {
+    'attendance': ReportSpec('посещаемость преподавателей', 'Преподавателей', _fmt_pct, threshold=40.0),
+    'homework_check': ReportSpec('проверка ДЗ', 'Преподавателей', _fmt_check, threshold=70.0),
+    'homework_submit': ReportSpec('сдача ДЗ', 'Студентов', _fmt_pct, threshold=70.0),
+    'students': ReportSpec('студенты (классная работа)', 'Студентов', _fmt_student, unit='', threshold=3.0),
+    'schedule': ReportSpec('расписание', 'Пар', _fmt_schedule, unit='', summable=True),
+    'lessons': ReportSpec('темы занятий', 'Некорректных тем', _fmt_lesson, has_value=False),
+}
+
+# ---------------------------------------------------------------------------
+# Разбор вопроса
+# ---------------------------------------------------------------------------
+
+# слова — с границами: «последние новости» или «топливо» — не запрос к отчёту
+_BOTTOM_RE = re.compile(r"\b(?:кто\s+меньше|меньше\s+всех|наимен\w*|худш\w*|хуже\s+всех|ниже\s+всех|"
+                        r"аутсайдер\w*|последн\w*\s+\d+|least|worst|bottom)\b", re.IGNORECASE)
+_TOP_RE = re.compile(r"\b(?:топ|лучш\w*|наибол\w*|больше\s+всех|выше\s+всех|первые\s+\d+|best|top)\b", re.IGNORECASE)
+_AVG_RE = re.compile(r"\b(?:средн\w*|average|avg)\b", re.IGNORECASE)
+_COUNT_RE = re.compile(r"\b(?:сколько|количеств\w*|how\s+many)\b", re.IGNORECASE)
+_LIST_RE = re.compile(r"\b(?:покажи|список|выведи|перечисли|какие|list)\b", re.IGNORECASE)
+# просьба что-то написать/объяснить — это задача для AI, даже если в ней есть «сколько» или фамилия
+_FREEFORM_RE = re.compile(r"^\W*(?:напиши|расскажи|объясни|составь|придумай|переведи|сочини|помоги|опиши)\b",
+                          re.IGNORECASE)
+# отчёт или показатель, названный в вопросе (без reply только такие вопросы идут в последний отчёт)
+_REPORT_RE = re.compile(r"%|\b(?:отч[её]т\w*|посещаем\w*|дз|домашн\w*|провер\w*|сдач\w*|сдал\w*|"
+                        r"расписани\w*|пар[аыу]?|тем[аыу]?|некорректн\w*|нумерац\w*|классн\w*|оценк\w*|"
+                        r"балл\w*|процент\w*|порог\w*|накладк\w*)\b", re.IGNORECASE)
+
+_THRESHOLD_RE = re.compile(
+    r"(?P<op><=|>=|<|>|ниже|выше|меньше|больше|менее|более|порог\w*(?:\s+в)?)\s*"
+    r"(?P<val>\d+(?:[.,]\d+)?)\s*%?",
+    re.IGNORECASE,
+)
+_N_RE = re.compile(r"(?<![\d.,])(\d{1,3})(?![\d.,%])")
+_GROUP_RE = re.compile(r"групп\w*\s+[\"«]?(?P<group>[\w\-./]*\d[\w\-./]*)", re.IGNORECASE)
+_NAME_RE = re.compile(
+    r"(?:\bпреподавател\w*|\bучител\w*|\bстудент\w*|\bу|\bпо)\s+(?P<name>[А-ЯЁA-Z][\w\-]+)"
+)
+
+_OPS = {
+    '<': lambda v, t: v < t,
+    '<=': lambda v, t: v <= t,
+    '>': lambda v, t: v > t,
+    '>=': lambda v, t: v >= t,
+}
+
+
+@dataclass
+class Intent:
+    action: str                         # top | bottom | count | avg | list
+    n: Optional[int] = None
+    threshold: Optional[float] = None
+    op: str = '<'
+    group: Optional[str] = None
+    name: Optional[str] = None
+
+
+def parse_intent(text: str) -> Optional[Intent]:
+    """Разобрать вопрос пользователя. None — вопрос не про отчёт (пусть отвечает AI)."""
+    q = text.strip()
+    low = q.lower()
+    if _FREEFORM_RE.search(q):
+        return None
+
+    threshold = None
+    op = '<'
+    m = _THRESHOLD_RE.search(low)
+    if m:
+        threshold = float(m.group('val').replace(',', '.'))
+        word = m.group('op')
+        if word in ('>', '>=', '<='):
+            op = word
+        elif word in ('выше', 'больше', 'более'):
+            op = '>'
+        low_wo_threshold = low[:m.start()] + ' ' + low[m.end():]
+    else:
+        low_wo_threshold = low
+
+    group = None
+    gm = _GROUP_RE.search(q)
+    if gm:
+        group = gm.group('group')
+
+    name = None
+    nm = _NAME_RE.search(q)
+    if nm:
+        name = nm.group('name')
+
+    if _BOTTOM_RE.search(low):
+        action = 'bottom'
+    elif _TOP_RE.search(low):
+        action = 'top'
+    elif _AVG_RE.search(low):
+        action = 'avg'
+    elif _COUNT_RE.search(low):
+        action = 'count'
+    elif threshold is not None or group or name or _LIST_RE.search(low):
+        action = 'list'
+    else:
+        return None
+
+    n = None
+    if action in ('top', 'bottom'):
+        scan = _GROUP_RE.sub(' ', low_wo_threshold)
+        nm_ = _N_RE.search(scan)
+        if nm_:
+            n = max(1, int(nm_.group(1)))
+        elif action == 'bottom' and re.search(r"\bкто\b", low):  # «кто меньше всех» — один человек
+            n = 1
+        else:
+            n = 5
+
+    return Intent(action=action, n=n, threshold=threshold, op=op, group=group, name=name)
+
+
+def names_report(text: str) -> bool:
+    """Вопрос сам называет отчёт или показатель (процент, группу, ДЗ...).
+
+    Без reply локально отвечаем только на такие вопросы — по последнему отчёту чата;
+    остальное («Сколько будет 2+2?») уходит в AI вместе с историей сессии.
+    """
+    return bool(_REPORT_RE.search(text) or _GROUP_RE.search(text))
+
+# ---------------------------------------------------------------------------
+# Выполнение запроса
+# ---------------------------------------------------------------------------
+
+
+_CASE_ENDINGS = ('ой', 'ым', 'ом', 'ей', 'а', 'у', 'е', 'ы', 'ю')
+
+
+def _name_matches(row_name: str, wanted: str) -> bool:
+    """Совпадение по основе слова: «Иванова» / «Иванову» находят «Иванов И.И.»."""
+    stem = wanted.casefold()
+    for ending in _CASE_ENDINGS:
+        if len(stem) - len(ending) >= 4 and stem.endswith(ending):
+            stem = stem[: -len(ending)]
+            break
+    return stem in row_name.casefold()
+
+
+def _is_problem(spec: ReportSpec, report: Dict[str, Any], row: Dict[str, Any], intent: Intent) -> bool:
+    if not spec.has_value:
+        return not row.get('ok', False)
+    value = row.get('value')
+    if value is None:
+        return False
+    if intent.threshold is not None:
+        return _OPS[intent.op](value, intent.threshold)
+    # правила чата, с которыми отчёт был построен (см. rules)
+    if report.get('rules') is not None:
+        return report['rules'].row(row)
+    threshold = report.get('threshold', spec.threshold)
+    if report['type'] == 'students' and row.get('homework') == 1:
+        return True
+    return threshold is not None and value < threshold
+
+
+def problem_count(report: Dict[str, Any]) -> Optional[int]:
+    """Число проблемных строк отчёта по его порогу/правилам (None для неизвестного типа)."""
+    spec = REPORT_SPECS.get(report.get('type'))
+    if spec is None:
+        return None
+    intent = Intent(action='count')
+    return sum(1 for r in report.get('rows') or [] if _is_problem(spec, report, r, intent))
+
+
+def _cut(lines: List[str], limit: int = 50) -> List[str]:
+    if len(lines) > limit:
+        return lines[:limit] + [f"... и ещё {len(lines) - limit}"]
+    return lines
+
+
+def answer(intent: Intent, report: Dict[str, Any]) -> Optional[str]:
+    """Выполнить запрос над строками отчёта. None — ответить локально нельзя."""
+    spec = REPORT_SPECS.get(report.get('type'))
+    if spec is None:
+        return None
+
+    rows = report.get('rows') or []
+    scope = []
+    if intent.group:
+        g = intent.group.casefold()
+        rows = [r for r in rows if g in str(r.get('group', '')).casefold()]
+        scope.append(f"группа {intent.group}")
+    if intent.name:
+        rows = [r for r in rows if _name_matches(str(r.get('name', '')), intent.name)
+                or (report['type'] == 'schedule' and _name_matches(str(r.get('group', '')), intent.name))]
+        scope.append(intent.name)
+    scope_text = f" ({', '.join(scope)})" if scope else ""
+
+    if not rows:
+        if intent.group or intent.name:
+            return None  # «по Python» — не строка отчёта: пусть отвечает AI
+        return f"🔎 По запросу{scope_text} в отчёте ничего не найдено."
+
+    if intent.action in ('top', 'bottom'):
+        if not spec.has_value:
+            return None
+        valued = [r for r in rows if r.get('value') is not None]
+        valued.sort(key=lambda r: r['value'], reverse=intent.action == 'top')
+        picked = valued[: intent.n]
+        if intent.n == 1 and picked:
+            prefix = "👍 Лучший результат" if intent.action == 'top' else "👎 Худший результат"
+            return f"{prefix}{scope_text}:\n{spec.fmt(picked[0])}"
+        head = "Топ" if intent.action == 'top' else "Последние"
+        lines = [f"{head} {len(picked)} — {spec.title}{scope_text}:"]
+        lines.extend(spec.fmt(r) for r in picked)
+        return "\n".join(lines)
+
+    if intent.action == 'avg':
+        values = [r['value'] for r in rows if r.get('value') is not None]
+        if not spec.has_value or not values:
+            return None
+        avg = sum(values) / len(values)
+        return f"📈 Среднее{scope_text}: {avg:.1f}{spec.unit} (по {len(values)} записям)"
+
+    if spec.summable and intent.action == 'count' and intent.threshold is None:
+        total = sum(r.get('value') or 0 for r in rows)
+        return f"📊 {spec.entity}{scope_text}: {total}"
+
+    problems = [r for r in rows if _is_problem(spec, report, r, intent)]
+    if intent.threshold is not None:
+        cond = f" ({intent.op} {intent.threshold:g}{spec.unit})"
+    elif report.get('rules') is not None:
+        cond = f" ({report['rules'].condition(spec.unit)})"
+    elif spec.threshold is not None:
+        cond = f" (< {report.get('threshold', spec.threshold):g}{spec.unit})"
+    else:
+        cond = ""
+
+    if intent.action == 'count':
+        return f"⚠️ {spec.entity}{cond}{scope_text}: {len(problems)} из {len(rows)}"
+
+    # list; для конкретного человека показываем его строки независимо от порога
+    if intent.name and intent.threshold is None:
+        problems, cond = rows, ""
+    if not problems:
+        return f"✅ Нет записей{cond}{scope_text}."
+    problems.sort(key=lambda r: (r.get('value') is None, r.get('value') or 0))
+    lines = [f"⚠️ {spec.entity}{cond}{scope_text}: {len(problems)}"]
+    lines.extend(_cut([spec.fmt(r) for r in problems]))
+    return "\n".join(lines)
+
+# ---------------------------------------------------------------------------
+# Отчёт из текста сообщения (если строки отчёта не сохранены, например после рестарта)
+# ---------------------------------------------------------------------------
+
+# • Name: Получено 10 | Проверено 7 | 70.0%
+_CHECK_LINE_RE = re.compile(
+    r"^[•\-\*]?\s*(?P<name>[^:\n]+):\s*[Пп]олучено\s*(?P<issued>[0-9]+)\s*\|\s*"
+    r"[Пп]роверено\s*(?P<checked>[0-9]+)\s*\|\s*(?P<pct>[0-9.,]+)%",
+    re.MULTILINE,
+)
+# • Name (group): 55.0%
+_PCT_LINE_RE = re.compile(
+    r"^[•\-\*]\s*(?P<name>[^:(\n]+?)(?:\s*\((?P<group>[^)\n]*)\))?:\s*(?P<pct>[0-9.,]+)%\s*$",
+    re.MULTILINE,
+)
+
+
+def parse_report_text(text: str) -> Optional[Dict[str, Any]]:
+    """Восстановить строки отчёта из текста сообщения бота."""
+    if not text:
+        return None
+
+    rows = []
+    for m in _CHECK_LINE_RE.finditer(text):
+        rows.append({
+            'name': m.group('name').strip(),
+            'issued': int(m.group('issued')),
+            'checked': int(m.group('checked')),
+            'value': float(m.group('pct').replace(',', '.')),
+        })
+    if rows:
+        return {'type': 'homework_check', 'rows': rows}
+
+    for m in _PCT_LINE_RE.finditer(text):
+        try:
+            value = float(m.group('pct').replace(',', '.'))
+        except ValueError:
+            continue
+        rows.append({'name': m.group('name').strip(), 'group': (m.group('group') or '').strip(), 'value': value})
+    if rows:
+        report_type = 'attendance' if 'посещаем' in text.lower() else 'homework_submit'
+        return {'type': report_type, 'rows': rows}
+
+    return None
+
+
+def report_to_prompt(report: Dict[str, Any], limit: int = 50) -> str:
+    """Краткое текстовое представление строк отчёта для контекста LLM."""
+    spec = REPORT_SPECS.get(report.get('type'))
+    title = spec.title if spec else report.get('type', 'отчёт')
+    rows = report.get('rows') or []
+    lines = [f"Report: {title}, rows: {len(rows)}"]
+    fmt = spec.fmt if spec else (lambda r: str(r))
+    lines.extend(fmt(r) for r in rows[:limit])
+    if len(rows) > limit:
+        lines.append(f"... ({len(rows) - limit} more rows)")
+    return "\n".join(lines)
@@ -0,0 +1,294 @@
+"""Чтение таблиц: формат определяется по сигнатуре файла, а не по расширению.
+
+Временные файлы бота всегда сохраняются с одним суффиксом, а пользователи
+присылают и старые .xls (BIFF/OLE2), и .xlsx, и .ods, и CSV/TSV. `sniff` смотрит
+первые байты (и оглавление zip), `engine_for` выбирает самый быстрый из доступных
+движков для этого формата, `read_excel` — замена pd.read_excel для всех
+обработчиков. Порядок предпочтения — ENGINE_PREFERENCE; переопределить
+можно переменной READER_ENGINE (например, READER_ENGINE=openpyxl).
+
+CSV/TSV читаются без zip+XML: кодировка (utf-8/cp1251) и разделитель
+определяются по началу файла, сам файл — одним pd.read_csv (C-парсер, только
+нужные колонки через usecols).
+"""
+import os
+import csv
+import logging
+import zipfile
+import threading
+import importlib.util
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+READER_ENGINE = os.getenv("READER_ENGINE", "").strip().lower() or None
+
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+
+# расширения, которые принимают обработчики загрузки (сам формат всё равно определяет sniff)
+SUPPORTED_EXTENSIONS = (".xls", ".xlsx", ".ods", ".csv", ".tsv", ".txt")
+
+CSV_SNIFF_BYTES = 64 * 1024
+# сколько файлов помнить в _failed_engines
+FAILED_ENGINES_MAX = 256
+CSV_DELIMITERS = ",;\t|"
+
+# формат -> движки от быстрого к медленному
+ENGINE_PREFERENCE: Dict[str, List[str]] = {
+    'xlsx': ['calamine', 'openpyxl'],
+    'xls': ['calamine', 'xlrd'],
+    'ods': ['calamine', 'odf'],
+    'xlsb': ['calamine', 'pyxlsb'],
+    'csv': ['c', 'python'],
+}
+
+# движок -> модуль, наличие которого проверяем
+_ENGINE_MODULES = {
+    'calamine': 'python_calamine',
+    'openpyxl': 'openpyxl',
+    'xlrd': 'xlrd',
+    'odf': 'odf',
+    'pyxlsb': 'pyxlsb',
+    'c': 'pandas',
+    'python': 'pandas',
+}
+
+FORMAT_NAMES = {'xlsx': 'Excel (.xlsx)', 'xls': 'Excel 97-2003 (.xls)', 'ods': 'OpenDocument (.ods)', 'xlsb': 'Excel (.xlsb)',
+                'csv': 'CSV/TSV'}
+
+
+class UnsupportedFormatError(ValueError):
+    """Файл не похож ни на один поддерживаемый формат таблиц (или для него нет движка)."""
+
+
+def sniff(file_path: str) -> Optional[str]:
+    """Формат по сигнатуре: 'xlsx', 'xls', 'ods', 'xlsb', 'csv' или None."""
+    with open(file_path, 'rb') as f:
+        head = f.read(8)
+        if not head.startswith((OLE2_MAGIC, ZIP_MAGIC)):
+            return 'csv' if _csv_dialect(head + f.read(CSV_SNIFF_BYTES)) else None
+    if head.startswith(OLE2_MAGIC):
+        return 'xls'
+    if head.startswith(ZIP_MAGIC):
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                names = set(zf.namelist())
+                if 'xl/workbook.xml' in names:
+                    return 'xlsx'
+                if 'xl/workbook.bin' in names:
+                    return 'xlsb'
+                if 'mimetype' in names and b'opendocument.spreadsheet' in zf.read('mimetype'):
+                    return 'ods'
+        except zipfile.BadZipFile:
+            return None
+    return None
+
+
+@lru_cache(maxsize=None)
+def engine_available(engine: str) -> bool:
+    module = _ENGINE_MODULES.get(engine)
+    return module is not None and importlib.util.find_spec(module) is not None
+
+
+@lru_cache(maxsize=None)
+def _pandas_has_calamine() -> bool:
+    # engine='calamine' появился в pandas 2.2; в более старых читаем через python_calamine сами
+    major, minor = (int(x) for x in pd.__version__.split('.')[:2])
+    return (major, minor) >= (2, 2)
+
+
+def available_engines(fmt: str) -> List[str]:
+    return [e for e in ENGINE_PREFERENCE.get(fmt, []) if engine_available(e)]
+
+
+def engine_for(file_path: str, fmt: Optional[str] = None) -> str:
+    """Самый быстрый доступный движок для файла (с учётом READER_ENGINE)."""
+    fmt = fmt or sniff(file_path)
+    if fmt is None:
+        raise UnsupportedFormatError("❌ Не удалось распознать формат файла. Отправьте таблицу .xlsx, .xls, .ods или .csv.")
+    engines = available_engines(fmt)
+    if READER_ENGINE and READER_ENGINE in engines:
+        return READER_ENGINE
+    if not engines:
+        raise UnsupportedFormatError(f"❌ Формат {FORMAT_NAMES.get(fmt, fmt)} не поддерживается на сервере.")
+    return engines[0]
+
+
+# (путь, размер, mtime) -> движки, которые на этом файле уже упали: файл читается
+# несколько раз (probe, infer, read), и неудачная попытка calamine (например, на ODS
+# из pandas/odfpy — "Parse float error") оплачивается один раз, а не на каждом чтении
+_failed_engines: "OrderedDict[Tuple[str, int, int], Set[str]]" = OrderedDict()
+_failed_lock = threading.Lock()
+
+
+def _file_key(file_path: str) -> Optional[Tuple[str, int, int]]:
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return os.path.abspath(file_path), st.st_size, st.st_mtime_ns
+
+
+def _note_failure(key: Optional[Tuple[str, int, int]], engine: str) -> None:
+    if key is None:
+        return
+    with _failed_lock:
+        _failed_engines.setdefault(key, set()).add(engine)
+        _failed_engines.move_to_end(key)
+        while len(_failed_engines) > FAILED_ENGINES_MAX:
+            _failed_engines.popitem(last=False)
+
+
+def read_excel(file_path: str, engine: Optional[str] = None, **kwargs) -> Any:
+    """pd.read_excel с автоматическим выбором движка по содержимому файла.
+
+    Если быстрый движок не справился с файлом (calamine строже к «кривым» выгрузкам),
+    пробуем следующий по списку; при следующих чтениях того же файла упавший движок
+    пропускается.
+    """
+    fmt = sniff(file_path)
+    with tracing.span("read_excel", format=fmt, nrows=kwargs.get('nrows')) as span:
+        if engine is not None:
+            span.set(engine=engine)
+            return _read_with(engine, file_path, fmt, **kwargs)
+        first = engine_for(file_path, fmt)
+        engines = [first] + [e for e in available_engines(fmt) if e != first]
+        key = _file_key(file_path)
+        with _failed_lock:
+            failed = _failed_engines.get(key, set())
+        engines = [e for e in engines if e not in failed] or engines[-1:]
+        for i, name in enumerate(engines):
+            try:
+                span.set(engine=name)
+                return _read_with(name, file_path, fmt, **kwargs)
+            except Exception as e:
+                if i == len(engines) - 1:
+                    raise
+                _note_failure(key, name)
+                logger.warning("Engine %s failed on %s (%s), falling back to %s", name, file_path, e, engines[i + 1])
+
+
+def _read_with(engine: str, file_path: str, fmt: Optional[str], **kwargs) -> Any:
+    if fmt == 'csv':
+        return _read_csv(file_path, engine, **kwargs)
+    if engine == 'calamine':
+        # calamine определяет формат по расширению, поэтому даём ему путь с «правильным» суффиксом
+        with _with_suffix(file_path, fmt) as path:
+            if not _pandas_has_calamine():
+                return _read_calamine(path, **kwargs)
+            return pd.read_excel(path, engine=engine, **kwargs)
+    return pd.read_excel(file_path, engine=engine, **kwargs)
+
+
+@contextmanager
+def _with_suffix(file_path: str, fmt: Optional[str]):
+    if fmt is None or file_path.lower().endswith('.' + fmt):
+        yield file_path
+        return
+    link = f"{file_path}.{fmt}"
+    os.symlink(os.path.abspath(file_path), link)
+    try:
+        yield link
+    finally:
+        try:
+            os.remove(link)
+        except OSError:
+            logger.warning("Не удалось удалить ссылку: %s", link)
+
+
+def _calamine_value(value: Any) -> Any:
+    # как в pandas: целые числа из Excel — int (пустые '' TextParser сам превращает в NaN)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _read_calamine(file_path: str, sheet_name: Any = 0, header: Any = 0, skiprows: Optional[int] = None,
+                   nrows: Optional[int] = None, usecols: Optional[List[int]] = None, **kwargs) -> Any:
+    """Чтение через python_calamine для pandas < 2.2 (поддерживаются параметры, которые использует бот)."""
+    import python_calamine
+
+    workbook = python_calamine.CalamineWorkbook.from_path(file_path)
+    if sheet_name is None:
+        names = workbook.sheet_names
+    elif isinstance(sheet_name, int):
+        names = [workbook.sheet_names[sheet_name]]
+    else:
+        names = [sheet_name]
+
+    frames = {}
+    for name in names:
+        sheet = workbook.get_sheet_by_name(name)
+        limit = None
+        if nrows is not None:
+            limit = nrows + (skiprows or 0) + (header + 1 if isinstance(header, int) else 0)
+        # skip_empty_area=False: позиции строк и колонок совпадают с openpyxl/xlrd
+        data = [[_calamine_value(v) for v in row] for row in sheet.to_python(skip_empty_area=False, nrows=limit)]
+        if skiprows:
+            data = data[skiprows:]
+        if not data:
+            frames[name] = pd.DataFrame()
+            continue
+        parser = TextParser(data, header=header, nrows=nrows, usecols=usecols, **kwargs)
+        frames[name] = parser.read()
+    return frames if sheet_name is None else frames[names[0]]
+
+
+def _decode_sample(sample: bytes) -> Optional[Tuple[str, str]]:
+    """(кодировка, текст) для начала файла или None, если это не текст."""
+    if b"\x00" in sample:
+        return None
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return 'utf-8-sig', sample[3:].decode('utf-8', errors='ignore')
+    # выборка могла оборвать многобайтный символ — допускаем неполный хвост
+    for cut in range(4):
+        try:
+            return 'utf-8', sample[: len(sample) - cut].decode('utf-8')
+        except UnicodeDecodeError:
+            continue
+    # выгрузки из 1С и старого Excel — в cp1251
+    return 'cp1251', sample.decode('cp1251', errors='replace')
+
+
+def _csv_dialect(sample: bytes) -> Optional[Tuple[str, str]]:
+    """(кодировка, разделитель) или None, если начало файла не похоже на таблицу."""
+    decoded = _decode_sample(sample)
+    if decoded is None:
+        return None
+    encoding, text = decoded
+    lines = [line for line in text.splitlines()[:50] if line.strip()]
+    if not lines:
+        return None
+    try:
+        delimiter = csv.Sniffer().sniff("\n".join(lines), delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        # одна колонка или неоднородные строки: берём самый частый разделитель первой строки
+        counts = {d: lines[0].count(d) for d in CSV_DELIMITERS}
+        delimiter = max(counts, key=counts.get)
+        if counts[delimiter] == 0:
+            return None
+    return encoding, delimiter
+
+
+def _read_csv(file_path: str, engine: str = 'c', sheet_name: Any = 0, header: Any = 0, **kwargs) -> Any:
+    """CSV/TSV с параметрами read_excel; лист один, называется 'csv'."""
+    with open(file_path, 'rb') as f:
+        dialect = _csv_dialect(f.read(CSV_SNIFF_BYTES))
+    if dialect is None:
+        raise UnsupportedFormatError("❌ Не удалось определить разделитель в CSV-файле.")
+    encoding, delimiter = dialect
+    # в выгрузках с ';' десятичный разделитель — запятая
+    decimal = ',' if delimiter == ';' else '.'
+    # одним вызовом: чтение по частям с последующим concat держало бы в памяти и части, и итог
+    df = pd.read_csv(file_path, sep=delimiter, encoding=encoding, decimal=decimal, header=header,
+                     engine=engine, skip_blank_lines=False, encoding_errors='replace', **kwargs)
+    return {'csv': df} if sheet_name is None else df
@@ -0,0 +1,179 @@
+"""Инкрементальные отчёты: что изменилось с прошлой загрузки того же отчёта.
+
+Для каждой строки считаются два отпечатка (векторно, `hash_pandas_object`):
+ключ (нормализованные ФИО/группа + номер повтора) и вся строка (ключ + значения).
+Снимок «ключ → (отпечаток строки, результат разбора)» хранится на чат и тип отчёта.
+При новой загрузке заново разбираются только строки с изменившимся отпечатком,
+остальные берутся из снимка; изменения (новые проблемы, решённые, ухудшения)
+считаются только по изменившимся и пропавшим строкам.
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import tracing, progress
+from .query_engine import REPORT_SPECS
+
+logger = logging.getLogger(__name__)
+
+# сколько снимков (чат × тип отчёта) держим в памяти
+MAX_DELTA_SNAPSHOTS = int(os.getenv("MAX_DELTA_SNAPSHOTS", "200"))
+MAX_DELTA_LINES = 20
+
+Row = Dict[str, Any]
+
+# (chat_id, report_key) -> (Series key_hash -> row_hash, {key_hash: результат разбора})
+_snapshots: "OrderedDict[Tuple[Any, str], Tuple[pd.Series, Dict[int, Optional[Row]]]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+@dataclass
+class Delta:
+    new: List[Row] = field(default_factory=list)
+    resolved: List[Row] = field(default_factory=list)
+    worsened: List[Tuple[Row, Row]] = field(default_factory=list)   # (было, стало)
+    removed: int = 0
+    changed: int = 0
+    total: int = 0
+
+
+def _normalize_key(s: pd.Series) -> pd.Series:
+    """Строковое представление без различий в регистре и пробелах (включая NBSP)."""
+    return s.astype(str).map(lambda x: " ".join(x.split()).casefold())
+
+
+def fingerprint(frame: pd.DataFrame, key_cols: List[Any]) -> Tuple[pd.Series, pd.Series]:
+    """Отпечатки ключа и строки целиком (uint64), индекс — как у frame."""
+    keys = pd.DataFrame({c: _normalize_key(frame[c]) for c in key_cols}, index=frame.index)
+    # одинаковые ФИО в одной выгрузке различаем по номеру повтора
+    keys['__dup'] = keys.groupby(list(key_cols), sort=False).cumcount()
+    key_hash = pd.util.hash_pandas_object(keys, index=False)
+    value_cols = [c for c in frame.columns if c not in key_cols]
+    if not value_cols:
+        return key_hash, key_hash
+    values = pd.util.hash_pandas_object(frame[value_cols], index=False)
+    row_hash = pd.util.hash_pandas_object(pd.DataFrame({'k': key_hash, 'v': values}), index=False)
+    return key_hash, row_hash
+
+
+@tracing.traced("compute.evaluate")
+def evaluate_incremental(
+    chat_id: Any,
+    report_key: str,
+    frame: pd.DataFrame,
+    key_cols: List[Any],
+    evaluate: Callable[[Dict[Any, Any]], Optional[Row]],
+    is_problem: Callable[[Row], bool],
+) -> Tuple[List[Row], Optional[Delta]]:
+    """Разобрать строки frame, переиспользуя неизменившиеся из прошлого снимка.
+
+    `evaluate` получает строку как dict {колонка: значение} и возвращает разобранную
+    строку отчёта (или None, если строку надо пропустить). Возвращает разобранные
+    строки в исходном порядке и Delta (None, если это первая загрузка).
+    """
+    key_hash, row_hash = fingerprint(frame, key_cols)
+    snapshot_key = (chat_id, report_key)
+    with _lock:
+        previous = _snapshots.get(snapshot_key)
+
+    keys = key_hash.to_numpy().tolist()
+    if previous:
+        prev_hashes, prev_results = previous
+        unchanged = (key_hash.map(prev_hashes) == row_hash).to_numpy()
+    else:
+        prev_hashes, prev_results = None, {}
+        unchanged = np.zeros(len(frame), dtype=bool)
+
+    results: List[Optional[Row]] = [None] * len(frame)
+    for pos in np.flatnonzero(unchanged).tolist():
+        results[pos] = prev_results[keys[pos]]
+
+    changed_pos = np.flatnonzero(~unchanged).tolist()
+    # порциями: между ними — ход выполнения и проверка отмены (см. progress)
+    progress.stage("разбор строк", total=len(frame))
+    progress.advance(len(frame) - len(changed_pos))
+    for part in progress.chunks(len(changed_pos)):
+        positions = changed_pos[part.start:part.stop]
+        for pos, record in zip(positions, frame.iloc[positions].to_dict('records')):
+            try:
+                results[pos] = evaluate(record)
+            except Exception:
+                logger.debug("Row %s skipped", pos, exc_info=True)
+                results[pos] = None
+        progress.advance(len(positions))
+
+    hashes = pd.Series(row_hash.to_numpy(), index=keys)
+    snapshot = (hashes[~hashes.index.duplicated()], dict(zip(keys, results)))
+    with _lock:
+        _snapshots[snapshot_key] = snapshot
+        _snapshots.move_to_end(snapshot_key)
+        while len(_snapshots) > MAX_DELTA_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+
+    rows = [r for r in results if r is not None]
+    if not previous:
+        return rows, None
+
+    delta = Delta(changed=len(changed_pos), total=len(frame))
+    for pos in changed_pos:
+        now = results[pos]
+        before = prev_results.get(keys[pos])
+        now_bad = now is not None and is_problem(now)
+        before_bad = before is not None and is_problem(before)
+        if now_bad and not before_bad:
+            delta.new.append(now)
+        elif before_bad and not now_bad and now is not None:
+            delta.resolved.append(now)
+        elif now_bad and before_bad and now.get('value') is not None and before.get('value') is not None \
+                and now['value'] < before['value']:
+            delta.worsened.append((before, now))
+
+    # пропавшие строки: разница множеств ключей, без прохода по всем строкам в Python
+    removed = prev_hashes.index.difference(key_hash.to_numpy())
+    delta.removed = len(removed)
+    for k in removed.tolist():
+        before = prev_results.get(k)
+        if before is not None and is_problem(before):
+            delta.resolved.append(before)
+    return rows, delta
+
+
+def format_delta(delta: Optional[Delta], report_type: str) -> List[str]:
+    """Строки раздела «Изменения с прошлой загрузки» (пусто для первой загрузки)."""
+    if delta is None:
+        return []
+
+    spec = REPORT_SPECS[report_type]
+    lines = ["", "🔄 Изменения с прошлой загрузки:"]
+    if not (delta.new or delta.resolved or delta.worsened or delta.removed):
+        lines.append(f"Без изменений (изменено строк: {delta.changed} из {delta.total}).")
+        return lines
+
+    def section(title: str, items: List[str]) -> None:
+        if not items:
+            return
+        lines.append(f"{title}: {len(items)}")
+        lines.extend(items[:MAX_DELTA_LINES])
+        if len(items) > MAX_DELTA_LINES:
+            lines.append(f"... и ещё {len(items) - MAX_DELTA_LINES}")
+
+    section("🆕 Новые проблемы", [spec.fmt(r) for r in delta.new])
+    section("📉 Ухудшилось", [
+        f"{spec.fmt(now)} (было {before['value']:.1f}{spec.unit})" for before, now in delta.worsened
+    ])
+    section("✅ Решено", [spec.fmt(r) for r in delta.resolved])
+    if delta.removed:
+        lines.append(f"➖ Пропало из выгрузки строк: {delta.removed}")
+    lines.append(f"Изменено строк: {delta.changed} из {delta.total}")
+    return lines
+
+
+def chat_scope(update) -> Any:
+    chat = getattr(update, 'effective_chat', None)
+    return chat.id if chat else None
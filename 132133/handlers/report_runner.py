@@ -0,0 +1,109 @@
+"""Выполнение обработчиков отчётов вне цикла событий: ответы копятся и отправляются потом.
+
+Файл, присланный в чат (main.file_handler), и файлы из архива (archive_handler)
+обрабатываются в пуле из REPORT_WORKERS потоков — своём, не общем с пакетной
+загрузкой (batch_ingest): ночная выгрузка не задерживает ручные отчёты. Пакетная
+загрузка вызывает те же run_processor/deliver, но в своём пуле.
+"""
+import os
+import asyncio
+import functools
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from . import logging_setup, tracing, profiler
+from .report_store import relink_message
+from . import (
+    schedule_handler,
+    lessons_handler,
+    students_handler,
+    attendance_handler,
+    homework_check_handler,
+    homework_submit_handler,
+)
+
+logger = logging.getLogger(__name__)
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "4"))
+
+PROCESSORS = {
+    'schedule': schedule_handler.process_schedule_file,
+    'lessons': lessons_handler.process_lessons_file,
+    'students': students_handler.process_students_file,
+    'attendance': attendance_handler.process_attendance_file,
+    'homework_check': homework_check_handler.process_homework_check_file,
+    'homework_submit': homework_submit_handler.process_homework_submit_file,
+}
+
+Drafts = List[Tuple[int, str, Optional[str]]]
+
+# id «черновиков» сообщений: отрицательные, с настоящими id Telegram не пересекаются
+_draft_ids = itertools.count(-1, -1)
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    """Пул для отчётов из чата (progress.run) и архивов."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+        return _executor
+
+
+class _DraftMessage:
+    """Вместо update.message: ответы обработчика копятся, а не уходят в Telegram."""
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.message_id = next(_draft_ids)
+        self.drafts: Drafts = []
+
+    async def reply_text(self, text: str, parse_mode: Optional[str] = None, **kwargs) -> Any:
+        draft = SimpleNamespace(message_id=next(_draft_ids), chat_id=self.chat_id)
+        self.drafts.append((draft.message_id, text, parse_mode))
+        return draft
+
+
+def run_processor(report_type: str, path: str, chat_id: int,
+                  user_data: Optional[Dict[str, Any]] = None) -> Drafts:
+    """Выполнить обработчик отчёта в потоке пула; вернуть подготовленные сообщения.
+
+    user_data — выбор пользователя (период проверки ДЗ); копируется, обработчик его не меняет.
+    """
+    # поток пула переиспользуется — контекст логов задаём заново
+    logging_setup.clear()
+    logging_setup.bind(chat_id=chat_id, report_type=report_type)
+    message = _DraftMessage(chat_id)
+    update = SimpleNamespace(
+        message=message, effective_message=message, callback_query=None, effective_user=None,
+        effective_chat=SimpleNamespace(id=chat_id, type='draft'),
+    )
+    context = SimpleNamespace(user_data=dict(user_data or {}), chat_data={}, bot_data={}, args=[])
+    # в потоке пула — свой профиль, в счёт обработок /profile идёт вызывающая обработка
+    with tracing.span("report.process", report_type=report_type, chat_id=chat_id), \
+            profiler.job(f"{report_type}: {os.path.basename(path)}", count=False):
+        asyncio.run(PROCESSORS[report_type](update, context, path))
+    return message.drafts
+
+
+async def send_drafts(send: Callable[..., Awaitable[Any]], chat_id: int, drafts: Drafts) -> None:
+    """Отправить подготовленные run_processor сообщения: send(text, parse_mode=...) — в чат chat_id."""
+    for draft_id, text, parse_mode in drafts:
+        sent = await send(text, parse_mode=parse_mode)
+        # reply на сообщение отчёта должен находить его строки (см. report_store)
+        relink_message(chat_id, draft_id, sent.message_id)
+
+
+async def deliver(bot, chat_id: int, title: str, drafts: Drafts) -> None:
+    """Отправить заголовок и подготовленные run_processor сообщения в чат."""
+    try:
+        await bot.send_message(chat_id, title)
+        await send_drafts(functools.partial(bot.send_message, chat_id), chat_id, drafts)
+    except Exception:
+        logger.exception("Не удалось отправить результат обработки в чат %s", chat_id)
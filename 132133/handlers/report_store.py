@@ -1,9 +1,101 @@
+import os
+import itertools
 import logging
-from typing import Optional, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
 from telegram import Update, Message
 
+from . import tracing
+
 logger = logging.getLogger(__name__)
 
+# Сколько структурированных отчётов держим в памяти (на все чаты суммарно)
+MAX_LAST_REPORTS = int(os.getenv("MAX_LAST_REPORTS", "200"))
+
+# report_id -> report; порядок вставки = порядок вытеснения
+_reports: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+# (chat_id, message_id) -> report_id, чтобы находить отчёт по reply
+_by_message: Dict[Tuple[int, int], int] = {}
+# chat_id -> report_id последнего отчёта в чате
+_latest: Dict[int, int] = {}
+# (chat_id, report_type) -> report_id последнего отчёта этого типа (для сводки /dashboard)
+_latest_by_type: Dict[Tuple[int, str], int] = {}
+_ids = itertools.count(1)
+# отчёты пакетной загрузки (batch_ingest) сохраняются из потоков пула
+_lock = threading.Lock()
+
+
+def _chat_id(update: Update) -> Optional[int]:
+    chat = getattr(update, 'effective_chat', None)
+    return chat.id if chat else None
+
+
+def store_report(update: Update, report_type: str, rows: List[Dict[str, Any]], **meta) -> Dict[str, Any]:
+    """Remember structured rows of a finished report for local follow-up queries.
+
+    Only compact row dicts are kept (no message text), and the total number of
+    reports is capped by MAX_LAST_REPORTS; the oldest ones are evicted first.
+    """
+    report = {
+        'id': next(_ids),
+        'type': report_type,
+        'chat_id': _chat_id(update),
+        'rows': rows,
+        'message_ids': [],
+    }
+    report.update(meta)
+
+    with _lock:
+        _reports[report['id']] = report
+        if report['chat_id'] is not None:
+            _latest[report['chat_id']] = report['id']
+            _latest_by_type[(report['chat_id'], report_type)] = report['id']
+
+        while len(_reports) > MAX_LAST_REPORTS:
+            _, old = _reports.popitem(last=False)
+            for mid in old['message_ids']:
+                _by_message.pop((old['chat_id'], mid), None)
+            if _latest.get(old['chat_id']) == old['id']:
+                _latest.pop(old['chat_id'], None)
+            if _latest_by_type.get((old['chat_id'], old['type'])) == old['id']:
+                _latest_by_type.pop((old['chat_id'], old['type']), None)
+
+    return report
+
+
+def relink_message(chat_id: int, old_id: int, new_id: int) -> None:
+    """Перепривязать отчёт к другому id сообщения (текст подготовлен заранее, отправлен позже)."""
+    with _lock:
+        report_id = _by_message.pop((chat_id, old_id), None)
+        report = _reports.get(report_id) if report_id is not None else None
+        if report is None:
+            return
+        _by_message[(chat_id, new_id)] = report_id
+        report['message_ids'] = [new_id if mid == old_id else mid for mid in report['message_ids']]
+
+
+def get_report(chat_id: Optional[int], message_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Find a stored report by the message it was sent in, or the chat's latest one."""
+    if chat_id is None:
+        return None
+    if message_id is not None:
+        report_id = _by_message.get((chat_id, message_id))
+        return _reports.get(report_id) if report_id is not None else None
+    report_id = _latest.get(chat_id)
+    return _reports.get(report_id) if report_id is not None else None
+
+
+def latest_reports(chat_id: Optional[int]) -> Dict[str, Dict[str, Any]]:
+    """The chat's latest stored report of each type: {report_type: report}."""
+    if chat_id is None:
+        return {}
+    found = {}
+    for (cid, report_type), report_id in list(_latest_by_type.items()):
+        if cid == chat_id and report_id in _reports:
+            found[report_type] = _reports[report_id]
+    return found
+
 
 async def send_and_store(
     update: Update,
@@ -14,27 +106,35 @@ async def send_and_store(
 ) -> Optional[Message]:
     """Send a message (reply or edit depending on update).
 
-    NOTE: This helper no longer stores messages to `bot_data` to avoid memory growth.
+    NOTE: This helper does not store message text in `bot_data` to avoid memory growth.
+    If `metadata` carries a stored `report` (see `store_report`), the sent message id
+    is linked to it so that replies to the message can be answered from the rows.
     Returns the sent/edited Message when available.
     """
     sent_msg = None
     try:
-        if getattr(update, 'callback_query', None) and update.callback_query:
-            # Try to edit the existing message first
-            try:
-                sent = await update.callback_query.edit_message_text(text, parse_mode=parse_mode)
-                # edit_message_text may return None in some PTB versions; fall back
-                sent_msg = sent if sent is not None else update.callback_query.message
-            except Exception:
-                # fallback to sending a new message in the chat
-                if update.callback_query.message:
-                    sent_msg = await update.callback_query.message.reply_text(text, parse_mode=parse_mode)
-        elif getattr(update, 'message', None) and update.message:
-            sent_msg = await update.message.reply_text(text, parse_mode=parse_mode)
-
-        # We intentionally do NOT store message text/metadata in bot_data here
-        # to avoid unbounded memory growth on the host. If persistent storage
-        # is needed later, use an external DB (Redis/SQLite/R2) with limits.
+        with tracing.span("telegram.send", chars=len(text)):
+            if getattr(update, 'callback_query', None) and update.callback_query:
+                # Try to edit the existing message first
+                try:
+                    sent = await update.callback_query.edit_message_text(text, parse_mode=parse_mode)
+                    # edit_message_text may return None in some PTB versions; fall back
+                    sent_msg = sent if sent is not None else update.callback_query.message
+                except Exception:
+                    # fallback to sending a new message in the chat
+                    if update.callback_query.message:
+                        sent_msg = await update.callback_query.message.reply_text(text, parse_mode=parse_mode)
+            elif getattr(update, 'message', None) and update.message:
+                sent_msg = await update.message.reply_text(text, parse_mode=parse_mode)
+
+        # We intentionally do NOT store message text in bot_data here
+        # to avoid unbounded memory growth on the host. Only the message id is
+        # linked to an already stored (bounded) report.
+        report = (metadata or {}).get('report')
+        if report is not None and sent_msg is not None and report.get('chat_id') is not None:
+            with _lock:
+                report['message_ids'].append(sent_msg.message_id)
+                _by_message[(report['chat_id'], sent_msg.message_id)] = report['id']
 
     except Exception:
         logger.exception('Failed to send or store message')
@@ -0,0 +1,345 @@
+"""Настраиваемые правила «проблемной» строки для отчётов.
+
+Правило — короткое выражение над полями разобранной строки отчёта:
+`value < 40`, `homework == 1 | classroom < 3`, `value < 70 и issued >= 5`.
+`|` (или/or) разделяет отдельные правила (любое сработало — строка проблемная),
+`&` (и/and) объединяет условия внутри правила. Наборы правил хранятся на чат
+(кампусу — свои пороги) в виде текста, версия набора растёт при каждом изменении.
+
+Текст разбирается один раз в `RuleSet`: векторную проверку всего DataFrame
+(`matrix`/`mask`, все правила за один проход по колонкам NumPy) и проверку одной
+строки-словаря (`row`) для инкрементальных отчётов. Скомпилированные наборы
+кешируются по (чат, тип отчёта, версия), так что смена правил не добавляет
+разбора на каждую строку. RULES_FILE (JSON) — где хранить правила между перезапусками.
+
+Смотреть правила может любой участник чата, менять и сбрасывать — только
+пользователи из ADMIN_USER_IDS (та же проверка, что у /profile).
+"""
+import os
+import re
+import json
+import asyncio
+import math
+import logging
+import operator
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from .profiler import is_admin
+
+logger = logging.getLogger(__name__)
+
+RULES_FILE = os.getenv("RULES_FILE", "")
+MAX_COMPILED_RULES = 256
+
+DEFAULT_RULES: Dict[str, str] = {
+    'attendance': 'value < 40',
+    'homework_check': 'value < 70',
+    'homework_submit': 'value < 70',
+    'students': 'homework == 1 | classroom < 3',
+}
+
+# поле, чей порог показывается в отчёте и используется в уточняющих вопросах
+VALUE_FIELD = {'students': 'classroom'}
+
+# поля строк отчёта (см. обработчики) и их русские синонимы
+FIELDS: Dict[str, Tuple[str, ...]] = {
+    'attendance': ('value',),
+    'homework_check': ('value', 'issued', 'checked'),
+    'homework_submit': ('value',),
+    'students': ('homework', 'classroom'),
+}
+FIELD_ALIASES = {
+    'процент': 'value', 'посещаемость': 'value', 'значение': 'value',
+    'дз': 'homework', 'классная': 'classroom', 'класс': 'classroom',
+    'получено': 'issued', 'выдано': 'issued', 'проверено': 'checked',
+}
+FIELD_LABELS = {'value': 'Процент', 'homework': 'ДЗ', 'classroom': 'Классная', 'issued': 'Получено', 'checked': 'Проверено'}
+
+REPORT_ALIASES = {
+    'посещаемость': 'attendance', 'проверка': 'homework_check', 'сдача': 'homework_submit',
+    'студенты': 'students',
+}
+
+_OPS: Dict[str, Tuple[Callable[[Any, Any], Any], Callable[[Any, Any], Any]]] = {
+    '<': (operator.lt, np.less),
+    '<=': (operator.le, np.less_equal),
+    '>': (operator.gt, np.greater),
+    '>=': (operator.ge, np.greater_equal),
+    '==': (operator.eq, np.equal),
+    '!=': (operator.ne, np.not_equal),
+}
+_CONDITION_RE = re.compile(r"^\s*([\wа-яё]+)\s*(<=|>=|==|!=|=|<|>)\s*(-?\d+(?:[.,]\d+)?)\s*%?\s*$", re.IGNORECASE)
+_OR_RE = re.compile(r"\s*(?:\||\bили\b|\bor\b)\s*", re.IGNORECASE)
+_AND_RE = re.compile(r"\s*(?:&|\bи\b|\band\b)\s*", re.IGNORECASE)
+
+
+class RuleError(ValueError):
+    """Текст правила не разобрался; сообщение показывается пользователю."""
+
+
+@dataclass(frozen=True)
+class Condition:
+    field: str
+    op: str
+    value: float
+
+    def describe(self) -> str:
+        op = '=' if self.op == '==' else self.op
+        return f"{FIELD_LABELS.get(self.field, self.field)} {op} {self.value:g}"
+
+
+@dataclass(frozen=True)
+class Rule:
+    conditions: Tuple[Condition, ...]
+
+    def describe(self) -> str:
+        return " и ".join(c.describe() for c in self.conditions)
+
+
+class RuleSet:
+    """Скомпилированный набор правил одного отчёта."""
+
+    def __init__(self, report_type: str, text: str, rules: Tuple[Rule, ...]):
+        self.report_type = report_type
+        self.text = text
+        self.rules = rules
+        # проверка строки-словаря: замыкания с готовыми операторами, без разбора текста
+        self._row_checks = tuple(
+            tuple((c.field, _OPS[c.op][0], c.value) for c in rule.conditions) for rule in rules
+        )
+
+    @property
+    def threshold(self) -> Optional[float]:
+        """Порог «value < X» (первое правило из одного такого условия) — для подписей и вопросов."""
+        field = VALUE_FIELD.get(self.report_type, 'value')
+        for rule in self.rules:
+            if len(rule.conditions) == 1:
+                c = rule.conditions[0]
+                if c.field == field and c.op in ('<', '<='):
+                    return c.value
+        return None
+
+    def describe(self) -> str:
+        return " ИЛИ ".join(r.describe() for r in self.rules)
+
+    def _simple(self) -> Optional[Condition]:
+        if len(self.rules) == 1 and len(self.rules[0].conditions) == 1:
+            c = self.rules[0].conditions[0]
+            if c.field == VALUE_FIELD.get(self.report_type, 'value') and c.op in ('<', '<='):
+                return c
+        return None
+
+    def condition(self, unit: str = '') -> str:
+        """«< 40%» для одиночного порога, иначе «по правилу «…»» — для подписей отчёта."""
+        c = self._simple()
+        return f"{c.op} {c.value:g}{unit}" if c else f"по правилу «{self.describe()}»"
+
+    def passed(self, unit: str = '') -> str:
+        """Обратное условие для строки «все в норме»: «≥ 40%»."""
+        c = self._simple()
+        if c:
+            return f"{'≥' if c.op == '<' else '>'} {c.value:g}{unit}"
+        return f"вне правила «{self.describe()}»"
+
+    def matrix(self, frame: pd.DataFrame) -> np.ndarray:
+        """Булева матрица строк × правил: все правила за один проход по колонкам."""
+        n = len(frame)
+        columns: Dict[str, np.ndarray] = {}
+        out = np.zeros((n, len(self.rules)), dtype=bool)
+        for j, rule in enumerate(self.rules):
+            hit = np.ones(n, dtype=bool)
+            for c in rule.conditions:
+                if c.field not in columns:
+                    if c.field in frame.columns:
+                        columns[c.field] = pd.to_numeric(frame[c.field], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+                    else:
+                        columns[c.field] = np.full(n, np.nan)
+                col = columns[c.field]
+                # NaN не проходит ни одно условие (в т.ч. «!=»)
+                hit &= _OPS[c.op][1](col, c.value) & ~np.isnan(col)
+            out[:, j] = hit
+        return out
+
+    def mask(self, frame: pd.DataFrame) -> np.ndarray:
+        if not self.rules:
+            return np.zeros(len(frame), dtype=bool)
+        return self.matrix(frame).any(axis=1)
+
+    def rows_mask(self, rows: List[Dict[str, Any]]) -> np.ndarray:
+        return self.mask(pd.DataFrame.from_records(rows)) if rows else np.zeros(0, dtype=bool)
+
+    def row(self, row: Dict[str, Any]) -> bool:
+        for checks in self._row_checks:
+            for field, op, value in checks:
+                v = row.get(field)
+                if v is None or (isinstance(v, float) and math.isnan(v)) or not op(v, value):
+                    break
+            else:
+                return True
+        return False
+
+    def reasons(self, hits: np.ndarray) -> List[str]:
+        """Подписи сработавших правил для одной строки матрицы."""
+        return [self.rules[j].describe() for j in np.flatnonzero(hits)]
+
+
+def parse(report_type: str, text: str) -> Tuple[Rule, ...]:
+    fields = FIELDS.get(report_type, ('value',))
+    rules = []
+    for part in _OR_RE.split(text.strip()):
+        if not part:
+            continue
+        conditions = []
+        for cond in _AND_RE.split(part):
+            m = _CONDITION_RE.match(cond)
+            if not m:
+                raise RuleError(f"❌ Не понял условие «{cond.strip()}». Пример: value < 40 или homework == 1 | classroom < 3")
+            field = m.group(1).casefold()
+            field = FIELD_ALIASES.get(field, field)
+            if field not in fields:
+                raise RuleError(f"❌ Поле «{m.group(1)}» недоступно. Поля отчёта: {', '.join(fields)}")
+            op = '==' if m.group(2) == '=' else m.group(2)
+            conditions.append(Condition(field, op, float(m.group(3).replace(',', '.'))))
+        rules.append(Rule(tuple(conditions)))
+    if not rules:
+        raise RuleError("❌ Пустое правило.")
+    return tuple(rules)
+
+
+def canonical_text(report_type: str, text: str) -> str:
+    """Компактная запись набора правил (в таком виде он и хранится)."""
+    return " | ".join(
+        " & ".join(f"{c.field} {c.op} {c.value:g}" for c in rule.conditions) for rule in parse(report_type, text)
+    )
+
+
+# ---------------------------------------------------------------------------
+# Хранение наборов по чатам
+# ---------------------------------------------------------------------------
+
+# scope (chat_id) -> (версия, {тип отчёта: текст})
+_chat_rules: Dict[Any, Tuple[int, Dict[str, str]]] = {}
+# (scope, тип отчёта, версия) -> RuleSet
+_compiled: "OrderedDict[Tuple[Any, str, int], RuleSet]" = OrderedDict()
+_lock = threading.Lock()
+# запись файла — вне _lock (его берут потоки отчётов в rules_for); свой замок упорядочивает записи
+_save_lock = threading.Lock()
+
+
+def _load() -> None:
+    if not RULES_FILE or not os.path.exists(RULES_FILE):
+        return
+    try:
+        with open(RULES_FILE, encoding='utf-8') as f:
+            data = json.load(f)
+        for scope, entry in data.items():
+            key = int(scope) if scope.lstrip('-').isdigit() else scope
+            _chat_rules[key] = (int(entry['version']), dict(entry['rules']))
+    except Exception:
+        logger.exception("Не удалось прочитать правила из %s", RULES_FILE)
+
+
+def _save() -> None:
+    """Записать RULES_FILE (блокирующая: из цикла событий — через asyncio.to_thread)."""
+    if not RULES_FILE:
+        return
+    # снимок берётся под _save_lock: последняя запись всегда содержит последние правила
+    with _save_lock:
+        with _lock:
+            data = {str(scope): {'version': v, 'rules': dict(rules)} for scope, (v, rules) in _chat_rules.items()}
+        _write(data)
+
+
+def _write(data: Dict[str, Any]) -> None:
+    try:
+        tmp = f"{RULES_FILE}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, RULES_FILE)
+    except Exception:
+        logger.exception("Не удалось сохранить правила в %s", RULES_FILE)
+
+
+def rules_for(scope: Any, report_type: str) -> RuleSet:
+    """Скомпилированный набор правил чата для отчёта (или набор по умолчанию)."""
+    with _lock:
+        version, texts = _chat_rules.get(scope, (0, {}))
+        key = (scope if report_type in texts else None, report_type, version if report_type in texts else 0)
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+        text = texts.get(report_type, DEFAULT_RULES.get(report_type, ''))
+    compiled = RuleSet(report_type, text, parse(report_type, text))
+    with _lock:
+        _compiled[key] = compiled
+        while len(_compiled) > MAX_COMPILED_RULES:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def set_rules(scope: Any, report_type: str, text: Optional[str]) -> RuleSet:
+    """Заменить (text=None — сбросить к умолчанию) правила отчёта в чате; версия набора растёт.
+
+    Только в памяти; сохранить в RULES_FILE — _save() (см. rules_command).
+    """
+    canonical = canonical_text(report_type, text) if text is not None else None
+    with _lock:
+        version, texts = _chat_rules.get(scope, (0, {}))
+        texts = dict(texts)
+        if canonical is None:
+            texts.pop(report_type, None)
+        else:
+            texts[report_type] = canonical
+        _chat_rules[scope] = (version + 1, texts)
+    return rules_for(scope, report_type)
+
+
+_load()
+
+
+async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/rules — показать правила; /rules <отчёт> <выражение> — задать; /rules <отчёт> default — сбросить."""
+    chat = update.effective_chat
+    scope = chat.id if chat else None
+    args = list(context.args or [])
+    try:
+        if not args:
+            lines = ["⚙️ Правила отчётов в этом чате:"]
+            custom = _chat_rules.get(scope, (0, {}))[1]
+            for report_type in DEFAULT_RULES:
+                mark = "" if report_type in custom else " (по умолчанию)"
+                lines.append(f"• {report_type}: {rules_for(scope, report_type).text}{mark}")
+            lines.append("")
+            lines.append("Изменить: /rules attendance value < 50")
+            lines.append("Сбросить: /rules attendance default")
+            await update.message.reply_text("\n".join(lines))
+            return
+
+        report_type = REPORT_ALIASES.get(args[0].casefold(), args[0].casefold())
+        if report_type not in DEFAULT_RULES:
+            await update.message.reply_text(f"❌ Неизвестный отчёт. Доступны: {', '.join(DEFAULT_RULES)}")
+            return
+        text = " ".join(args[1:]).strip()
+        if not text:
+            await update.message.reply_text(f"• {report_type}: {rules_for(scope, report_type).text}")
+            return
+        if not is_admin(update):
+            await update.message.reply_text("⛔ Менять правила могут только администраторы.")
+            return
+        ruleset = set_rules(scope, report_type, None if text.casefold() in ('default', 'сброс') else text)
+        await asyncio.to_thread(_save)
+        await update.message.reply_text(f"✅ {report_type}: {ruleset.text}\nПроблемная строка: {ruleset.describe()}")
+    except RuleError as e:
+        await update.message.reply_text(str(e))
+    except Exception:
+        logger.exception("Ошибка при изменении правил")
+        await update.message.reply_text("❌ Не удалось изменить правила. Подробности в логах.")
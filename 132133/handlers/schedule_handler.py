@@ -1,13 +1,28 @@
 """Обработчик отчета по расписанию"""
+import re
 import logging
 import pandas as pd
 from telegram import Update
 from telegram.ext import ContextTypes
-from .report_store import send_and_store
-from collections import Counter
+from .report_store import send_and_store, store_report
+from . import schema
+from telegram.helpers import escape_markdown
 
 logger = logging.getLogger(__name__)
 
+# поля внутри ячейки сетки: "Предмет: ...\nПреподаватель: ...\nАудитория: ..."
+FIELD_PATTERNS = {
+    'discipline': re.compile(r'Предмет:([^\n]*)'),
+    'teacher': re.compile(r'Преподаватель:([^\n]*)'),
+    'room': re.compile(r'(?:Аудитория|Ауд\.):([^\n]*)'),
+}
+# в одной ячейке может быть несколько занятий (подгруппы) — каждое начинается со строки «Предмет:»
+LESSON_SPLIT = re.compile(r'\n(?=[^\n]*Предмет:)')
+SPACES_RE = re.compile(r'\s+')
+# «аудитории», которые могут быть заняты несколькими группами одновременно
+SHARED_ROOMS = {'', '-', 'онлайн', 'дистант', 'дистанционно', 'спортзал'}
+MAX_CONFLICT_LINES = 30
+
 async def start_schedule_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Сообщение перед загрузкой файла"""
     if update.callback_query:
@@ -32,49 +47,43 @@ async def process_schedule_file(update: Update, context: ContextTypes.DEFAULT_TY
             return
         context.user_data['processing_schedule'] = True
 
-        df = pd.read_excel(file_path)
-
-        if 'Группа' not in df.columns:
-            await update.message.reply_text("❌ В файле не найдена колонка 'Группа'. Файл некорректный.")
+        try:
+            mapping = schema.infer(file_path, 'schedule')
+        except schema.SchemaError as e:
+            await update.message.reply_text(str(e))
             return
+        df = schema.read(file_path, mapping)
 
         content_columns = df.columns[3::2]
         if len(content_columns) == 0:
             await update.message.reply_text("❌ Не найдены колонки с расписанием по дням.")
             return
 
+        # каждую ячейку сетки разбираем в записи (день, пара, группа, дисциплина, преподаватель, аудитория)
+        lessons = parse_schedule(df, mapping, content_columns)
         groups = df['Группа'].dropna().unique()
 
         report = "📅 *Отчет по выставленному расписанию*\n\n"
         overall_total = 0
+        rows = []
 
+        # пары по дисциплинам в порядке первого появления, затем по убыванию количества
+        counts = lessons[lessons['discipline'] != ''].groupby(['group_key', 'discipline'], sort=False).size()
         for group in groups:
             if pd.isna(group) or str(group).strip() == '':
                 continue
 
-            group_df = df[df['Группа'] == group]
-            disciplines = []
-
-            for col in content_columns:
-                for cell in group_df[col]:
-                    if pd.notna(cell):
-                        cell_str = str(cell)
-                        for line in cell_str.split('\n'):
-                            if 'Предмет:' in line:
-                                discipline = line.split('Предмет:', 1)[1].strip()
-                                if discipline:
-                                    disciplines.append(discipline)
-
-            if not disciplines:
+            group_counts = counts[counts.index.get_level_values(0) == group] if len(counts) else counts
+            if group_counts.empty:
                 report += f"*Группа {group}*: Нет занятий в расписании.\n\n"
                 continue
 
-            counts = Counter(disciplines)
-
             report += f"*Группа {group}*:\n"
             group_total = 0
-            for disc, count in sorted(counts.items(), key=lambda x: x[1], reverse=True):
+            for (_, disc), count in group_counts.sort_values(ascending=False, kind='stable').items():
+                count = int(count)
                 report += f"• {disc}: *{count} пар*\n"
+                rows.append({'group': str(group), 'name': disc, 'value': count})
                 group_total += count
                 overall_total += count
 
@@ -85,11 +94,111 @@ async def process_schedule_file(update: Update, context: ContextTypes.DEFAULT_TY
 
         report += f"*Общее количество пар по всем группам: {overall_total}*"
 
-        await send_and_store(update, context, report, parse_mode='Markdown', metadata={'type': 'schedule'})
+        conflicts = find_conflicts(lessons)
+        report += format_conflicts(conflicts)
+
+        # строки отчёта для уточняющих вопросов (см. query_engine)
+        stored = store_report(update, 'schedule', rows, conflicts=conflict_count(conflicts))
+        await send_and_store(update, context, report, parse_mode='Markdown', metadata={'type': 'schedule', 'report': stored})
 
         # Очистка флага обработки
         context.user_data.pop('processing_schedule', None)
 
     except Exception as e:
         logger.exception("Ошибка при обработке файла расписания")
-        await update.message.reply_text("❌ Произошла ошибка при обработке файла. Попробуйте снова.")
\ No newline at end of file
+        await update.message.reply_text("❌ Произошла ошибка при обработке файла. Попробуйте снова.")
+
+
+def parse_schedule(df: pd.DataFrame, mapping, content_columns) -> pd.DataFrame:
+    """Сетка расписания -> записи (day, slot, group, discipline, teacher, room), по одной на занятие.
+
+    Разбор векторный: melt по дням, split ячеек на занятия, str.extract полей.
+    Порядок записей — как при обходе «день за днём, строка за строкой».
+    """
+    slot_col = mapping.column('slot') if mapping.index('slot') is not None else None
+    time_col = mapping.column('time') if mapping.index('time') is not None else None
+    frame = pd.DataFrame({'group_key': df['Группа'].astype(object)}, index=df.index)
+    frame['slot'] = df[slot_col].astype(str).str.strip() if slot_col in df.columns else ''
+    if time_col in df.columns:
+        times = df[time_col].astype(str).str.strip().where(df[time_col].notna(), '')
+        frame['slot'] = (frame['slot'] + ' (' + times + ')').where(times != '', frame['slot'])
+    for col in content_columns:
+        frame[col] = df[col]
+
+    cells = frame.melt(id_vars=['group_key', 'slot'], value_vars=list(content_columns), var_name='day', value_name='cell')
+    cells = cells[cells['cell'].notna() & cells['group_key'].notna()]
+    blocks = cells['cell'].astype(str).str.split(LESSON_SPLIT, regex=True).explode()
+    lessons = cells.drop(columns='cell').loc[blocks.index].reset_index(drop=True)
+    blocks = blocks.reset_index(drop=True)
+    for field, pattern in FIELD_PATTERNS.items():
+        lessons[field] = blocks.str.extract(pattern, expand=False).fillna('').str.strip()
+    lessons['group'] = lessons['group_key'].astype(str).str.strip()
+    return lessons[lessons['discipline'] != ''].reset_index(drop=True) if len(lessons) else lessons
+
+
+def find_conflicts(lessons: pd.DataFrame) -> pd.DataFrame:
+    """Накладки: один преподаватель или одна аудитория в одно время у разных занятий.
+
+    Хеш-группировка по (день, пара, преподаватель) и (день, пара, аудитория) — один линейный
+    проход вместо попарного сравнения. Поток (несколько групп на одной лекции: тот же
+    преподаватель, аудитория и дисциплина) накладкой не считается.
+
+    key — нормализованное имя (регистр, пробелы), по нему накладки и группируются;
+    who — первое написание из файла, для показа.
+    """
+    columns = ['kind', 'day', 'slot', 'key', 'who', 'group', 'discipline', 'teacher', 'room']
+    if lessons.empty:
+        return pd.DataFrame(columns=columns)
+
+    data = lessons.assign(
+        teacher_key=lessons['teacher'].str.casefold().str.replace(SPACES_RE, ' ', regex=True),
+        room_key=lessons['room'].str.casefold().str.replace(SPACES_RE, ' ', regex=True),
+    )
+    # «занятие» внутри слота: поток из нескольких групп даёт одно и то же занятие
+    data['session'] = data['teacher_key'] + '|' + data['room_key'] + '|' + data['discipline'].str.casefold()
+
+    found = []
+    for kind, key, who in (('teacher', 'teacher_key', 'teacher'), ('room', 'room_key', 'room')):
+        part = data[data[key] != ''] if kind == 'teacher' else data[~data[key].isin(SHARED_ROOMS)]
+        if part.empty:
+            continue
+        sessions = part.groupby(['day', 'slot', key], sort=False)['session'].transform('nunique')
+        clash = part[sessions > 1]
+        if not clash.empty:
+            first = clash.groupby(['day', 'slot', key], sort=False)[who].transform('first')
+            found.append(clash.assign(kind=kind, key=clash[key], who=first)[columns])
+    if not found:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(found, ignore_index=True)
+
+
+def conflict_count(conflicts: pd.DataFrame) -> int:
+    """Число накладок: разные написания одного имени — одна накладка."""
+    return int(conflicts.groupby(['kind', 'day', 'slot', 'key']).ngroups) if len(conflicts) else 0
+
+
+def format_conflicts(conflicts: pd.DataFrame) -> str:
+    """Раздел отчёта с накладками (Markdown), пустая строка если их нет."""
+    if conflicts.empty:
+        return ""
+    # описание каждого занятия строкой, затем склейка по накладке — без обхода строк в Python
+    teacher_side = conflicts['kind'] == 'teacher'
+    detail = ('ауд. ' + conflicts['room']).where(teacher_side & (conflicts['room'] != ''), conflicts['teacher'].replace('', '-'))
+    desc = conflicts['group'] + ' (' + conflicts['discipline'] + ', ' + detail + ')'
+    who = conflicts['who'].where(teacher_side, 'ауд. ' + conflicts['who'])
+    by = [conflicts['kind'], conflicts['day'], conflicts['slot'], conflicts['key']]
+    joined = desc.groupby(by, sort=False).agg(', '.join)
+    names = who.groupby(by, sort=False).first()
+
+    items = []
+    for (kind, day, slot, key), what in joined.head(MAX_CONFLICT_LINES).items():
+        name = names[(kind, day, slot, key)]
+        icon = "👤" if kind == 'teacher' else "🚪"
+        items.append(escape_markdown(f"{icon} {day}, пара {slot}: {name} — {what}", version=1))
+    total = len(joined)
+
+    text = f"\n\n⚠️ *Накладки в расписании: {total}*\n"
+    text += "\n".join(items)
+    if total > MAX_CONFLICT_LINES:
+        text += f"\n... и ещё {total - MAX_CONFLICT_LINES}"
+    return text
@@ -0,0 +1,451 @@
+"""Определение колонок отчётов по заголовкам (общий модуль для всех обработчиков).
+
+`infer` читает только первые PROBE_ROWS строк листа, по ним находит строку(и)
+заголовка и роли колонок (ФИО, группа, процент, получено/проверено и т.д.) и
+возвращает `ColumnMapping`. Результат кэшируется по отпечатку раскладки
+заголовка, поэтому повторные загрузки той же выгрузки определение пропускают.
+`read` загружает лист по найденному заголовку — только колонки нужных ролей
+(usecols) и сразу в компактных типах (category для имён и групп, узкие целые для
+целых чисел; дробные остаются float64).
+"""
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from . import readers, progress, parse_pool
+
+logger = logging.getLogger(__name__)
+
+PROBE_ROWS = int(os.getenv("SCHEMA_PROBE_ROWS", "8"))
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "256"))
+
+# Компактные типы колонок по ролям (суффикс роли после '_' не учитывается: issued_month -> issued)
+ROLE_DTYPES = {
+    'teacher': 'category',
+    'student': 'category',
+    'fio': 'category',
+    'group': 'category',
+    # значения, которые сравниваются с порогами, — float64: во float32 доля 0.7 * 100 даёт
+    # 69.99999, и студент ровно с 70% попадает в «< 70%»
+    'attendance': 'float64',
+    'percentage': 'float64',
+    'homework': 'float64',
+    'classroom': 'float64',
+    'issued': 'float64',
+    'checked': 'float64',
+}
+
+# Предкомпилированные шаблоны ролей колонок (по заголовку в нижнем регистре)
+TEACHER_RE = re.compile(r"преподав|учител|фио")
+ATTENDANCE_RE = re.compile(r"посещ|сред|процент|%|присут|avg")
+STUDENT_RE = re.compile(r"фио|студент|имя|name")
+GROUP_RE = re.compile(r"группа|group")
+PERCENTAGE_RE = re.compile(r"percentage")
+HOMEWORK_RE = re.compile(r"homework")
+ISSUED_RE = re.compile(r"получ")
+CHECKED_RE = re.compile(r"провер")
+MONTH_RE = re.compile(r"месяц")
+WEEK_RE = re.compile(r"недел")
+TOPIC_RE = re.compile(r"тема")
+DISCIPLINE_RE = re.compile(r"дисциплин|предмет|subject")
+SLOT_RE = re.compile(r"пара|урок|№|slot")
+TIME_RE = re.compile(r"время|time")
+
+
+class SchemaError(ValueError):
+    """Не удалось найти обязательные колонки; текст пригоден для показа пользователю."""
+
+    def __init__(self, message: str, mapping: Optional['ColumnMapping'] = None):
+        super().__init__(message)
+        self.mapping = mapping
+
+
+@dataclass(frozen=True)
+class ColumnMapping:
+    """Раскладка листа: где заголовок и какая колонка за что отвечает."""
+    report_type: str
+    header_row: int                       # последняя строка заголовка (0-based), данные — ниже
+    labels: Tuple[str, ...]               # заголовки колонок (многоуровневые склеены через пробел)
+    roles: Dict[str, Optional[int]] = field(default_factory=dict)   # роль -> позиция колонки
+    header_cells: Tuple[Tuple[str, ...], ...] = ()                  # сырые строки заголовка
+
+    def index(self, role: str) -> Optional[int]:
+        return self.roles.get(role)
+
+    def column(self, role: str) -> Optional[str]:
+        idx = self.roles.get(role)
+        return self.labels[idx] if idx is not None else None
+
+
+def _cell(value: Any) -> str:
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    return str(value).strip()
+
+
+def _header_rows(raw: pd.DataFrame, first: int, last: int) -> Tuple[Tuple[str, ...], ...]:
+    return tuple(tuple(_cell(v) for v in raw.iloc[r].tolist()) for r in range(first, last + 1))
+
+
+def _labels(rows: Tuple[Tuple[str, ...], ...]) -> Tuple[str, ...]:
+    """Склеить строки заголовка; верхний уровень протягивается вправо (объединённые ячейки)."""
+    if len(rows) == 1:
+        return _dedupe([c or f"Unnamed: {i}" for i, c in enumerate(rows[0])])
+    filled = []
+    for level in rows[:-1]:
+        cur, out = "", []
+        for c in level:
+            cur = c or cur
+            out.append(cur)
+        filled.append(out)
+    filled.append(list(rows[-1]))
+    labels = []
+    for i in range(len(rows[-1])):
+        parts = [lvl[i] for lvl in filled if lvl[i]]
+        labels.append(" ".join(parts) if parts else f"Unnamed: {i}")
+    return _dedupe(labels)
+
+
+def _dedupe(labels: List[str]) -> Tuple[str, ...]:
+    """Повторяющиеся заголовки различаем суффиксом, как pandas: 'Получено', 'Получено.1'."""
+    seen: Dict[str, int] = {}
+    out = []
+    for label in labels:
+        n = seen.get(label, 0)
+        seen[label] = n + 1
+        out.append(f"{label}.{n}" if n else label)
+    return tuple(out)
+
+
+def _first(lower: List[str], *patterns: re.Pattern) -> Optional[int]:
+    for i, c in enumerate(lower):
+        if all(p.search(c) for p in patterns):
+            return i
+    return None
+
+
+def _last(lower: List[str], pattern: re.Pattern) -> Optional[int]:
+    found = None
+    for i, c in enumerate(lower):
+        if pattern.search(c):
+            found = i
+    return found
+
+
+def _mapping(report_type: str, raw: pd.DataFrame, header_first: int, header_last: int,
+             roles: Dict[str, Optional[int]]) -> ColumnMapping:
+    cells = _header_rows(raw, header_first, header_last)
+    return ColumnMapping(report_type, header_last, _labels(cells), roles, cells)
+
+
+# ---------------------------------------------------------------------------
+# Детекторы по типам отчётов (работают по пробе первых строк, header=None)
+# ---------------------------------------------------------------------------
+
+def _detect_attendance(raw: pd.DataFrame) -> ColumnMapping:
+    labels = _labels(_header_rows(raw, 0, 0))
+    if len(labels) < 2:
+        raise SchemaError("❌ Файл должен содержать минимум 2 колонки.")
+    lower = [c.lower() for c in labels]
+    # как и раньше, при нескольких совпадениях берётся последняя подходящая колонка
+    teacher = _last(lower, TEACHER_RE)
+    attendance = _last(lower, ATTENDANCE_RE)
+    return _mapping('attendance', raw, 0, 0, {
+        'teacher': teacher if teacher is not None else 0,
+        'attendance': attendance if attendance is not None else 1,
+    })
+
+
+def _detect_homework_submit(raw: pd.DataFrame) -> ColumnMapping:
+    labels = _labels(_header_rows(raw, 0, 0))
+    if len(labels) < 2:
+        raise SchemaError("❌ Файл должен содержать минимум 2 колонки.")
+    lower = [c.lower() for c in labels]
+    student = _first(lower, STUDENT_RE)
+    percentage = _first(lower, PERCENTAGE_RE, HOMEWORK_RE)
+    if percentage is None:
+        percentage = _first(lower, PERCENTAGE_RE)
+    mapping = _mapping('homework_submit', raw, 0, 0, {
+        'student': student if student is not None else 0,
+        'group': _first(lower, GROUP_RE),
+        'percentage': percentage,
+    })
+    if percentage is None:
+        raise SchemaError("❌ Не удалось найти колонку 'Percentage Homework' в файле.", mapping)
+    return mapping
+
+
+def _pair_periods(lower: List[str]) -> Dict[str, Optional[int]]:
+    """Найти пары «получено/проверено» за месяц и неделю (по подписи периода или по соседству)."""
+    periods = {'month': {'issued': None, 'checked': None}, 'week': {'issued': None, 'checked': None}}
+    other_issued, other_checked = [], []
+    for i, text in enumerate(lower):
+        period = 'month' if MONTH_RE.search(text) else 'week' if WEEK_RE.search(text) else None
+        if ISSUED_RE.search(text):
+            if period:
+                periods[period]['issued'] = i
+            else:
+                other_issued.append(i)
+        if CHECKED_RE.search(text):
+            if period:
+                periods[period]['checked'] = i
+            else:
+                other_checked.append(i)
+
+    month, week = periods['month'], periods['week']
+    if month['issued'] is None and other_issued:
+        month['issued'] = other_issued[0]
+    if month['checked'] is None and other_checked:
+        if month['issued'] is not None:
+            # ближайшая к «получено» колонка «проверено»
+            month['checked'] = min(other_checked, key=lambda x: abs(x - month['issued']))
+        else:
+            month['checked'] = other_checked[0]
+
+    if week['issued'] is None and len(other_issued) >= 2:
+        week['issued'] = other_issued[1]
+    elif week['issued'] is None and month['issued'] is not None and other_issued:
+        week['issued'] = next((i for i in other_issued if i != month['issued']), None)
+
+    if week['checked'] is None and len(other_checked) >= 2:
+        week['checked'] = other_checked[1]
+    elif week['checked'] is None and month['checked'] is not None and other_checked:
+        week['checked'] = next((i for i in other_checked if i != month['checked']), None)
+
+    return {
+        'issued_month': month['issued'], 'checked_month': month['checked'],
+        'issued_week': week['issued'], 'checked_week': week['checked'],
+    }
+
+
+def _detect_homework_check(raw: pd.DataFrame) -> ColumnMapping:
+    # Варианты заголовка: двухуровневый (строки 0-1), обычный (строка 0), заголовок во 2-й строке.
+    # Предпочитаем вариант с подписями периода, иначе первый, где есть «получено» и «проверено».
+    chosen = None
+    for first, last in ((0, 1), (0, 0), (1, 1)):
+        if last >= len(raw):
+            continue
+        lower = [c.lower() for c in _labels(_header_rows(raw, first, last))]
+        has_keywords = any(ISSUED_RE.search(c) for c in lower) and any(CHECKED_RE.search(c) for c in lower)
+        has_period = any(MONTH_RE.search(c) or WEEK_RE.search(c) for c in lower)
+        if has_keywords and has_period:
+            chosen = (first, last)
+            break
+        if chosen is None and has_keywords:
+            chosen = (first, last)
+    first, last = chosen or (0, 0)
+
+    lower = [c.lower() for c in _labels(_header_rows(raw, first, last))]
+    teacher = _first(lower, TEACHER_RE)
+    roles = {'teacher': teacher if teacher is not None else 0}
+    roles.update(_pair_periods(lower))
+    mapping = _mapping('homework_check', raw, first, last, roles)
+
+    if not any(ISSUED_RE.search(c) for c in lower) or not any(CHECKED_RE.search(c) for c in lower):
+        # prepare short diagnostics
+        msg_lines = ["Не удалось автоматически определить колонки 'Получено' и/или 'Проверено'.", "Найденные заголовки:"]
+        for i, c in enumerate(lower[:12]):
+            msg_lines.append(f"{i}: {c}")
+        msg_lines.append("Если хотите, пришлите первый лист xlsx или укажите номер строки заголовка.")
+        raise SchemaError("\n".join(msg_lines), mapping)
+    return mapping
+
+
+def _detect_lessons(raw: pd.DataFrame) -> ColumnMapping:
+    labels = _labels(_header_rows(raw, 0, 0))
+    # По умолчанию 'Тема урока', иначе колонка с 'тема' в имени, иначе первая непустая
+    topic = labels.index('Тема урока') if 'Тема урока' in labels else _first([c.lower() for c in labels], TOPIC_RE)
+    if topic is None:
+        data = raw.iloc[1:]
+        topic = next((i for i in range(data.shape[1]) if data.iloc[:, i].notna().any()), None)
+    if topic is None:
+        raise SchemaError("❌ Не удалось определить колонку с темами уроков.")
+    lower = [c.lower() for c in labels]
+    group = _first(lower, GROUP_RE)
+    discipline = _first(lower, DISCIPLINE_RE)
+    return _mapping('lessons', raw, 0, 0, {
+        'topic': topic,
+        'group': group if group != topic else None,
+        'discipline': discipline if discipline != topic else None,
+    })
+
+
+def _detect_students(raw: pd.DataFrame) -> ColumnMapping:
+    labels = _labels(_header_rows(raw, 0, 0))
+    roles = {name.lower(): (labels.index(name) if name in labels else None)
+             for name in ('FIO', 'Homework', 'Classroom')}
+    roles['group'] = labels.index('Группа') if 'Группа' in labels else None
+    mapping = _mapping('students', raw, 0, 0, roles)
+    if any(roles[r] is None for r in ('fio', 'homework', 'classroom')):
+        raise SchemaError("❌ Нет нужных колонок в файле", mapping)
+    return mapping
+
+
+def _detect_schedule(raw: pd.DataFrame) -> ColumnMapping:
+    labels = _labels(_header_rows(raw, 0, 0))
+    lower = [c.lower() for c in labels]
+    group = labels.index('Группа') if 'Группа' in labels else None
+    # номер пары / время — колонки между группой и сеткой по дням (по умолчанию 1 и 2)
+    slot = _first(lower[:3], SLOT_RE)
+    time = _first(lower[:3], TIME_RE)
+    mapping = _mapping('schedule', raw, 0, 0, {
+        'group': group,
+        'slot': slot if slot is not None else (1 if len(labels) > 1 and group != 1 else None),
+        'time': time if time is not None else (2 if len(labels) > 2 and group != 2 else None),
+    })
+    if mapping.index('group') is None:
+        raise SchemaError("❌ В файле не найдена колонка 'Группа'. Файл некорректный.", mapping)
+    return mapping
+
+
+DETECTORS: Dict[str, Callable[[pd.DataFrame], ColumnMapping]] = {
+    'attendance': _detect_attendance,
+    'homework_submit': _detect_homework_submit,
+    'homework_check': _detect_homework_check,
+    'lessons': _detect_lessons,
+    'students': _detect_students,
+    'schedule': _detect_schedule,
+}
+
+# Тип отчёта по самому файлу (для пакетной загрузки, где пользователь тип не выбирает).
+# Детекторы выше снисходительны (attendance и lessons берут колонки по умолчанию),
+# поэтому здесь требуется явный признак в заголовке; порядок — от самых строгих.
+_TYPE_EVIDENCE: Tuple[Tuple[str, Callable[[ColumnMapping], bool]], ...] = (
+    ('homework_check', lambda m: True),
+    ('students', lambda m: True),
+    ('homework_submit', lambda m: True),
+    ('lessons', lambda m: any(TOPIC_RE.search(c.lower()) for c in m.labels)),
+    ('schedule', lambda m: any(SLOT_RE.search(c.lower()) or TIME_RE.search(c.lower()) for c in m.labels[:3])),
+    ('attendance', lambda m: bool(TEACHER_RE.search(m.labels[m.index('teacher')].lower())
+                                  and ATTENDANCE_RE.search(m.labels[m.index('attendance')].lower()))),
+)
+
+
+def detect_report_type(raw: pd.DataFrame) -> Optional[str]:
+    """Тип отчёта по пробе листа (header=None) или None, если ни один не подходит уверенно."""
+    if raw.empty:
+        return None
+    for report_type, has_evidence in _TYPE_EVIDENCE:
+        try:
+            mapping = DETECTORS[report_type](raw)
+        except SchemaError:
+            continue
+        if has_evidence(mapping):
+            return report_type
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Кэш по отпечатку раскладки заголовка
+# ---------------------------------------------------------------------------
+
+_cache: "OrderedDict[str, ColumnMapping]" = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def layout_fingerprint(report_type: str, raw: pd.DataFrame) -> str:
+    """Отпечаток раскладки: число колонок, текст первой строки и типы ячеек второй.
+
+    Во второй строке берутся только типы (пусто/число/текст), чтобы смена данных
+    в первой строке данных не ломала попадание в кэш.
+    """
+    h = hashlib.sha1(report_type.encode('utf-8'))
+    h.update(str(raw.shape[1]).encode())
+    for row in _header_rows(raw, 0, 0) if len(raw) else ():
+        h.update("\x1f".join(c.casefold() for c in row).encode('utf-8'))
+    if len(raw) > 1:
+        kinds = ['n' if isinstance(v, (int, float)) and not pd.isna(v) else 'e' if _cell(v) == '' else 's'
+                 for v in raw.iloc[1].tolist()]
+        h.update("".join(kinds).encode())
+    return h.hexdigest()
+
+
+def probe(file_path: str, nrows: int = PROBE_ROWS, sheet_name: Any = 0) -> pd.DataFrame:
+    """Первые строки листа без разбора заголовка."""
+    return readers.read_excel(file_path, header=None, nrows=nrows, sheet_name=sheet_name)
+
+
+def infer(file_path: str, report_type: str, raw: Optional[pd.DataFrame] = None) -> ColumnMapping:
+    """Определить раскладку листа. Бросает SchemaError, если обязательных колонок нет."""
+    if raw is None:
+        raw = probe(file_path)
+    if raw.empty:
+        raise SchemaError("❌ Файл пустой.")
+
+    fp = layout_fingerprint(report_type, raw)
+    with _cache_lock:
+        cached = _cache.get(fp)
+        if cached is not None:
+            _cache.move_to_end(fp)
+    # совпадение отпечатка проверяем по сырым строкам заголовка
+    if cached is not None and _header_rows(raw, cached.header_row - len(cached.header_cells) + 1,
+                                           cached.header_row) == cached.header_cells:
+        with _cache_lock:
+            _stats['hits'] += 1
+        return cached
+
+    mapping = DETECTORS[report_type](raw)
+    with _cache_lock:
+        # счётчики меняются из потоков пула (пакетная загрузка, архивы) — под тем же замком
+        _stats['misses'] += 1
+        _cache[fp] = mapping
+        while len(_cache) > SCHEMA_CACHE_SIZE:
+            _cache.popitem(last=False)
+    logger.info("Schema for %s detected: header_row=%d roles=%s", report_type, mapping.header_row, mapping.roles)
+    return mapping
+
+
+def read(file_path: str, mapping: ColumnMapping, roles: Optional[Iterable[str]] = None,
+         **kwargs) -> pd.DataFrame:
+    """Прочитать лист по найденной раскладке; колонки подписаны mapping.labels.
+
+    Если заданы roles, читаются только колонки этих ролей (usecols), остальные
+    даже не разбираются. Колонки ролей сразу приводятся к компактным типам
+    (см. ROLE_DTYPES).
+    """
+    usecols = None
+    if roles is not None:
+        usecols = sorted({mapping.roles[r] for r in roles if mapping.roles.get(r) is not None})
+    progress.stage("чтение файла")
+    # полное чтение — в пуле процессов, если он включён (PARSE_PROCESSES)
+    df = parse_pool.read_excel(file_path, header=None, skiprows=mapping.header_row + 1, usecols=usecols, **kwargs)
+    if usecols is not None:
+        df.columns = [mapping.labels[i] for i in usecols]
+    else:
+        labels = list(mapping.labels)
+        if df.shape[1] > len(labels):
+            labels += [f"Unnamed: {i}" for i in range(len(labels), df.shape[1])]
+        df.columns = labels[: df.shape[1]]
+    progress.checkpoint()  # отменили, пока читался файл
+    return _compact(df, mapping)
+
+
+def _compact(df: pd.DataFrame, mapping: ColumnMapping) -> pd.DataFrame:
+    for role, idx in mapping.roles.items():
+        dtype = ROLE_DTYPES.get(role.split('_', 1)[0])
+        label = mapping.labels[idx] if idx is not None else None
+        if dtype is None or label not in df.columns:
+            continue
+        col = df[label]
+        if dtype == 'category':
+            df[label] = col.astype('category')
+        elif pd.api.types.is_integer_dtype(col):
+            # целые оценки/счётчики без пропусков: int8/int16 вместо int64
+            df[label] = pd.to_numeric(col, downcast='integer')
+        elif pd.api.types.is_numeric_dtype(col):
+            # текстовые значения ('45%', '1,5') оставляем как есть — их чистят обработчики
+            df[label] = col.astype(dtype)
+    return df
+
+
+def cache_stats() -> Dict[str, int]:
+    with _cache_lock:
+        return dict(_stats, size=len(_cache))
@@ -0,0 +1,127 @@
+"""Хранение состояния диалогов и user_data/chat_data в той же базе, что и очередь задач.
+
+Нужно в раздельном режиме (QUEUE_DB): выбор отчёта и периода переживает перезапуск
+процесса приёма апдейтов и виден другим процессам. user_data и chat_data
+перечитываются из базы перед каждым апдейтом (refresh_*), поэтому изменения из
+другого процесса подхватываются сразу — если только у этого процесса нет своих
+ещё не записанных изменений (PTB пишет раз в PERSIST_INTERVAL секунд), их не
+затираем. Состояния диалогов читаются при старте.
+bot_data не сохраняется: там только клавиатура, которую main создаёт заново.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .task_queue import connect
+
+logger = logging.getLogger(__name__)
+
+# как часто PTB сбрасывает изменения состояния в базу
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "1"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, path: str, update_interval: float = PERSIST_INTERVAL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, callback_data=False),
+                         update_interval=update_interval)
+        self.path = path
+        self._db = connect(path)
+        self._db.executescript(SCHEMA)
+        # (kind, key) -> последнее записанное/прочитанное значение (JSON)
+        self._synced: Dict[Tuple[str, str], str] = {}
+
+    # --- низкоуровневые операции (в потоке, чтобы не блокировать цикл событий) ---
+
+    async def _run(self, sql: str, params: Tuple = ()) -> list:
+        return await asyncio.to_thread(lambda: self._db.execute(sql, params).fetchall())
+
+    async def _load(self, kind: str) -> Dict[str, Any]:
+        rows = await self._run("SELECT key, value FROM state WHERE kind = ?", (kind,))
+        for key, value in rows:
+            self._synced[(kind, key)] = value
+        return {key: json.loads(value) for key, value in rows}
+
+    async def _put(self, kind: str, key: str, value: Any) -> None:
+        text = json.dumps(value, ensure_ascii=False, default=str)
+        self._synced[(kind, key)] = text
+        await self._run("INSERT OR REPLACE INTO state (kind, key, value) VALUES (?, ?, ?)", (kind, key, text))
+
+    async def _refresh(self, kind: str, key: str, data: Dict[Any, Any]) -> None:
+        synced = self._synced.get((kind, key))
+        if synced is not None and json.dumps(data, ensure_ascii=False, default=str) != synced:
+            return  # есть свои незаписанные изменения
+        rows = await self._run("SELECT value FROM state WHERE kind = ? AND key = ?", (kind, key))
+        if rows:
+            self._synced[(kind, key)] = rows[0][0]
+            data.clear()
+            data.update(json.loads(rows[0][0]))
+
+    async def _drop(self, kind: str, key: str) -> None:
+        self._synced.pop((kind, key), None)
+        await self._run("DELETE FROM state WHERE kind = ? AND key = ?", (kind, key))
+
+    # --- BasePersistence ---
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {int(k): v for k, v in (await self._load('user')).items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {int(k): v for k, v in (await self._load('chat')).items()}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        return {tuple(json.loads(k)): v for k, v in (await self._load(f'conv:{name}')).items()}
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        if new_state is None:
+            await self._drop(f'conv:{name}', json.dumps(list(key)))
+        else:
+            await self._put(f'conv:{name}', json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        await self._put('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        await self._put('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._drop('user', str(user_id))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._drop('chat', str(chat_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        await self._refresh('user', str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        await self._refresh('chat', str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self._db.close)
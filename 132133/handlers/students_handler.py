@@ -1,55 +1,85 @@
 """Обработчик отчета по студентам — ИЛИ условие"""
 import logging
+import numpy as np
 import pandas as pd
 from telegram import Update
 from telegram.helpers import escape_markdown
 from telegram.ext import ContextTypes
-from .report_store import send_and_store
+from .report_store import send_and_store, store_report
+from .report_delta import evaluate_incremental, format_delta, chat_scope
+from . import schema, rules
+from .logging_setup import lazy
 
 logger = logging.getLogger(__name__)
 
 async def start_students_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    ruleset = rules.rules_for(chat_scope(update), 'students')
     if update.callback_query:
         await update.callback_query.edit_message_text(
             "👥 *Отчет по студентам*\n\n"
             "Загрузите файл:\n"
             "• Отчет по студентам.xls или .xlsx\n\n"
             "Бот найдёт студентов с:\n"
-            "• ДЗ = 1 *или*\n"
-            "• Классная работа < 3",
+            + " *или*\n".join(f"• {r.describe()}" for r in ruleset.rules),
             parse_mode='Markdown'
         )
     else:
         await update.message.reply_text(
             "👥 Загрузите файл с данными студентов.\n"
-            "Бот покажет студентов с ДЗ = 1 ИЛИ классной работой < 3"
+            f"Бот покажет студентов с {ruleset.describe()}"
         )
 
 async def process_students_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_path: str) -> None:
     try:
-        df = pd.read_excel(file_path, header=0)
-
-        print("\n=== ДАННЫЕ ИЗ ФАЙЛА (последние строки) ===")
-        if all(col in df.columns for col in ['FIO', 'Homework', 'Classroom']):
-            print(df[['FIO', 'Homework', 'Classroom']].tail(10).to_string())
-        print("===========================================\n")
-
-        if not all(col in df.columns for col in ['FIO', 'Homework', 'Classroom']):
-            await update.message.reply_text("❌ Нет нужных колонок в файле")
+        try:
+            mapping = schema.infer(file_path, 'students')
+        except schema.SchemaError as e:
+            await update.message.reply_text(str(e))
             return
+        df = schema.read(file_path, mapping, roles=('fio', 'homework', 'classroom', 'group'))
+
+        # хвост таблицы форматируется, только если DEBUG-запись действительно выводится
+        logger.debug("Данные из файла (последние строки):\n%s",
+                     lazy(lambda: df[['FIO', 'Homework', 'Classroom']].tail(10).to_string()))
 
         df['Homework'] = pd.to_numeric(df['Homework'], errors='coerce')
         df['Classroom'] = pd.to_numeric(df['Classroom'], errors='coerce')
 
         # Проверяем наличие колонки 'Группа'
-        has_group = 'Группа' in df.columns
+        has_group = mapping.index('group') is not None
 
-        mask = (df['Homework'] == 1) | (df['Classroom'] < 3)
+        # все правила чата (по умолчанию «ДЗ = 1» и «Классная < 3») — одной матрицей
+        ruleset = rules.rules_for(chat_scope(update), 'students')
+        hits = ruleset.matrix(pd.DataFrame({'homework': df['Homework'], 'classroom': df['Classroom']}))
+        mask = hits.any(axis=1)
         cols_to_copy = ['FIO', 'Homework', 'Classroom']
         if has_group:
             cols_to_copy.append('Группа')
         problems = df[mask][cols_to_copy].copy()
         problems['FIO'] = problems['FIO'].str.strip()
+        problem_hits = hits[mask]
+
+        # строки отчёта для уточняющих вопросов (см. query_engine);
+        # разбираем заново только строки, изменившиеся с прошлой загрузки (см. report_delta)
+        def evaluate(row):
+            if pd.isna(row['FIO']):
+                return None
+            hw = row['Homework']
+            cw = row['Classroom']
+            return {
+                'name': str(row['FIO']).strip(),
+                'group': str(row['Группа']).strip() if has_group and pd.notna(row['Группа']) else '',
+                'homework': float(hw) if pd.notna(hw) else None,
+                'classroom': float(cw) if pd.notna(cw) else None,
+                'value': float(cw) if pd.notna(cw) else None,
+            }
+
+        key_cols = ['FIO', 'Группа'] if has_group else ['FIO']
+        rows, delta = evaluate_incremental(
+            chat_scope(update), 'students', df[cols_to_copy], key_cols, evaluate,
+            is_problem=ruleset.row,
+        )
+        stored = store_report(update, 'students', rows, threshold=ruleset.threshold, rules=ruleset)
 
         report = "👥 *Отчет по студентам с проблемами*\n\n"
 
@@ -58,14 +88,14 @@ async def process_students_file(update: Update, context: ContextTypes.DEFAULT_TY
         else:
             count_text = "студент" if len(problems) == 1 else "студента" if 2 <= len(problems) % 10 <= 4 and len(problems) % 100 not in [12,13,14] else "студентов"
             report += f"⚠️ Найдено {len(problems)} {count_text}:\n\n"
-            for _, row in problems.iterrows():
+            for (_, row), row_hits in zip(problems.iterrows(), problem_hits):
                 hw = row['Homework']
                 cw = row['Classroom']
                 reason = []
-                if pd.notna(hw) and hw == 1:
-                    reason.append("ДЗ = 1 🔥")
-                if pd.notna(cw) and cw < 3:
-                    reason.append("Классная < 3 ⚠️")
+                for j in np.flatnonzero(row_hits):
+                    rule = ruleset.rules[j]
+                    mark = "🔥" if any(c.op == '==' for c in rule.conditions) else "⚠️"
+                    reason.append(f"{rule.describe()} {mark}")
 
                 report += f"• *{row['FIO']}*"
                 if has_group:
@@ -77,9 +107,11 @@ async def process_students_file(update: Update, context: ContextTypes.DEFAULT_TY
                     report += f"  Причина: {', '.join(reason)}\n"
                 report += "\n"
 
+        report += "\n".join(format_delta(delta, 'students'))
+
         # Экранируем спецсимволы и отправляем безопасно в MarkdownV2
         escaped_report = escape_markdown(report, version=2)
-        await send_and_store(update, context, escaped_report, parse_mode='MarkdownV2', metadata={'type': 'students'})
+        await send_and_store(update, context, escaped_report, parse_mode='MarkdownV2', metadata={'type': 'students', 'report': stored})
 
     except Exception as e:
         logger.exception("Ошибка в отчете по студентам")
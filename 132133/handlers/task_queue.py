@@ -0,0 +1,215 @@
+"""Общая очередь задач на SQLite для раздельного режима (QUEUE_DB).
+
+Процесс `main.py` принимает апдейты и ставит тяжёлую обработку файлов в очередь,
+процессы `worker.py` (сколько угодно, на той же машине/диске) забирают задачи и
+отправляют результаты сами.
+
+Доставка «хотя бы один раз»: задача берётся в аренду на QUEUE_LEASE_SECONDS (воркер
+продлевает аренду, пока работает); если воркер упал, по истечении аренды задачу
+заберёт другой. После QUEUE_MAX_ATTEMPTS попыток задача помечается failed.
+Повторная обработка не дублирует сообщения: каждое отправленное сообщение задачи
+записывается в таблицу sent под своим порядковым номером, и при повторе уже
+отправленные номера пропускаются (см. worker.Outbox). Повторные доставки одного
+апдейта отсекаются уникальным dedupe_key. /cancel помечает задачи чата cancelled:
+ещё не взятые воркер не возьмёт, а начатую бросит, когда не сможет продлить аренду.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DB = os.getenv("QUEUE_DB", "")
+QUEUE_LEASE_SECONDS = float(os.getenv("QUEUE_LEASE_SECONDS", "300"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+# сколько хранить выполненные задачи (и журнал их сообщений) для отсечения дублей
+QUEUE_KEEP_SECONDS = float(os.getenv("QUEUE_KEEP_SECONDS", str(7 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, lease_until);
+CREATE TABLE IF NOT EXISTS sent (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    message_id INTEGER,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+def enabled() -> bool:
+    return bool(QUEUE_DB)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Соединение для нескольких процессов: WAL, ожидание блокировки, явные транзакции."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class TaskQueue:
+    def __init__(self, path: str = QUEUE_DB):
+        if not path:
+            raise ValueError("QUEUE_DB is not set")
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> Optional[int]:
+        """id новой задачи или None, если задача с таким dedupe_key уже есть."""
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO jobs (kind, dedupe_key, payload, created, updated) VALUES (?, ?, ?, ?, ?)",
+            (kind, dedupe_key, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        return cur.lastrowid if cur.rowcount else None
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Взять в аренду самую старую готовую задачу (новую или с истёкшей арендой)."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, kind, payload, attempts = row
+            if attempts >= QUEUE_MAX_ATTEMPTS:
+                # воркер падал на этой задаче каждый раз — больше не берём
+                conn.execute("UPDATE jobs SET status = 'failed', error = COALESCE(error, 'lease expired'), updated = ? "
+                             "WHERE id = ?", (now, job_id))
+                conn.execute("COMMIT")
+                logger.error("Job %s failed after %d attempts", job_id, attempts)
+                return self.claim(worker)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, updated = ? "
+                "WHERE id = ?",
+                (worker, now + QUEUE_LEASE_SECONDS, now, job_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(job_id, kind, json.loads(payload), attempts + 1)
+
+    def extend(self, job_id: int, worker: str) -> bool:
+        """Продлить аренду; False — задачу уже забрал другой воркер."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + QUEUE_LEASE_SECONDS, job_id, worker),
+        )
+        return cur.rowcount > 0
+
+    def complete(self, job_id: int, worker: str) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', lease_until = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time(), job_id, worker),
+        )
+
+    def cancel(self, chat_id: int) -> int:
+        """Отменить ожидающие и выполняющиеся задачи чата; возвращает их число."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'cancelled', lease_until = NULL, updated = ? "
+            "WHERE status IN ('queued', 'running') AND json_extract(payload, '$.chat_id') = ?",
+            (time.time(), chat_id),
+        )
+        if cur.rowcount:
+            logger.info("Cancelled %d queued jobs of chat %s", cur.rowcount, chat_id)
+        return cur.rowcount
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """Вернуть задачу в очередь (или пометить failed после последней попытки). True — попыток больше не будет."""
+        conn = self._conn()
+        row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        final = row is None or row[0] >= QUEUE_MAX_ATTEMPTS
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, lease_until = NULL, error = ?, updated = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            ('failed' if final else 'queued', error[:2000], time.time(), job_id, worker),
+        )
+        # отменённую (или уже чужую) задачу не возвращаем в очередь и о ней не сообщаем
+        return final and cur.rowcount > 0
+
+    def sent_message(self, job_id: int, seq: int) -> Optional[int]:
+        row = self._conn().execute("SELECT message_id FROM sent WHERE job_id = ? AND seq = ?", (job_id, seq)).fetchone()
+        return row[0] if row else None
+
+    def record_sent(self, job_id: int, seq: int, message_id: Optional[int]) -> None:
+        self._conn().execute("INSERT OR REPLACE INTO sent (job_id, seq, message_id) VALUES (?, ?, ?)",
+                             (job_id, seq, message_id))
+
+    def purge(self) -> int:
+        """Удалить давно выполненные задачи и их журнал сообщений."""
+        conn = self._conn()
+        cutoff = time.time() - QUEUE_KEEP_SECONDS
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM sent WHERE job_id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed', "
+                         "'cancelled') AND updated < ?)", (cutoff,))
+            cur = conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated < ?",
+                               (cutoff,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+_queue: Optional[TaskQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> TaskQueue:
+    """Очередь процесса main.py: одна на процесс (соединение — своё у каждого потока).
+
+    Вызовы блокирующие (busy_timeout, пока воркер держит BEGIN IMMEDIATE) — из цикла
+    событий только через asyncio.to_thread.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = TaskQueue()
+        return _queue
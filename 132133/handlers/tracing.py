@@ -0,0 +1,260 @@
+"""Трассировка обработки апдейта: скачивание, разбор, расчёт, отправка.
+
+Спаны пишутся локально в TRACE_FILE (JSONL) в формате OTLP/JSON — как файловый
+экспортер OpenTelemetry Collector: одна строка — один trace
+({"resourceSpans": [...]}), такой файл читает filereceiver коллектора и
+импортируют Jaeger/Tempo. Без TRACE_FILE трассировка выключена и span() почти
+ничего не стоит.
+
+Текущий спан хранится в contextvar, поэтому вложенность внутри одной задачи
+asyncio получается сама. В потоки (run_in_executor) контекст передаётся через
+wrap(fn), в процесс воркера — через W3C traceparent в задаче очереди
+(traceparent() / span(..., parent=...)).
+
+Выборка — по хвосту: спаны копятся в памяти, пока не закончится локальный корень
+трассы, и только тогда решается, писать ли её. Пишутся трассы с ошибкой, трассы
+дольше TRACE_SLOW_MS и самые медленные TRACE_KEEP_SLOWEST_PCT процентов среди
+последних TRACE_WINDOW трасс. Воркер принимает решение по своей части трассы
+независимо от процесса приёма.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import inspect
+import secrets
+import functools
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_KEEP_SLOWEST_PCT = float(os.getenv("TRACE_KEEP_SLOWEST_PCT", "10"))
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", "200"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "report-bot")
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    local_root: bool
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+_lock = threading.Lock()
+_open: Dict[str, List[Span]] = {}
+_durations: Deque[float] = deque(maxlen=TRACE_WINDOW)
+_stats = {'traces': 0, 'kept': 0}
+_export_queue: "queue.SimpleQueue[Optional[List[Span]]]" = queue.SimpleQueue()
+_writer: Optional[threading.Thread] = None
+
+
+def enabled() -> bool:
+    return bool(TRACE_FILE)
+
+
+def traceparent() -> Optional[str]:
+    """W3C traceparent текущего спана — чтобы продолжить трассу в другом процессе."""
+    current = _current.get()
+    if current is None:
+        return None
+    return f"00-{current.trace_id}-{current.span_id}-01"
+
+
+def _parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+@contextmanager
+def span(name: str, parent: Optional[str] = None, **attributes: Any) -> Iterator[Any]:
+    """Спан вокруг блока кода (в т.ч. с await внутри). parent — traceparent из другого процесса."""
+    if not enabled():
+        yield _NOOP
+        return
+    current = _current.get()
+    remote = _parse_traceparent(parent) if current is None else None
+    if current is not None:
+        s = Span(current.trace_id, secrets.token_hex(8), current.span_id, name, local_root=False)
+    elif remote is not None:
+        s = Span(remote[0], secrets.token_hex(8), remote[1], name, local_root=True)
+    else:
+        s = Span(secrets.token_hex(16), secrets.token_hex(8), None, name, local_root=True)
+    s.attributes.update(attributes)
+    if s.local_root:
+        with _lock:
+            _open[s.trace_id] = []
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # спан закрыт в другом контексте (не должно случаться) — просто снимаем его
+            _current.set(current)
+        _finish(s)
+
+
+def traced(name: str):
+    """Декоратор функции (обычной или async): каждый вызов — спан с именем name."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+        else:
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return fn(*args, **kwargs)
+        return functools.wraps(fn)(wrapper)
+    return decorator
+
+
+def wrap(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """fn, которая выполнится в текущем контексте трассировки (для run_in_executor)."""
+    if not enabled():
+        return fn
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+    return run
+
+
+def _finish(s: Span) -> None:
+    with _lock:
+        spans = _open.get(s.trace_id)
+        if spans is None:
+            return  # корень уже закрыт (спан из потока, который пережил обработку)
+        if len(spans) < TRACE_MAX_SPANS:
+            spans.append(s)
+        if not s.local_root:
+            return
+        del _open[s.trace_id]
+        keep = _keep(s, spans)
+    if keep:
+        _export(spans)
+
+
+def _keep(root: Span, spans: List[Span]) -> bool:
+    """Решение выборки по завершённой трассе (вызывается под _lock)."""
+    duration = root.duration_ms
+    _stats['traces'] += 1
+    window = sorted(_durations)
+    _durations.append(duration)
+    keep = any(sp.error for sp in spans) or duration >= TRACE_SLOW_MS
+    if not keep and len(window) >= 20 and TRACE_KEEP_SLOWEST_PCT > 0:
+        threshold = window[min(len(window) - 1, int(len(window) * (1 - TRACE_KEEP_SLOWEST_PCT / 100)))]
+        keep = duration >= threshold
+    if keep:
+        _stats['kept'] += 1
+    return keep
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def _otlp(s: Span) -> Dict[str, Any]:
+    data = {
+        'traceId': s.trace_id,
+        'spanId': s.span_id,
+        'name': s.name,
+        'kind': 1,  # SPAN_KIND_INTERNAL
+        'startTimeUnixNano': str(s.start_ns),
+        'endTimeUnixNano': str(s.end_ns),
+        'attributes': [_attribute(k, v) for k, v in s.attributes.items() if v is not None],
+        'status': {'code': 2, 'message': s.error} if s.error else {'code': 0},
+    }
+    if s.parent_id:
+        data['parentSpanId'] = s.parent_id
+    return data
+
+
+def _export(spans: List[Span]) -> None:
+    _start_writer()
+    _export_queue.put(spans)
+
+
+def _write_loop() -> None:
+    # сериализация и запись в файл — в отдельном потоке, не в цикле событий
+    while True:
+        spans = _export_queue.get()
+        if spans is None:
+            return
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', SERVICE_NAME),
+                                        _attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [_otlp(s) for s in spans]}],
+        }]}, ensure_ascii=False, default=str)
+        try:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except OSError:
+            logger.exception("Не удалось записать трассу в %s", TRACE_FILE)
+
+
+def _start_writer() -> None:
+    global _writer
+    if _writer is not None:
+        return
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="trace-writer", daemon=True)
+            _writer.start()
+            atexit.register(_stop_writer)
+
+
+def _stop_writer() -> None:
+    if _writer is not None:
+        _export_queue.put(None)
+        _writer.join(timeout=5)
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, 'open_traces': len(_open)}
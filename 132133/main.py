@@ -1,9 +1,16 @@
 import os
 import sys
+import time
+import asyncio
 import logging
 import tempfile
+import threading
+import importlib
 from dotenv import load_dotenv
 
+# от старта процесса: по нему видно, сколько ждёт первый /start после холодного старта
+_BOOT = time.perf_counter()
+
 # Загрузить переменные окружения из .env
 load_dotenv()
 
@@ -16,24 +23,74 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ContextTypes,
+    TypeHandler,
 )
 
-from handlers import (
-    schedule_handler,
-    lessons_handler,
-    students_handler,
-    attendance_handler,
-    homework_check_handler,
-    homework_submit_handler,
-    ai_handler,
-)
+# очередь задач, жизненный цикл процесса и логирование — без pandas, грузятся сразу
+from handlers import task_queue, lifecycle, logging_setup, tracing, profiler, progress, parse_pool
 
-# Настройка логирования
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# Настройка логирования: запись и форматирование — в фоновом потоке (см. logging_setup)
+logging_setup.configure()
 logger = logging.getLogger(__name__)
 
+# Модули обработчиков (и вместе с ними pandas) загружаются при первом обращении к отчёту,
+# а не при старте: после сна на бесплатном тарифе Render бот отвечает на /start сразу.
+# PREWARM=1 (по умолчанию) — догрузить их в фоне сразу после запуска.
+PREWARM = os.getenv("PREWARM", "1").lower() not in ("0", "false", "no", "")
+HANDLER_MODULES = (
+    "readers", "schema", "attendance_handler", "homework_check_handler", "homework_submit_handler",
+    "students_handler", "lessons_handler", "schedule_handler", "ai_handler", "dashboard_handler",
+    "rules", "report_runner", "archive_handler",
+)
+_import_lock = threading.Lock()
+_first_start_logged = False
+
+
+def load_handler(name: str):
+    """handlers.<name>, импортированный при первом обращении (время импорта пишется в лог)."""
+    module = sys.modules.get(f"handlers.{name}")
+    if module is not None:
+        return module
+    with _import_lock:
+        started = time.perf_counter()
+        module = importlib.import_module(f"handlers.{name}")
+        logger.info("Loaded handlers.%s in %.0f ms", name, (time.perf_counter() - started) * 1000)
+    return module
+
+
+def lazy(module: str, attr: str):
+    """Колбэк для PTB, который загружает модуль обработчика при первом вызове."""
+    @lifecycle.tracked(f"{module}.{attr}")
+    @tracing.traced(f"{module}.{attr}")
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await getattr(load_handler(module), attr)(update, context)
+    callback.__name__ = attr
+    return callback
+
+
+def prewarm() -> None:
+    started = time.perf_counter()
+    for name in HANDLER_MODULES:
+        try:
+            load_handler(name)
+        except Exception:
+            logger.exception("Prewarm of handlers.%s failed", name)
+    logger.info("Prewarm finished in %.0f ms", (time.perf_counter() - started) * 1000)
+
+
+async def _post_init(application: Application) -> None:
+    logger.info("Bot ready %.0f ms after process start", (time.perf_counter() - _BOOT) * 1000)
+    if PREWARM:
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+    if parse_pool.enabled():
+        # процессы чтения таблиц поднимаются сейчас, а не на первом файле
+        threading.Thread(target=parse_pool.warm, name="parse-pool-warm", daemon=True).start()
+
+
+async def _post_shutdown(application: Application) -> None:
+    parse_pool.shutdown()
+
+
 # Состояния разговора 
 SCHEDULE = "schedule"
 LESSONS = "lessons"
@@ -87,6 +144,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 reply_markup=get_start_reply_keyboard(),
             )
 
+    global _first_start_logged
+    if not _first_start_logged:
+        _first_start_logged = True
+        logger.info("First /start answered %.0f ms after process start", (time.perf_counter() - _BOOT) * 1000)
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Справка по боту"""
     help_text = """
@@ -103,13 +165,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 *Как пользоваться:*
 1. Нажмите на нужный отчёт
-2. Загрузите соответствующий Excel-файл
+2. Загрузите соответствующий Excel-файл (или ту же выгрузку в CSV/TSV — так быстрее; несколько файлов — одним .zip)
 3. Получите результат
 
 Команды:
 /start — главное меню
 /help — эта справка
 /cancel — отменить текущую операцию
+/dashboard — сводка по людям из последних загруженных отчётов
+/rules — пороги отчётов в этом чате (например: /rules attendance value < 50)
+/subscribe, /unsubscribe — отчёты из пакетной загрузки (ночные выгрузки) в этот чат
 """
 
     if update.message:
@@ -120,6 +185,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """Обработка всех inline-кнопок"""
     query = update.callback_query
+    # «Отменить» под ходом обработки вне диалога (или уже после неё) — как /cancel
+    if query.data == progress.CANCEL_CALLBACK:
+        return await cancel(update, context)
     await query.answer()
 
     choice = query.data
@@ -137,29 +205,31 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # выбор периода по проверке ДЗ
     if choice in ("hw_check_month", "hw_check_week"):
         context.user_data["report_type"] = HOMEWORK_CHECK
-        await homework_check_handler.handle_hw_check_period(update, context)
+        await load_handler("homework_check_handler").handle_hw_check_period(update, context)
         return HOMEWORK_CHECK
 
-    # сопоставление кнопки с функцией запуска отчёта
+    # сопоставление кнопки с функцией запуска отчёта (модуль грузится при первом выборе)
     start_handlers = {
-        SCHEDULE: schedule_handler.start_schedule_report,
-        LESSONS: lessons_handler.start_lessons_report,
-        STUDENTS: students_handler.start_students_report,
-        ATTENDANCE: attendance_handler.start_attendance_report,
-        HOMEWORK_CHECK: homework_check_handler.start_homework_check_report,
-        HOMEWORK_SUBMIT: homework_submit_handler.start_homework_submit_report,
-        AI: ai_handler.start_ai_report,
+        SCHEDULE: ("schedule_handler", "start_schedule_report"),
+        LESSONS: ("lessons_handler", "start_lessons_report"),
+        STUDENTS: ("students_handler", "start_students_report"),
+        ATTENDANCE: ("attendance_handler", "start_attendance_report"),
+        HOMEWORK_CHECK: ("homework_check_handler", "start_homework_check_report"),
+        HOMEWORK_SUBMIT: ("homework_submit_handler", "start_homework_submit_report"),
+        AI: ("ai_handler", "start_ai_report"),
     }
 
-    handler_func = start_handlers.get(choice)
-    if handler_func:
+    target = start_handlers.get(choice)
+    if target:
         context.user_data["report_type"] = choice
         
-        await handler_func(update, context)
+        await getattr(load_handler(target[0]), target[1])(update, context)
         return choice
 
     return ConversationHandler.END
 
+@lifecycle.tracked("обработка файла")
+@tracing.traced("file_handler")
 async def file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """Единый обработчик всех загруженных файлов"""
     report_type = context.user_data.get("report_type")
@@ -169,11 +239,22 @@ async def file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
         return ConversationHandler.END
 
     document = update.message.document
-    if not document or not document.file_name.lower().endswith((".xls", ".xlsx")):
-        await update.message.reply_text("❌ Пожалуйста, отправьте файл Excel (.xls или .xlsx).")
+    extensions = load_handler("readers").SUPPORTED_EXTENSIONS
+    archive_handler = load_handler("archive_handler")
+    is_archive = bool(document and document.file_name.lower().endswith(".zip"))
+    if not document or not (is_archive or document.file_name.lower().endswith(extensions)):
+        await update.message.reply_text("❌ Пожалуйста, отправьте файл Excel (.xls, .xlsx, .ods), CSV/TSV или .zip с ними.")
         return report_type
+    if is_archive and (document.file_size or 0) > archive_handler.ARCHIVE_MAX_MB * 1024 * 1024:
+        await update.message.reply_text(f"❌ Архив больше {archive_handler.ARCHIVE_MAX_MB:g} МБ.")
+        return report_type
+
+    # раздельный режим: обработку выполняет worker.py, здесь только ставим задачу в очередь
+    if task_queue.enabled():
+        return await enqueue_file(update, context, report_type, is_archive)
 
-    await update.message.reply_text("📥 Файл получен, обрабатываю...")
+    # это сообщение показывает ход обработки, кнопка под ним её отменяет (см. progress)
+    status = await update.message.reply_text("📥 Файл получен, обрабатываю...", reply_markup=progress.cancel_keyboard())
 
     tmp_path = None
     try:
@@ -184,33 +265,41 @@ async def file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
             return report_type
 
         file_obj = await document.get_file()
-        # используем NamedTemporaryFile для безопасного управления временным файлом
-        tmp = tempfile.NamedTemporaryFile(prefix="bot_", suffix=".xlsx", delete=False)
+        # используем NamedTemporaryFile для безопасного управления временным файлом;
+        # формат потом определяется по содержимому (handlers.readers), суффикс — только для наглядности
+        suffix = os.path.splitext(document.file_name)[1].lower() or ".xlsx"
+        tmp = tempfile.NamedTemporaryFile(prefix="bot_", suffix=suffix, delete=False)
         tmp_path = tmp.name
         tmp.close()
-        await file_obj.download_to_drive(tmp_path)
+        with tracing.span("telegram.download", file_size=document.file_size):
+            await file_obj.download_to_drive(tmp_path)
         # помечаем как обработанный (чтобы избежать повторной обработки при дублированных апдейтах)
         context.user_data[processed_key] = True
 
-        # выбор процесса
-        processors = {
-            SCHEDULE: schedule_handler.process_schedule_file,
-            LESSONS: lessons_handler.process_lessons_file,
-            STUDENTS: students_handler.process_students_file,
-            ATTENDANCE: attendance_handler.process_attendance_file,
-            HOMEWORK_CHECK: homework_check_handler.process_homework_check_file,
-            HOMEWORK_SUBMIT: homework_submit_handler.process_homework_submit_file,
-        }
-
-        processor = processors.get(report_type)
-        if processor:
-            await processor(update, context, tmp_path)
+        report_runner = load_handler("report_runner")
+        chat_id = update.effective_chat.id
+        with profiler.job(f"{report_type}: {document.file_name}"):
+            if is_archive:
+                # каждый файл архива — отдельный отчёт того же типа (см. archive_handler)
+                with tracing.span("report.process", report_type=report_type, archive=True):
+                    await progress.track(status, archive_handler.process_archive(update, context, tmp_path, report_type))
+            elif report_type in report_runner.PROCESSORS:
+                # обработчик — в потоке пула, цикл событий свободен для /cancel и других чатов;
+                # ответы копятся и отправляются после (как в пакетной загрузке)
+                user_data = {k: v for k, v in context.user_data.items() if k == "hw_check_period"}
+                drafts = await progress.run(status, report_runner.executor(), report_runner.run_processor,
+                                            report_type, tmp_path, chat_id, user_data)
+                await report_runner.send_drafts(update.message.reply_text, chat_id, drafts)
 
         # возврат в главное меню
         await update.message.reply_text("✅ Готово! Выберите следующий отчёт:", reply_markup=get_main_keyboard())
         context.user_data.clear()
         return ConversationHandler.END
 
+    except progress.Cancelled:
+        # /cancel или кнопка «Отменить»: ответ уже дал cancel()
+        return ConversationHandler.END
+
     except Exception as e:
         logger.exception("Ошибка при обработке файла")
         await update.message.reply_text("❌ Произошла ошибка при обработке файла.")
@@ -224,24 +313,71 @@ async def file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
             except Exception:
                 logger.warning("Не удалось удалить временный файл: %s", tmp_path)
 
+async def enqueue_file(update: Update, context: ContextTypes.DEFAULT_TYPE, report_type: str, is_archive: bool) -> str:
+    """Поставить обработку загруженного файла в общую очередь (QUEUE_DB)."""
+    document = update.message.document
+    chat_id = update.effective_chat.id
+    payload = {
+        "report_type": report_type,
+        "file_id": document.file_id,
+        "file_name": document.file_name,
+        "chat_id": chat_id,
+        "is_archive": is_archive,
+        "user_data": {k: v for k, v in context.user_data.items() if k == "hw_check_period"},
+        # трасса продолжится в воркере (см. tracing)
+        "traceparent": tracing.traceparent(),
+    }
+    # повторная доставка того же апдейта (например, после перезапуска) не создаст вторую задачу
+    # первое обращение создаёт очередь (схема SQLite) — тоже вне цикла событий
+    dedupe_key = f"msg:{chat_id}:{update.message.message_id}"
+    job_id = await asyncio.to_thread(lambda: task_queue.get_queue().enqueue("report", payload, dedupe_key=dedupe_key))
+    if job_id is None:
+        await update.message.reply_text("❗ Этот файл уже обрабатывается или был обработан.")
+        return report_type
+    await update.message.reply_text(f"📥 Файл получен и поставлен в очередь (задача №{job_id}), результат придёт сюда.")
+    context.user_data.clear()
+    return ConversationHandler.END
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Отмена текущей операции"""
-    await update.message.reply_text("❌ Операция отменена.", reply_markup=get_main_keyboard())
+    """Отмена текущей операции (/cancel или кнопка «Отменить» под ходом обработки)"""
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    if update.callback_query:
+        await update.callback_query.answer()
+    # идущая обработка файла или запрос к AI действительно останавливаются (см. progress)
+    progress.cancel(chat_id)
+    if task_queue.enabled() and chat_id is not None:
+        # раздельный режим: задачи чата снимаются с очереди, воркер бросает начатую
+        await asyncio.to_thread(lambda: task_queue.get_queue().cancel(chat_id))
+    await update.effective_message.reply_text("❌ Операция отменена.", reply_markup=get_main_keyboard())
     context.user_data.clear()
+    # вместе с операцией завершаем и AI-сессию чата (загруженный файл, история)
+    # (если модуль ещё не загружен, сессий нет и загружать его ради этого незачем)
+    if "handlers.ai_session" in sys.modules:
+        sys.modules["handlers.ai_session"].drop(update.effective_chat.id if update.effective_chat else None)
     return ConversationHandler.END
 
-def main():
-    # Загружаем переменные окружения из .env файла
-    load_dotenv()
-    
-    # токен
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set")
-        sys.exit(1)
+async def busy(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Апдейт чата, в котором ещё идёт обработка файла или запроса (ConversationHandler.WAITING)"""
+    if update.callback_query:
+        await update.callback_query.answer(progress.BUSY_TEXT)
+    elif update.effective_message:
+        await update.effective_message.reply_text(progress.BUSY_TEXT)
+
+def build_application(token: str, **builder_options) -> Application:
+    """Application со всеми обработчиками (без запуска).
 
+    builder_options — дополнительные методы ApplicationBuilder, например
+    base_url/base_file_url для локального Bot API (см. tools/replay_loadtest.py).
+    """
     # создание приложения
-    application = Application.builder().token(token).build()
+    builder = Application.builder().token(token).post_init(_post_init).post_shutdown(_post_shutdown)
+    for option, value in builder_options.items():
+        builder = getattr(builder, option)(value)
+    if task_queue.enabled():
+        # раздельный режим: состояние диалогов — в общей базе, файлы обрабатывает worker.py
+        from handlers.sqlite_persistence import SQLitePersistence
+        builder = builder.persistence(SQLitePersistence(task_queue.QUEUE_DB))
+    application = builder.build()
 
     # store reusable objects in bot_data for handlers (e.g., main keyboard)
     application.bot_data["main_keyboard"] = get_main_keyboard()
@@ -249,31 +385,72 @@ def main():
     # ConversationHandler
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start), CallbackQueryHandler(button_handler)],
+        # обработка файла и запрос к AI не блокируют приём апдейтов (block=False): пока они идут,
+        # апдейты этого чата попадают в WAITING, где их ждут /cancel и кнопка «Отменить»
         states={
-            SCHEDULE: [MessageHandler(filters.Document.ALL, file_handler)],
-            LESSONS: [MessageHandler(filters.Document.ALL, file_handler)],
-            STUDENTS: [MessageHandler(filters.Document.ALL, file_handler)],
-            ATTENDANCE: [MessageHandler(filters.Document.ALL, file_handler)],
-            HOMEWORK_CHECK: [MessageHandler(filters.Document.ALL, file_handler)],
-            HOMEWORK_SUBMIT: [MessageHandler(filters.Document.ALL, file_handler)],
+            SCHEDULE: [MessageHandler(filters.Document.ALL, file_handler, block=False)],
+            LESSONS: [MessageHandler(filters.Document.ALL, file_handler, block=False)],
+            STUDENTS: [MessageHandler(filters.Document.ALL, file_handler, block=False)],
+            ATTENDANCE: [MessageHandler(filters.Document.ALL, file_handler, block=False)],
+            HOMEWORK_CHECK: [MessageHandler(filters.Document.ALL, file_handler, block=False)],
+            HOMEWORK_SUBMIT: [MessageHandler(filters.Document.ALL, file_handler, block=False)],
             AI: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, ai_handler.process_ai_query),
-                MessageHandler(filters.Document.ALL, ai_handler.process_ai_file),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, lazy("ai_handler", "process_ai_query"), block=False),
+                MessageHandler(filters.Document.ALL, lazy("ai_handler", "process_ai_file"), block=False),
+            ],
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel),
+                CallbackQueryHandler(cancel, pattern=f"^{progress.CANCEL_CALLBACK}$"),
+                CallbackQueryHandler(busy),
+                MessageHandler(filters.ALL, busy),
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True,
+        name="main",
+        persistent=task_queue.enabled(),
     )
 
+    # контекст логов (update_id, чат, тип отчёта) — до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, logging_setup.bind_update), group=-1)
+
     # Добавляем только этот хендлер и /help
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", help_command))
+    # /cancel вне диалога — например, для AI-ответа на reply
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("dashboard", lazy("dashboard_handler", "dashboard_command")))
+    application.add_handler(CommandHandler("rules", lazy("rules", "rules_command")))
+    application.add_handler(CommandHandler("subscribe", lazy("batch_ingest", "subscribe_command")))
+    application.add_handler(CommandHandler("unsubscribe", lazy("batch_ingest", "unsubscribe_command")))
+    application.add_handler(CommandHandler("profile", lazy("profiler", "profile_command")))
+
+    # пакетная загрузка выгрузок из BATCH_DIR (если задан) по расписанию JobQueue
+    if os.getenv("BATCH_DIR"):
+        load_handler("batch_ingest").schedule_jobs(application)
+    # проверка процессов чтения таблиц (PARSE_PROCESSES)
+    if parse_pool.enabled() and application.job_queue is not None:
+        application.job_queue.run_repeating(parse_pool.health_job, interval=parse_pool.PARSE_HEALTH_SECONDS,
+                                            first=parse_pool.PARSE_HEALTH_SECONDS, name="parse_pool_health")
 
     # Allow asking the AI by replying to any message (no need to enter AI mode)
     # Reply with text -> routed to process_ai_query
-    application.add_handler(MessageHandler(filters.TEXT & filters.REPLY, ai_handler.process_ai_query))
+    application.add_handler(MessageHandler(filters.TEXT & filters.REPLY, lazy("ai_handler", "process_ai_query"), block=False))
     # Reply with a document -> routed to process_ai_file
-    application.add_handler(MessageHandler(filters.Document.ALL & filters.REPLY, ai_handler.process_ai_file))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.REPLY, lazy("ai_handler", "process_ai_file"), block=False))
+    return application
+
+def main():
+    # Загружаем переменные окружения из .env файла
+    load_dotenv()
+    
+    # токен
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set")
+        sys.exit(1)
+
+    application = build_application(token)
 
     # Webhook конфиг для Render
     webhook_url = os.getenv("WEBHOOK_URL")
@@ -281,16 +458,17 @@ def main():
     listen = "0.0.0.0"
 
     if webhook_url:
-        print(f"🤖 Запускаю webhook на {listen}:{port}")
-        print(f"   Webhook URL: {webhook_url}/{token}")
-        application.run_webhook(
+        logger.info("Запускаю webhook на %s:%d, URL: %s/<token>", listen, port, webhook_url)
+        # свой сервер вместо run_webhook: /healthz, /readyz и плавная остановка по SIGTERM (см. lifecycle)
+        asyncio.run(lifecycle.serve_webhook(
+            application,
             listen=listen,
             port=port,
             url_path=f"/{token}",
             webhook_url=f"{webhook_url}/{token}",
-        )
+        ))
     else:
-        print("⚠️  WEBHOOK_URL не задан — работаю в polling-режиме (может быть медленнее на Render)")
+        logger.warning("WEBHOOK_URL не задан — работаю в polling-режиме (может быть медленнее на Render)")
         application.run_polling()
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import zipfile
+
+import pytest
+
+from handlers import archive_handler
+from handlers.archive_handler import ArchiveError, MB
+
+
+def _zip(tmp_path, members):
+    path = tmp_path / 'reports.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return zipfile.ZipFile(path)
+
+
+def test_list_members_skips_directories_and_service_files(tmp_path):
+    zf = _zip(tmp_path, {
+        'march/': b'',
+        'march/att.xlsx': b'x',
+        'march/sub.csv': b'x',
+        'march/~$att.xlsx': b'x',
+        '.hidden.xlsx': b'x',
+        '__MACOSX/march/._att.xlsx': b'x',
+        'photo.jpg': b'x',
+    })
+    assert [i.filename for i in archive_handler.list_members(zf)] == ['march/att.xlsx', 'march/sub.csv']
+
+
+def test_list_members_without_spreadsheets(tmp_path):
+    with pytest.raises(ArchiveError, match='нет таблиц'):
+        archive_handler.list_members(_zip(tmp_path, {'photo.jpg': b'x', 'notes.pdf': b'x'}))
+
+
+def test_list_members_limits_member_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive_handler, 'ARCHIVE_MAX_MEMBERS', 2)
+    zf = _zip(tmp_path, {f'{i}.csv': b'x' for i in range(3)})
+    with pytest.raises(ArchiveError, match='3 файлов'):
+        archive_handler.list_members(zf)
+
+
+def test_list_members_limits_declared_sizes(tmp_path, monkeypatch):
+    zf = _zip(tmp_path, {'a.csv': b'x' * MB, 'b.csv': b'x' * MB})
+    monkeypatch.setattr(archive_handler, 'ARCHIVE_MAX_MEMBER_MB', 0.5)
+    with pytest.raises(ArchiveError, match='a.csv'):
+        archive_handler.list_members(zf)
+    monkeypatch.setattr(archive_handler, 'ARCHIVE_MAX_MEMBER_MB', 1)
+    monkeypatch.setattr(archive_handler, 'ARCHIVE_MAX_TOTAL_MB', 1.5)
+    with pytest.raises(ArchiveError, match='1.5 МБ'):
+        archive_handler.list_members(zf)
+
+
+def test_extract_copies_member(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    zf = _zip(tmp_path, {'dir/att.CSV': b'a;b\n1;2\n'})
+    path = archive_handler._extract(zf, zf.getinfo('dir/att.CSV'))
+    assert path.endswith('.csv') and os.path.dirname(path) == str(tmp_path)
+    with open(path, 'rb') as f:
+        assert f.read() == b'a;b\n1;2\n'
+
+
+def test_extract_counts_actual_bytes_and_removes_partial_file(tmp_path, monkeypatch):
+    extract_dir = tmp_path / 'extract'
+    extract_dir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(extract_dir))
+    monkeypatch.setattr(archive_handler, 'COPY_CHUNK', 1024)
+    zf = _zip(tmp_path, {'big.csv': b'x' * 10_000})
+    info = zf.getinfo('big.csv')
+    # оглавлению не верим: лимит проверяется по прочитанным байтам
+    monkeypatch.setattr(archive_handler, 'ARCHIVE_MAX_MEMBER_MB', 4096 / MB)
+    with pytest.raises(ArchiveError, match='big.csv'):
+        archive_handler._extract(zf, info)
+    assert list(extract_dir.iterdir()) == []
@@ -0,0 +1,24 @@
+import asyncio
+from types import SimpleNamespace
+
+import pandas as pd
+
+from handlers import attendance_handler
+
+
+class _Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def test_schema_error_is_replied_to_the_message(tmp_path):
+    path = tmp_path / 'one_column.xlsx'
+    pd.DataFrame({'Преподаватель': ['Иванов И.И.']}).to_excel(path, index=False)
+    message = _Message()
+    update = SimpleNamespace(message=message, callback_query=None, effective_chat=SimpleNamespace(id=1))
+    context = SimpleNamespace(user_data={}, chat_data={})
+    asyncio.run(attendance_handler.process_attendance_file(update, context, str(path)))
+    assert message.replies == ["❌ Файл должен содержать минимум 2 колонки."]
@@ -0,0 +1,30 @@
+import logging
+import queue
+
+from handlers import logging_setup
+from handlers.logging_setup import lazy
+
+
+def _logger(name, level=logging.DEBUG):
+    records = queue.SimpleQueue()
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers[:] = [logging_setup._DeferredQueueHandler(records)]
+    logger.setLevel(level)
+    return logger, records
+
+
+def test_lazy_args_are_evaluated_in_callers_thread():
+    logger, records = _logger('tests.lazy_snapshot')
+    data = [1, 2]
+    logger.debug("data %s", lazy(lambda: list(data)))
+    # обработчик меняет данные сразу после вызова лога — в записи остаётся снимок
+    data.append(3)
+    assert records.get_nowait().getMessage() == "data [1, 2]"
+
+
+def test_lazy_args_are_not_evaluated_for_dropped_records():
+    logger, records = _logger('tests.lazy_dropped', level=logging.INFO)
+    calls = []
+    logger.debug("data %s", lazy(lambda: calls.append(1)))
+    assert calls == [] and records.empty()
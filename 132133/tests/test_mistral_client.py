@@ -0,0 +1,21 @@
+import logging
+
+from handlers import mistral_client
+
+
+def test_breaker_state_change_logs_counters(caplog):
+    breaker = mistral_client.CircuitBreaker(threshold=2, cooldown=0)
+    with caplog.at_level(logging.WARNING, logger=mistral_client.__name__):
+        breaker.record_failure()
+        breaker.record_failure()
+    assert breaker.state == 'open'
+    [record] = caplog.records
+    assert 'closed -> open' in record.getMessage()
+    assert 'opened_total=1' in record.getMessage()
+    assert 'short_circuited=' in record.getMessage()
+
+
+def test_get_stats_reports_breaker_state():
+    stats = mistral_client.get_stats()
+    assert stats['breaker_state'] == mistral_client.breaker.state
+    assert {'calls', 'retries', 'fallbacks', 'breaker_opened_total'} <= set(stats)
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from handlers.name_index import NameIndex, canonical, canonical_series
+
+
+@pytest.mark.parametrize('raw, key', [
+    ('Иванов И.И.', 'иванов ии'),
+    ('Иванов  Иван Иванович', 'иванов ии'),
+    ('ИВАНОВ И. И.', 'иванов ии'),
+    ('И.И. Иванов', 'иванов ии'),
+    ('Алёшин А.', 'алешин а'),
+    (None, ''),
+])
+def test_canonical(raw, key):
+    assert canonical(raw) == key
+
+
+def test_canonical_series_keeps_index():
+    s = pd.Series(['Иванов И.И.', None, 'Иванов И.И.'], index=[10, 11, 12])
+    assert canonical_series(s).tolist() == ['иванов ии', '', 'иванов ии']
+
+
+def _index(*keys):
+    index = NameIndex()
+    for key in keys:
+        index.add(key)
+    return index
+
+
+def test_exact_and_typo():
+    index = _index('иванов ии', 'константинопольский пп')
+    assert index.lookup('иванов ии') == 'иванов ии'
+    assert index.lookup('константинопольскй пп') == 'константинопольский пп'
+    assert index.lookup('иванов и') == 'иванов ии'
+
+
+@pytest.mark.parametrize('existing, wanted', [
+    ('иванов ии', 'иванова ии'),
+    ('петров ас', 'петрова а'),
+    ('бородин ав', 'бородина ав'),
+    ('достоевский фм', 'достоевская фм'),
+])
+def test_gendered_surnames_are_different_people(existing, wanted):
+    assert _index(existing).lookup(wanted) is None
+    assert _index(wanted).lookup(existing) is None
+
+
+def test_full_initials_must_match():
+    assert _index('иванов ип').lookup('иванов ии') is None
+
+
+def test_numbered_names_are_not_merged():
+    assert _index('студент1 с', 'студент11 с').lookup('студент12 с') is None
+
+
+def test_ambiguous_fuzzy_match_is_rejected():
+    # «иванов и» подходит и к «иванов ии», и к «иванов ип»
+    assert _index('иванов ии', 'иванов ип').lookup('иванов и') is None
+
+
+def test_resolve_series_adds_new_people():
+    index = NameIndex()
+    keys = pd.Series(['иванов ии', 'иванова ии', 'иванов ии'])
+    assert index.resolve_series(keys).tolist() == ['иванов ии', 'иванова ии', 'иванов ии']
+    assert len(index) == 2
@@ -0,0 +1,75 @@
+import pytest
+
+from handlers import query_engine
+from handlers.query_engine import answer, names_report, parse_intent
+
+REPORT = {
+    'type': 'attendance',
+    'rows': [
+        {'name': 'Иванов И.И.', 'group': '', 'value': 35.0},
+        {'name': 'Петров П.П.', 'group': '', 'value': 80.0},
+        {'name': 'Сидоров С.С.', 'group': '', 'value': 55.0},
+    ],
+}
+
+
+@pytest.mark.parametrize('text, action', [
+    ('кто меньше всех', 'bottom'),
+    ('последние 3', 'bottom'),
+    ('топ 2', 'top'),
+    ('средняя посещаемость', 'avg'),
+    ('сколько ниже 40%', 'count'),
+    ('покажи выше 50', 'list'),
+])
+def test_parse_intent_actions(text, action):
+    assert parse_intent(text).action == action
+
+
+@pytest.mark.parametrize('text', [
+    'Расскажи про последние новости',
+    'Напиши письмо преподавателю Петрову',
+    'Привет! Как дела?',
+    'Что такое топливо?',
+])
+def test_parse_intent_ignores_general_questions(text):
+    assert parse_intent(text) is None
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Сколько будет 2+2?', False),
+    ('Расскажи про последние новости', False),
+    ('Какие есть книги по Python?', False),
+    ('кто меньше всех', False),
+    ('сколько ниже 40%', True),
+    ('средняя посещаемость', True),
+    ('сколько в группе ИС-11', True),
+    ('сколько студентов не сдали ДЗ', True),
+])
+def test_names_report(text, expected):
+    assert names_report(text) is expected
+
+
+def test_threshold_and_n():
+    intent = parse_intent('топ 2 выше 50%')
+    assert (intent.action, intent.n, intent.op, intent.threshold) == ('top', 2, '>', 50.0)
+    assert parse_intent('кто меньше').n == 1
+
+
+def test_unknown_name_falls_through_to_ai():
+    intent = parse_intent('Какие есть книги по Python?')
+    assert intent.name == 'Python'
+    assert answer(intent, REPORT) is None
+
+
+def test_name_filter_matches_declined_surname():
+    text = answer(parse_intent('покажи по Иванову'), REPORT)
+    assert 'Иванов И.И.' in text and 'Петров' not in text
+
+
+def test_count_uses_report_threshold():
+    assert answer(parse_intent('сколько'), REPORT) == '⚠️ Преподавателей (< 40%): 1 из 3'
+
+
+def test_bottom_and_top():
+    assert 'Иванов' in answer(parse_intent('кто меньше всех'), REPORT)
+    assert query_engine.answer(parse_intent('топ 1'), REPORT).endswith('Петров П.П.: 80.0%')
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from handlers import readers
+
+
+def test_read_csv_semicolon_cp1251_with_decimal_comma(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_bytes('ФИО;Процент\nИванов;45,5\nПетров;70\n'.encode('cp1251'))
+    df = readers.read_excel(str(path))
+    assert list(df.columns) == ['ФИО', 'Процент']
+    assert df['Процент'].tolist() == [45.5, 70.0]
+
+
+def test_read_csv_usecols_and_skiprows(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_text('a,b,c\n1,2,3\n4,5,6\n', encoding='utf-8')
+    df = readers.read_excel(str(path), header=None, skiprows=1, usecols=[0, 2], sheet_name=None)['csv']
+    assert df.values.tolist() == [[1, 3], [4, 6]]
+
+
+@pytest.mark.skipif(not (readers.engine_available('calamine') and readers.engine_available('odf')),
+                    reason='needs python_calamine and odfpy')
+def test_failed_engine_is_skipped_on_next_read_of_same_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'report.ods')
+    pd.DataFrame({'a': [1.5, 2], 'b': ['x', 'y']}).to_excel(path, index=False, engine='odf')
+    calls = []
+    read_with = readers._read_with
+
+    def tracked(engine, *args, **kwargs):
+        calls.append(engine)
+        if engine == 'calamine':
+            raise ValueError('Parse float error')
+        return read_with(engine, *args, **kwargs)
+
+    monkeypatch.setattr(readers, '_read_with', tracked)
+    for _ in range(3):
+        assert readers.read_excel(path).shape == (2, 2)
+    assert calls == ['calamine', 'odf', 'odf', 'odf']
@@ -0,0 +1,57 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from handlers import profiler, rules
+
+CHAT_ID = -2002
+
+
+class _Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def _rules(user_id, *args):
+    message = _Message()
+    update = SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=CHAT_ID),
+                             effective_user=SimpleNamespace(id=user_id))
+    asyncio.run(rules.rules_command(update, SimpleNamespace(args=list(args))))
+    return message.replies
+
+
+@pytest.fixture(autouse=True)
+def admins(monkeypatch):
+    monkeypatch.setattr(profiler, 'ADMIN_USER_IDS', {1})
+    monkeypatch.setattr(rules, 'RULES_FILE', '')
+    yield
+    rules.set_rules(CHAT_ID, 'attendance', None)
+
+
+def test_anyone_can_view_rules():
+    assert 'value < 40' in _rules(2)[0]
+    assert _rules(2, 'attendance') == ['• attendance: value < 40']
+
+
+def test_non_admin_cannot_change_or_reset_rules():
+    assert _rules(2, 'attendance', 'value', '<', '50')[0].startswith('⛔')
+    assert _rules(2, 'attendance', 'default')[0].startswith('⛔')
+    assert rules.rules_for(CHAT_ID, 'attendance').text == 'value < 40'
+
+
+def test_admin_changes_rules():
+    assert _rules(1, 'attendance', 'value', '<', '50')[0].startswith('✅')
+    assert rules.rules_for(CHAT_ID, 'attendance').text == 'value < 50'
+
+
+def test_admin_change_is_saved_to_rules_file(tmp_path, monkeypatch):
+    path = tmp_path / 'rules.json'
+    monkeypatch.setattr(rules, 'RULES_FILE', str(path))
+    _rules(1, 'attendance', 'value', '<', '55')
+    data = json.loads(path.read_text(encoding='utf-8'))
+    assert data[str(CHAT_ID)]['rules'] == {'attendance': 'value < 55'}
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from handlers import schedule_handler
+
+
+def _lessons(rows):
+    return pd.DataFrame(rows, columns=['day', 'slot', 'group', 'discipline', 'teacher', 'room'])
+
+
+def test_conflicts_group_spelling_variants_of_one_teacher_and_room():
+    lessons = _lessons([
+        ('Пн', '1', 'ИС-11', 'Математика', 'Иванов И.И.', '101'),
+        ('Пн', '1', 'ИС-21', 'Физика', 'иванов  И.И.', '202'),
+        ('Пн', '1', 'ИС-31', 'История', 'Петров П.П.', 'Лаб 5'),
+        ('Пн', '1', 'ИС-41', 'Химия', 'Сидоров С.С.', 'лаб  5'),
+    ])
+    conflicts = schedule_handler.find_conflicts(lessons)
+    assert schedule_handler.conflict_count(conflicts) == 2
+    # показывается первое написание из файла
+    assert set(conflicts['who']) == {'Иванов И.И.', 'Лаб 5'}
+
+    text = schedule_handler.format_conflicts(conflicts)
+    assert 'Накладки в расписании: 2' in text
+    lines = [line for line in text.splitlines() if line.startswith(('👤', '🚪'))]
+    assert len(lines) == 2
+    assert 'Иванов И.И. — ИС-11' in lines[0] and 'ИС-21' in lines[0]
+    assert 'ауд. Лаб 5 — ИС-31' in lines[1] and 'ИС-41' in lines[1]
+
+
+def test_stream_of_groups_is_not_a_conflict():
+    lessons = _lessons([
+        ('Пн', '1', 'ИС-11', 'Математика', 'Иванов И.И.', '101'),
+        ('Пн', '1', 'ИС-21', 'Математика', 'Иванов  И.И.', '101'),
+    ])
+    conflicts = schedule_handler.find_conflicts(lessons)
+    assert conflicts.empty
+    assert schedule_handler.conflict_count(conflicts) == 0
+    assert schedule_handler.format_conflicts(conflicts) == ''
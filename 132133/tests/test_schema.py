@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from handlers import report_runner, schema
+
+
+@pytest.fixture
+def submit_file(tmp_path):
+    path = tmp_path / 'submit.xlsx'
+    pd.DataFrame({
+        'FIO': ['Ровно Семьдесят', 'Чуть Меньше', 'Выше Порога'],
+        'Группа': ['ИС-11', 'ИС-11', 'ИС-21'],
+        'Percentage Homework': [0.7, 0.69, 0.95],
+    }).to_excel(path, index=False)
+    return str(path)
+
+
+def test_read_keeps_only_requested_roles_with_compact_dtypes(submit_file):
+    mapping = schema.infer(submit_file, 'homework_submit')
+    df = schema.read(submit_file, mapping, roles=('student', 'percentage'))
+    assert list(df.columns) == [mapping.column('student'), mapping.column('percentage')]
+    assert isinstance(df[mapping.column('student')].dtype, pd.CategoricalDtype)
+    # доли сравниваются с порогом после * 100 — во float32 0.7 превратилось бы в 69.99999
+    assert df[mapping.column('percentage')].dtype == 'float64'
+
+
+def test_read_downcasts_integer_counters(tmp_path):
+    path = tmp_path / 'students.xlsx'
+    pd.DataFrame({'FIO': ['А', 'Б'], 'Группа': ['ИС-11', 'ИС-11'], 'Homework': [1, 5], 'Classroom': [3, 4]}).to_excel(path, index=False)
+    mapping = schema.infer(str(path), 'students')
+    df = schema.read(str(path), mapping)
+    assert df[mapping.column('homework')].dtype == 'int8'
+
+
+def test_threshold_boundary_is_not_a_problem(submit_file):
+    drafts = report_runner.run_processor('homework_submit', submit_file, chat_id=-1001)
+    text = '\n'.join(t for _, t, _ in drafts)
+    assert 'Чуть Меньше' in text
+    assert 'Ровно Семьдесят' not in text
+    assert 'Выше Порога' not in text
+
+
+def test_infer_uses_layout_cache(submit_file):
+    schema.infer(submit_file, 'homework_submit')
+    before = schema.cache_stats()['hits']
+    schema.infer(submit_file, 'homework_submit')
+    assert schema.cache_stats()['hits'] == before + 1
+
+
+def test_cache_counters_are_consistent_across_threads(submit_file):
+    from concurrent.futures import ThreadPoolExecutor
+
+    raw = schema.probe(submit_file)
+    before = schema.cache_stats()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: schema.infer(submit_file, 'homework_submit', raw), range(200)))
+    after = schema.cache_stats()
+    assert (after['hits'] + after['misses']) - (before['hits'] + before['misses']) == 200
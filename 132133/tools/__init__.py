@@ -0,0 +1 @@
+"""Вспомогательные инструменты: заглушки и нагрузочные тесты"""
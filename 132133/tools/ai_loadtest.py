@@ -0,0 +1,209 @@
+"""Нагрузочный тест AI-пути: N параллельных пользователей через process_ai_query / process_ai_file.
+
+Обработчики вызываются напрямую с упрощёнными объектами Update/Context, а запросы к AI
+уходят на локальную заглушку (`tools.fake_mistral`), так что квота API не тратится.
+
+Запуск (из каталога 132133):
+    python -m tools.ai_loadtest --users 50 --requests 5 --mode mixed --serve --latency-ms 500
+или против уже запущенной заглушки:
+    python -m tools.ai_loadtest --endpoint http://127.0.0.1:8799/v1/chat/completions
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import itertools
+import tempfile
+from types import SimpleNamespace
+from typing import List, Optional
+
+from tools import fake_mistral
+
+_message_ids = itertools.count(1)
+
+QUESTIONS = [
+    "Составь план проверки домашних заданий на неделю",
+    "Как повысить посещаемость вечерних групп?",
+    "Кратко: чем опасна низкая проверка ДЗ?",
+]
+
+
+class FakeFile:
+    def __init__(self, source: str):
+        self.source = source
+
+    async def download_to_drive(self, custom_path: str) -> None:
+        await asyncio.to_thread(shutil.copyfile, self.source, custom_path)
+
+
+class FakeDocument:
+    def __init__(self, source: str, file_name: str):
+        self.file_id = f"doc{next(_message_ids)}"
+        self.file_unique_id = self.file_id
+        self.file_name = file_name
+        self.file_size = os.path.getsize(source)
+        self._source = source
+
+    async def get_file(self) -> FakeFile:
+        return FakeFile(self._source)
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int, text: Optional[str] = None, document: Optional[FakeDocument] = None):
+        self.message_id = next(_message_ids)
+        self.chat_id = chat_id
+        self.text = text
+        self.caption = None
+        self.document = document
+        self.reply_to_message = None
+        self.media_group_id = None
+        self.replies: List[str] = []
+
+    async def reply_text(self, text: str, **kwargs) -> 'FakeMessage':
+        self.replies.append(text)
+        return FakeMessage(self.chat_id, text)
+
+
+def make_update(chat_id: int, message: FakeMessage) -> SimpleNamespace:
+    return SimpleNamespace(
+        update_id=next(_message_ids),
+        message=message,
+        effective_message=message,
+        callback_query=None,
+        effective_chat=SimpleNamespace(id=chat_id, type='private'),
+        effective_user=SimpleNamespace(id=chat_id),
+    )
+
+
+def make_context() -> SimpleNamespace:
+    return SimpleNamespace(
+        user_data={'report_type': 'ai'},
+        chat_data={},
+        bot_data={},
+        application=SimpleNamespace(bot_data={'main_keyboard': None}),
+    )
+
+
+def make_workbook(directory: str, rows: int) -> str:
+    """Таблица, похожая на отчёт по посещаемости, для сценария process_ai_file."""
+    import pandas as pd
+
+    path = os.path.join(directory, "loadtest.xlsx")
+    df = pd.DataFrame({
+        'ФИО преподавателя': [f"Преподаватель {i}" for i in range(rows)],
+        'Группа': [f"ИС-{i % 12 + 1}1" for i in range(rows)],
+        'Средняя посещаемость': [(i * 37) % 100 for i in range(rows)],
+    })
+    df.to_excel(path, index=False)
+    return path
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+async def simulate_user(user_no: int, requests_per_user: int, mode: str, workbook: str,
+                        latencies: List[float], failures: List[str]) -> None:
+    from handlers import ai_handler
+
+    chat_id = 10_000 + user_no
+    for i in range(requests_per_user):
+        use_file = mode == 'file' or (mode == 'mixed' and (user_no + i) % 2 == 1)
+        if use_file:
+            msg = FakeMessage(chat_id, document=FakeDocument(workbook, "Посещаемость.xlsx"))
+            handler = ai_handler.process_ai_file
+        else:
+            msg = FakeMessage(chat_id, text=QUESTIONS[(user_no + i) % len(QUESTIONS)])
+            handler = ai_handler.process_ai_query
+
+        started = time.perf_counter()
+        try:
+            await handler(make_update(chat_id, msg), make_context())
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e}")
+            continue
+        latencies.append(time.perf_counter() - started)
+        errors = [r for r in msg.replies if r.startswith(('❌', '⏳'))]
+        if errors:
+            failures.append(errors[0][:120])
+
+
+async def run(args: argparse.Namespace, workbook: str) -> None:
+    latencies: List[float] = []
+    failures: List[str] = []
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(n, args.requests, args.mode, workbook, latencies, failures)
+        for n in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = args.users * args.requests
+    print(f"\nПользователей: {args.users}, запросов: {total}, режим: {args.mode}")
+    print(f"Время: {elapsed:.2f} с, пропускная способность: {total / elapsed:.2f} запр/с")
+    print(f"Ошибок: {len(failures)}")
+    for p in (50, 95, 99):
+        print(f"p{p}: {percentile(latencies, p) * 1000:.0f} мс")
+    if latencies:
+        print(f"max: {latencies[-1] * 1000:.0f} мс")
+    for text, count in sorted(_count(failures).items(), key=lambda x: -x[1])[:5]:
+        print(f"  {count} × {text}")
+
+
+def _count(items: List[str]) -> dict:
+    counts = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20, help='параллельных пользователей')
+    parser.add_argument('--requests', type=int, default=3, help='запросов на пользователя')
+    parser.add_argument('--mode', choices=('query', 'file', 'mixed'), default='mixed')
+    parser.add_argument('--rows', type=int, default=500, help='строк в тестовом Excel')
+    parser.add_argument('--endpoint', help='URL уже запущенной заглушки')
+    parser.add_argument('--serve', action='store_true', help='поднять заглушку в этом процессе')
+    fake_mistral.add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    if args.serve or not args.endpoint:
+        server = fake_mistral.start_in_thread(config=fake_mistral.config_from_args(args))
+        args.endpoint = server.endpoint
+    # конфиг клиента читается при импорте handlers, поэтому окружение задаём до него
+    os.environ['MISTRAL_ENDPOINT'] = args.endpoint
+    os.environ.setdefault('MISTRAL_API_KEY', 'loadtest')
+    print(f"AI endpoint: {args.endpoint}")
+
+    workdir = tempfile.mkdtemp(prefix="ai_loadtest_")
+    cwd = os.getcwd()
+    try:
+        workbook = make_workbook(workdir, args.rows)
+        # process_ai_file складывает временные файлы в текущий каталог
+        os.chdir(workdir)
+        asyncio.run(run(args, workbook))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if server is not None:
+        print(f"Заглушка: {server.stats.snapshot()}")
+        server.shutdown()
+
+    from handlers import mistral_client
+    print(f"Клиент: {mistral_client.get_stats()}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
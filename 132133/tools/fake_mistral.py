@@ -0,0 +1,283 @@
+"""Локальная заглушка Mistral API (/v1/chat/completions) для нагрузочных тестов.
+
+Отвечает в том же формате, что разбирает `mistral_client`, и умеет имитировать
+задержки, ошибки 5xx, 429 с Retry-After и потоковую выдачу (stream=true, SSE).
+
+Запуск (из каталога 132133):
+    python -m tools.fake_mistral --port 8799 --latency-dist lognormal --latency-ms 800 --error-rate 0.05
+и в окружении бота:
+    MISTRAL_ENDPOINT=http://127.0.0.1:8799/v1/chat/completions
+"""
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+LATENCY_DISTS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+
+class StubConfig:
+    """Параметры поведения заглушки (можно менять на лету из тестов)."""
+
+    def __init__(
+        self,
+        latency_dist: str = 'fixed',
+        latency_ms: float = 200.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        reply_words: int = 80,
+        stream_chunk_ms: float = 20.0,
+        seed: Optional[int] = None,
+    ):
+        if latency_dist not in LATENCY_DISTS:
+            raise ValueError(f"unknown latency distribution: {latency_dist}")
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.reply_words = reply_words
+        self.stream_chunk_ms = stream_chunk_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """Задержка ответа в секундах; latency_ms — среднее (для lognormal — медиана)."""
+        mean = self.latency_ms / 1000.0
+        with self.lock:
+            if self.latency_dist == 'uniform':
+                value = self.rng.uniform(0, 2 * mean)
+            elif self.latency_dist == 'normal':
+                value = self.rng.gauss(mean, mean * self.latency_sigma)
+            elif self.latency_dist == 'lognormal':
+                value = mean * self.rng.lognormvariate(0, self.latency_sigma)
+            elif self.latency_dist == 'exponential':
+                value = self.rng.expovariate(1 / mean) if mean > 0 else 0.0
+            else:
+                value = mean
+        return max(0.0, value)
+
+    def pick_outcome(self) -> str:
+        with self.lock:
+            r = self.rng.random()
+        if r < self.rate_limit_rate:
+            return 'rate_limited'
+        if r < self.rate_limit_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'ok': 0, 'errors': 0, 'rate_limited': 0, 'streamed': 0}
+
+    def inc(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+def _reply_text(prompt: str, words: int) -> str:
+    head = f"Заглушка: получен запрос длиной {len(prompt)} символов."
+    filler = " ".join(["анализ"] * max(0, words))
+    return f"{head} {filler}".strip()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "FakeMistral/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.config
+
+    @property
+    def stats(self) -> StubStats:
+        return self.server.stats
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send_json(200, self.stats.snapshot())
+        else:
+            self._send_json(404, {'message': 'not found'})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/v1/chat/completions'):
+            self._send_json(404, {'message': f'no route {self.path}'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'message': 'invalid json'})
+            return
+
+        self.stats.inc('requests')
+        time.sleep(self.config.sample_latency())
+
+        outcome = self.config.pick_outcome()
+        if outcome == 'rate_limited':
+            self.stats.inc('rate_limited')
+            self._send_json(429, {'message': 'Requests rate limit exceeded'},
+                            headers={'Retry-After': f"{self.config.retry_after:g}"})
+            return
+        if outcome == 'error':
+            self.stats.inc('errors')
+            self._send_json(503, {'message': 'Service unavailable (stub)'})
+            return
+
+        model = body.get('model', 'stub')
+        messages = body.get('messages') or [{}]
+        prompt = str(messages[-1].get('content', ''))
+        text = _reply_text(prompt, self.config.reply_words)
+        completion_id = f"cmpl-{uuid.uuid4().hex[:12]}"
+
+        if body.get('stream'):
+            self._stream(completion_id, model, text)
+            return
+
+        self.stats.inc('ok')
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': len(prompt) // 4,
+                'completion_tokens': len(text) // 4,
+                'total_tokens': (len(prompt) + len(text)) // 4,
+            },
+        })
+
+    def _stream(self, completion_id: str, model: str, text: str) -> None:
+        """SSE в формате chat.completion.chunk, завершается `data: [DONE]`."""
+        self.stats.inc('streamed')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        words = text.split(' ')
+        for i in range(0, len(words), 8):
+            piece = ' '.join(words[i:i + 8]) + ' '
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.config.stream_chunk_ms / 1000.0)
+
+        last = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self.wfile.write(f"data: {json.dumps(last)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+
+class FakeMistralServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.stats = StubStats()
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0, config: Optional[StubConfig] = None) -> FakeMistralServer:
+    """Запустить заглушку в фоновом потоке (port=0 — свободный порт)."""
+    server = FakeMistralServer((host, port), config or StubConfig())
+    threading.Thread(target=server.serve_forever, name='fake-mistral', daemon=True).start()
+    return server
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTS, default='fixed')
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='среднее (для lognormal — медиана)')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='разброс для normal/lognormal')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='значение Retry-After для 429')
+    parser.add_argument('--reply-words', type=int, default=80)
+    parser.add_argument('--stream-chunk-ms', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        reply_words=args.reply_words,
+        stream_chunk_ms=args.stream_chunk_ms,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8799)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    server = FakeMistralServer((args.host, args.port), config_from_args(args))
+    print(f"🧪 Заглушка Mistral слушает {server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Итого: {server.stats.snapshot()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Локальная заглушка Telegram Bot API для сквозных нагрузочных тестов.
+
+Понимает запросы python-telegram-bot (form-urlencoded и multipart): getMe, getFile и
+скачивание файлов, sendMessage, editMessageText, sendDocument; остальные методы
+(answerCallbackQuery, setWebhook, ...) просто отвечают true. Файлы для getFile
+регистрируются через add_file(); отправленные ботом сообщения передаются в колбэк
+on_sent (из потока сервера) и считаются по методам.
+
+Приложение направляется на заглушку так:
+    Application.builder().base_url(server.base_url).base_file_url(server.base_file_url)
+(см. main.build_application и tools/replay_loadtest.py).
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import itertools
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Deque, Dict, Optional
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 777000, 'is_bot': True, 'first_name': 'Replay', 'username': 'replay_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+
+@dataclass
+class Sent:
+    """Сообщение, отправленное (или отредактированное) ботом."""
+    method: str
+    chat_id: int
+    text: str
+    message_id: int
+    at: float = field(default_factory=time.perf_counter)
+
+
+class FakeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+
+    def inc(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+def _value(raw: str) -> Any:
+    # PTB кодирует нестроковые параметры как JSON (числа, разметка клавиатур)
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def parse_params(content_type: str, body: bytes) -> Dict[str, Any]:
+    """Параметры метода из тела запроса: JSON, form-urlencoded или multipart."""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+        params: Dict[str, Any] = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is not None:
+                params[name] = part.get_payload(decode=True)  # содержимое файла
+            else:
+                params[name] = _value(part.get_content())
+        return params
+    return {k: _value(v[0]) for k, v in parse_qs(body.decode('utf-8'), keep_blank_values=True).items()}
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    server_version = "FakeTelegram/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply(self, result: Any = None, error: Optional[str] = None) -> None:
+        if error is not None:
+            payload = {'ok': False, 'error_code': 400, 'description': f"Bad Request: {error}"}
+        else:
+            payload = {'ok': True, 'result': result}
+        self._send(400 if error else 200, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        # /file/bot<token>/<file_path>
+        parts = self.path.split('/', 3)
+        if len(parts) == 4 and parts[1] == 'file' and parts[2].startswith('bot'):
+            path = self.server.files.get(parts[3].rpartition('/')[2])
+            if path is not None:
+                self.server.stats.inc('download')
+                with open(path, 'rb') as f:
+                    self._send(200, f.read(), 'application/octet-stream')
+                return
+        self._send(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        # /bot<token>/<method>
+        parts = self.path.split('/')
+        if len(parts) != 3 or not parts[1].startswith('bot'):
+            self._send(404, b'not found', 'text/plain')
+            return
+        method = parts[2]
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            params = parse_params(self.headers.get('Content-Type') or '', self.rfile.read(length))
+        except ValueError as e:
+            self._reply(error=f"can't parse request: {e}")
+            return
+        self.server.stats.inc(method)
+        handler = getattr(self.server, f"api_{method}", None)
+        if handler is None:
+            self._reply(True)  # answerCallbackQuery, setWebhook, setMyCommands, ...
+            return
+        try:
+            self._reply(handler(params))
+        except LookupError as e:
+            self._reply(error=str(e))
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, on_sent: Optional[Callable[[Sent], None]] = None, keep_last: int = 1000):
+        super().__init__(address, FakeTelegramHandler)
+        self.on_sent = on_sent
+        self.stats = FakeStats()
+        self.files: Dict[str, str] = {}
+        # последние сообщения — для отладки; ограничены, чтобы не искажать замер памяти
+        self.sent: Deque[Sent] = deque(maxlen=keep_last)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/file/bot"
+
+    def add_file(self, path: str, file_id: Optional[str] = None) -> str:
+        """Зарегистрировать локальный файл для getFile; возвращает его file_id."""
+        with self._lock:
+            file_id = file_id or f"file{next(self._ids)}"
+        self.files[file_id] = path
+        return file_id
+
+    def _message(self, chat_id: int, text: str, message_id: Optional[int] = None) -> Dict[str, Any]:
+        with self._lock:
+            message_id = message_id or next(self._ids)
+        return {'message_id': message_id, 'date': int(time.time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+
+    def _record(self, method: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        sent = Sent(method, message['chat']['id'], message.get('text') or '', message['message_id'])
+        self.sent.append(sent)
+        if self.on_sent is not None:
+            try:
+                self.on_sent(sent)
+            except Exception:
+                logger.exception("on_sent failed")
+        return message
+
+    def api_getMe(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return BOT_USER
+
+    def api_getFile(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        file_id = str(params.get('file_id'))
+        if file_id not in self.files:
+            raise LookupError("invalid file_id")
+        return {'file_id': file_id, 'file_unique_id': file_id,
+                'file_size': os.path.getsize(self.files[file_id]), 'file_path': f"documents/{file_id}"}
+
+    def api_sendMessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._record('sendMessage', self._message(int(params['chat_id']), str(params.get('text', ''))))
+
+    def api_editMessageText(self, params: Dict[str, Any]) -> Any:
+        if 'inline_message_id' in params:
+            return True
+        message = self._message(int(params['chat_id']), str(params.get('text', '')), int(params['message_id']))
+        return self._record('editMessageText', message)
+
+    def api_sendDocument(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        message = self._message(int(params['chat_id']), str(params.get('caption') or ''))
+        message['document'] = {'file_id': f"sent{message['message_id']}", 'file_unique_id': f"sent{message['message_id']}"}
+        return self._record('sendDocument', message)
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0,
+                    on_sent: Optional[Callable[[Sent], None]] = None) -> FakeTelegramServer:
+    """Запустить заглушку в фоновом потоке (port=0 — свободный порт)."""
+    server = FakeTelegramServer((host, port), on_sent)
+    threading.Thread(target=server.serve_forever, name='fake-telegram', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8798)
+    parser.add_argument('files', nargs='*', help='файлы для getFile (file_id — имя файла)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    server = FakeTelegramServer((args.host, args.port),
+                                on_sent=lambda s: logger.info("%s → %s: %s", s.method, s.chat_id, s.text[:80]))
+    for path in args.files:
+        server.add_file(path, os.path.basename(path))
+    print(f"🧪 Заглушка Bot API слушает {server.base_url}<token>/, файлы: {server.base_file_url}<token>/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Итого: {server.stats.snapshot()}")
+
+
+if __name__ == '__main__':
+    main()
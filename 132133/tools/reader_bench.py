@@ -0,0 +1,151 @@
+"""Сравнение движков чтения таблиц (handlers.readers) на формах наших отчётов.
+
+Генерирует книги, похожие на реальные выгрузки (посещаемость — 2 колонки,
+студенты — широкая таблица, проверка ДЗ — двухуровневый заголовок, расписание —
+многострочные ячейки) в xlsx/ods/csv, и для каждого доступного движка меряет полное чтение листа
+и путь обработчика (проба заголовка + чтение нужных колонок).
+
+Запуск (из каталога 132133):
+    python -m tools.reader_bench --rows 5000 --repeat 3
+    python -m tools.reader_bench --files "Отчет по студентам.xls" "Посещаемость.xlsx"
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from handlers import readers, schema
+
+# тип отчёта -> роли, которые читает обработчик
+REPORT_ROLES = {
+    'attendance': ('teacher', 'attendance'),
+    'students': ('fio', 'homework', 'classroom', 'group'),
+    'homework_check': ('teacher', 'issued_month', 'checked_month'),
+    'schedule': None,
+}
+
+
+def make_frames(rows: int) -> Dict[str, Tuple[pd.DataFrame, bool]]:
+    """Тип отчёта -> (таблица, писать ли индекс). Проверка ДЗ пишется с двухуровневым заголовком."""
+    attendance = pd.DataFrame({
+        'ФИО преподавателя': [f"Преподаватель {i}" for i in range(rows)],
+        'Средняя посещаемость': [f"{(i * 37) % 100}%" for i in range(rows)],
+    })
+    students = pd.DataFrame({
+        'FIO': [f"Студент {i}" for i in range(rows)],
+        'Группа': [f"ИС-{i % 40}" for i in range(rows)],
+        'Homework': [(i * 7) % 5 + 1 for i in range(rows)],
+        'Classroom': [(i * 11) % 5 + 1 for i in range(rows)],
+    })
+    for k in range(12):
+        students[f'Extra {k}'] = [f"значение {i}" for i in range(rows)]
+    check = pd.DataFrame({
+        ('ФИО преподавателя', ''): [f"Учитель {i}" for i in range(rows)],
+        ('Месяц', 'Получено'): [(i * 13) % 100 + 1 for i in range(rows)],
+        ('Месяц', 'Проверено'): [(i * 7) % 60 for i in range(rows)],
+        ('Неделя', 'Получено'): [(i * 5) % 30 + 1 for i in range(rows)],
+        ('Неделя', 'Проверено'): [(i * 3) % 20 for i in range(rows)],
+    })
+    schedule = pd.DataFrame({'Группа': [f"ИС-{i % 40}" for i in range(rows)], 'Время': ['9:00'] * rows,
+                             'Ауд.': ['101'] * rows})
+    for day in ('Пн', 'Вт', 'Ср', 'Чт', 'Пт'):
+        schedule[day] = [f"Предмет: Дисциплина {i % 9}\nПреподаватель: П{i % 30}" for i in range(rows)]
+        schedule[f'{day} ауд.'] = ['201'] * rows
+    return {
+        'attendance': (attendance, False),
+        'students': (students, False),
+        'homework_check': (check, True),
+        'schedule': (schedule, False),
+    }
+
+
+def write_files(directory: str, rows: int) -> List[Tuple[str, str]]:
+    """Записать книги во всех форматах, для которых есть писатель. Возвращает (тип, путь)."""
+    files = []
+    for report_type, (df, index) in make_frames(rows).items():
+        path = os.path.join(directory, f"{report_type}.xlsx")
+        df.to_excel(path, index=index)
+        files.append((report_type, path))
+        if readers.engine_available('odf') and not index:
+            path = os.path.join(directory, f"{report_type}.ods")
+            df.to_excel(path, index=False, engine='odf')
+            files.append((report_type, path))
+        if not index:
+            # та же выгрузка в CSV, как её отдаёт 1С: cp1251 и ';'
+            path = os.path.join(directory, f"{report_type}.csv")
+            df.to_csv(path, index=False, sep=';', encoding='cp1251')
+            files.append((report_type, path))
+    return files
+
+
+def timed(fn: Callable[[], object], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def bench_file(report_type: Optional[str], path: str, repeat: int) -> List[Tuple[str, str, str, float, float]]:
+    fmt = readers.sniff(path)
+    results = []
+    for engine in readers.available_engines(fmt or ''):
+        try:
+            full = timed(lambda: readers.read_excel(path, engine=engine, header=None), repeat)
+        except Exception as e:
+            print(f"  {os.path.basename(path)} [{engine}]: ошибка: {e}")
+            continue
+
+        handler = float('nan')
+        if report_type:
+            def handler_path():
+                raw = readers.read_excel(path, engine=engine, header=None, nrows=schema.PROBE_ROWS)
+                mapping = schema.DETECTORS[report_type](raw)
+                skip = mapping.header_row + 1
+                roles = REPORT_ROLES[report_type]
+                usecols = sorted({mapping.roles[r] for r in roles if mapping.roles.get(r) is not None}) if roles else None
+                readers.read_excel(path, engine=engine, header=None, skiprows=skip, usecols=usecols)
+            handler = timed(handler_path, repeat)
+        results.append((os.path.basename(path), fmt, engine, full, handler))
+    return results
+
+
+def guess_report_type(path: str) -> Optional[str]:
+    """Тип отчёта для реального файла (см. schema.detect_report_type)."""
+    try:
+        report_type = schema.detect_report_type(schema.probe(path))
+    except Exception:
+        return None
+    return report_type if report_type in REPORT_ROLES else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000, help='строк в сгенерированных книгах')
+    parser.add_argument('--repeat', type=int, default=3, help='повторов на замер (берётся медиана)')
+    parser.add_argument('--files', nargs='*', default=[], help='реальные выгрузки для замера')
+    args = parser.parse_args()
+
+    engines = {fmt: readers.available_engines(fmt) for fmt in readers.ENGINE_PREFERENCE}
+    print("Доступные движки: " + ", ".join(f"{fmt}: {'/'.join(e) or '-'}" for fmt, e in engines.items()))
+
+    workdir = tempfile.mkdtemp(prefix="reader_bench_")
+    try:
+        files = [(guess_report_type(p), p) for p in args.files] if args.files else write_files(workdir, args.rows)
+        print(f"\n{'файл':<28}{'формат':<8}{'движок':<10}{'весь лист, мс':>15}{'путь обработчика, мс':>22}")
+        for report_type, path in files:
+            for name, fmt, engine, full, handler in bench_file(report_type, path, args.repeat):
+                print(f"{name[:27]:<28}{fmt:<8}{engine:<10}{full * 1000:>15.0f}{handler * 1000:>22.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
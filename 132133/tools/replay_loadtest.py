@@ -0,0 +1,307 @@
+"""Сквозной нагрузочный тест: настоящий Application из main против локального Bot API.
+
+Приложение собирается main.build_application, но запросы к Bot API уходят на заглушку
+(`tools.fake_telegram`), а апдейты подаются прямо в application.update_queue — как их
+кладёт вебхук. Каждый пользователь проигрывает сценарий
+    /start → кнопка отчёта → (для проверки ДЗ — период) → документ → «✅ Готово»
+столько раз, сколько задано --sessions; следующий шаг отправляется после ответа бота
+на предыдущий. Общий темп подачи апдейтов ограничен --rate (апдейтов в секунду).
+
+Результат: апдейтов в секунду, задержка от подачи апдейта до ответа бота
+(p50/p90/p99/max по шагам сценария) и память процесса (RSS) во времени. Заглушка
+работает в этом же процессе, но ничего не накапливает.
+
+Запуск (из каталога 132133):
+    python -m tools.replay_loadtest --users 20 --sessions 5 --rate 50 --rows 2000
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import itertools
+import tempfile
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+from handlers import progress
+from tools import fake_telegram
+from tools.ai_loadtest import percentile
+
+TOKEN = "123456:REPLAY"
+USER_ID_BASE = 100_000
+STEP_TIMEOUT = 120.0
+BUSY_RETRY_SECONDS = 0.05
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+
+
+def _message(user_id: int, **fields) -> dict:
+    return {'message_id': next(_message_ids), 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'}, 'from': _user(user_id), **fields}
+
+
+def _callback(user_id: int, data: str) -> dict:
+    # кнопка под сообщением бота; какое именно сообщение — обработчикам не важно
+    message = {**_message(user_id, text="menu"), 'from': fake_telegram.BOT_USER}
+    return {'id': str(next(_update_ids)), 'from': _user(user_id), 'chat_instance': str(user_id),
+            'data': data, 'message': message}
+
+
+def _edited(sent: fake_telegram.Sent) -> bool:
+    return sent.method == 'editMessageText'
+
+
+def session_steps(user_id: int, report_type: str, file_id: str, file_name: str) -> List[Tuple[str, dict, Callable]]:
+    """Сценарий одного отчёта: (шаг, поля апдейта, признак ответа бота)."""
+    steps = [
+        ('start', {'message': _message(user_id, text='/start',
+                                       entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}])},
+         lambda s: 'кнопку /start' in s.text),
+        ('menu', {'callback_query': _callback(user_id, report_type)}, _edited),
+    ]
+    if report_type == 'homework_check':
+        steps.append(('period', {'callback_query': _callback(user_id, 'hw_check_month')}, _edited))
+    steps.append(('file', {'message': _message(user_id, document={
+        'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name})},
+        lambda s: s.text.startswith('✅ Готово')))
+    return steps
+
+
+def is_failure(sent: fake_telegram.Sent) -> bool:
+    return sent.text.startswith(('❌', '❗'))
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (Linux: /proc/self/statm; иначе — пиковый из getrusage)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Pacer:
+    """Общий темп подачи апдейтов: не больше rate в секунду (0 — без ограничения)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next = 0.0
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        slot = max(now, self.next)
+        self.next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Replay:
+    def __init__(self, application, pacer: Pacer, timeout: float):
+        self.application = application
+        self.pacer = pacer
+        self.timeout = timeout
+        self.loop = asyncio.get_running_loop()
+        # чат -> (признак ответа, future)
+        self.waiters: Dict[int, Tuple[Callable, asyncio.Future]] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.updates = 0
+        self.busy_retries = 0
+
+    def on_sent(self, sent: fake_telegram.Sent) -> None:
+        # вызывается из потока заглушки
+        self.loop.call_soon_threadsafe(self._dispatch, sent)
+
+    def _dispatch(self, sent: fake_telegram.Sent) -> None:
+        waiter = self.waiters.get(sent.chat_id)
+        if waiter is None or waiter[1].done():
+            return
+        done, future = waiter
+        if is_failure(sent) or sent.text == progress.BUSY_TEXT or done(sent):
+            future.set_result(sent)
+
+    async def step(self, user_id: int, name: str, fields: dict, done: Callable) -> bool:
+        started = None
+        while True:
+            await self.pacer.wait()
+            future = self.loop.create_future()
+            self.waiters[user_id] = (done, future)
+            update = fake_telegram_update(self.application.bot, fields)
+            started = started or time.perf_counter()
+            await self.application.update_queue.put(update)
+            self.updates += 1
+            try:
+                sent = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self.failures[f"{name}: нет ответа за {self.timeout:g} с"] += 1
+                return False
+            finally:
+                self.waiters.pop(user_id, None)
+            if sent.text != progress.BUSY_TEXT:
+                break
+            # ответ на прошлый шаг ушёл, а его обработчик ещё не вернулся — повторяем, как повторил бы человек
+            self.busy_retries += 1
+            await asyncio.sleep(BUSY_RETRY_SECONDS)
+        if is_failure(sent):
+            self.failures[f"{name}: {sent.text[:80]}"] += 1
+            return False
+        self.latencies[name].append(sent.at - started)
+        return True
+
+    async def user(self, n: int, sessions: int, files: List[Tuple[str, str, str]]) -> None:
+        user_id = USER_ID_BASE + n
+        for i in range(sessions):
+            report_type, file_id, file_name = files[(n + i) % len(files)]
+            for name, fields, done in session_steps(user_id, report_type, file_id, file_name):
+                if not await self.step(user_id, name, fields, done):
+                    break  # сессия сорвалась — начинаем следующую с /start
+
+
+def fake_telegram_update(bot, fields: dict):
+    from telegram import Update
+    return Update.de_json({'update_id': next(_update_ids), **fields}, bot)
+
+
+async def sample_memory(replay: Replay, every: float, timeline: List[Tuple[float, int, int]]) -> None:
+    started = time.perf_counter()
+    while True:
+        timeline.append((time.perf_counter() - started, replay.updates, rss_bytes()))
+        await asyncio.sleep(every)
+
+
+async def run(args: argparse.Namespace, server: fake_telegram.FakeTelegramServer,
+              files: List[Tuple[str, str, str]]) -> dict:
+    from main import build_application
+
+    application = build_application(TOKEN, base_url=server.base_url, base_file_url=server.base_file_url)
+    replay = Replay(application, Pacer(args.rate), args.timeout)
+    server.on_sent = replay.on_sent
+    timeline: List[Tuple[float, int, int]] = []
+
+    async with application:
+        if application.post_init and not args.no_post_init:
+            await application.post_init(application)
+        await application.start()
+        sampler = asyncio.create_task(sample_memory(replay, args.sample_every, timeline))
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(replay.user(n, args.sessions, files) for n in range(args.users)))
+        finally:
+            elapsed = time.perf_counter() - started
+            sampler.cancel()
+            timeline.append((elapsed, replay.updates, rss_bytes()))
+            await application.stop()
+
+    return {
+        'users': args.users,
+        'sessions': args.sessions,
+        'rate': args.rate,
+        'elapsed_s': elapsed,
+        'updates': replay.updates,
+        'updates_per_s': replay.updates / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            name: {f"p{p}": percentile(sorted(values), p) * 1000 for p in (50, 90, 99)}
+            | {'max': max(values) * 1000, 'n': len(values)}
+            for name, values in replay.latencies.items()
+        },
+        'failures': dict(replay.failures),
+        'busy_retries': replay.busy_retries,
+        'memory': [{'t_s': round(t, 2), 'updates': u, 'rss_mb': round(rss / 2**20, 1)} for t, u, rss in timeline],
+        'bot_api': server.stats.snapshot(),
+    }
+
+
+def print_report(result: dict, rows: int = 15) -> None:
+    print(f"\nПользователей: {result['users']}, сессий на пользователя: {result['sessions']}, "
+          f"темп: {result['rate'] or 'без ограничения'} апд/с")
+    print(f"Апдейтов: {result['updates']} за {result['elapsed_s']:.2f} с — {result['updates_per_s']:.1f} апд/с")
+    print("\nЗадержка до ответа бота, мс:")
+    for name, stats in result['latency_ms'].items():
+        print(f"  {name:<7} n={stats['n']:<5} p50={stats['p50']:.0f} p90={stats['p90']:.0f} "
+              f"p99={stats['p99']:.0f} max={stats['max']:.0f}")
+    failures = sum(result['failures'].values())
+    print(f"\nОшибок: {failures}, повторов после «ещё обрабатываю»: {result['busy_retries']}")
+    for text, count in sorted(result['failures'].items(), key=lambda x: -x[1])[:5]:
+        print(f"  {count} × {text}")
+
+    memory = result['memory']
+    print("\nПамять (RSS):")
+    step = max(1, len(memory) // rows)
+    for point in memory[::step] + ([memory[-1]] if (len(memory) - 1) % step else []):
+        print(f"  {point['t_s']:>8.1f} с  {point['updates']:>7} апд  {point['rss_mb']:>8.1f} МБ")
+    if memory:
+        first, middle, last = memory[0], memory[len(memory) // 2], memory[-1]
+        peak = max(p['rss_mb'] for p in memory)
+        print(f"  прирост: {last['rss_mb'] - first['rss_mb']:+.1f} МБ (пик {peak:.1f} МБ)")
+        # первая половина — прогрев (импорт модулей, кэши); утечку видно по второй
+        updates = last['updates'] - middle['updates']
+        if updates:
+            print(f"  во второй половине: {(last['rss_mb'] - middle['rss_mb']) / updates * 1000:+.2f} МБ "
+                  f"на 1000 апдейтов")
+    print(f"\nBot API: {result['bot_api']}")
+
+
+def prepare_files(server: fake_telegram.FakeTelegramServer, directory: str, rows: int,
+                  report_types: List[str], formats: List[str]) -> List[Tuple[str, str, str]]:
+    """Сгенерировать выгрузки (tools.reader_bench) и зарегистрировать их в заглушке."""
+    from tools.reader_bench import write_files
+
+    files = []
+    for report_type, path in write_files(directory, rows):
+        extension = os.path.splitext(path)[1].lstrip('.')
+        if report_type in report_types and extension in formats:
+            files.append((report_type, server.add_file(path), os.path.basename(path)))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help='параллельных пользователей')
+    parser.add_argument('--sessions', type=int, default=3, help='отчётов на пользователя')
+    parser.add_argument('--rate', type=float, default=20.0, help='апдейтов в секунду (0 — без ограничения)')
+    parser.add_argument('--rows', type=int, default=1000, help='строк в сгенерированных выгрузках')
+    parser.add_argument('--report-types', default='attendance,students,homework_check,schedule')
+    parser.add_argument('--formats', default='xlsx', help='xlsx,csv,ods')
+    parser.add_argument('--timeout', type=float, default=STEP_TIMEOUT, help='ожидание ответа на шаг, с')
+    parser.add_argument('--sample-every', type=float, default=1.0, help='период замера RSS, с')
+    parser.add_argument('--no-post-init', action='store_true', help='не вызывать post_init (без прогрева)')
+    parser.add_argument('--json', help='записать результат в JSON-файл')
+    args = parser.parse_args()
+
+    # замеряем обычный режим: в раздельном (QUEUE_DB) файлы обрабатывает worker.py
+    os.environ.pop('QUEUE_DB', None)
+
+    server = fake_telegram.start_in_thread()
+    workdir = tempfile.mkdtemp(prefix="replay_loadtest_")
+    try:
+        files = prepare_files(server, workdir, args.rows, args.report_types.split(','), args.formats.split(','))
+        if not files:
+            print("Нет файлов для выбранных --report-types/--formats")
+            return 1
+        print(f"Bot API: {server.base_url}…, файлов: {len(files)}")
+        result = asyncio.run(run(args, server, files))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 1 if result['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
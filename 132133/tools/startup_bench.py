@@ -0,0 +1,51 @@
+"""Замер холодного старта: сколько времени от запуска процесса до готовности ответить на /start.
+
+Каждый замер — новый процесс Python (как после сна инстанса на Render):
+  * lazy  — `import main` (обработчики и pandas не загружаются);
+  * eager — `import main` + загрузка всех модулей обработчиков (как было до ленивой загрузки);
+  * first report — lazy + загрузка одного обработчика отчёта (первый выбор отчёта в меню).
+
+Запуск (из каталога 132133):
+    python -m tools.startup_bench --repeat 5
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+SCENARIOS: Dict[str, str] = {
+    'lazy (/start)': "import main",
+    'eager (все обработчики)': "import main; [main.load_handler(m) for m in main.HANDLER_MODULES]",
+    'first report (посещаемость)': "import main; main.load_handler('attendance_handler')",
+}
+
+_TIMER = (
+    "import time; _t = time.perf_counter(); {code}; "
+    "print((time.perf_counter() - _t) * 1000)"
+)
+
+
+def measure(code: str, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _TIMER.format(code=code)], capture_output=True, text=True,
+                             check=True, env={**os.environ, 'PREWARM': '0'})
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='процессов на сценарий (берётся медиана)')
+    args = parser.parse_args()
+
+    print(f"{'сценарий':<32}{'медиана, мс':>12}{'мин, мс':>10}")
+    for name, code in SCENARIOS.items():
+        samples = measure(code, args.repeat)
+        print(f"{name:<32}{statistics.median(samples):>12.0f}{min(samples):>10.0f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
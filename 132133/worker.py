@@ -0,0 +1,220 @@
+"""Воркер раздельного режима: забирает задачи обработки файлов из общей очереди (QUEUE_DB)
+и отправляет результаты в чат сам.
+
+Запуск (процессов может быть сколько угодно, см. Procfile):
+    QUEUE_DB=/data/bot.db TELEGRAM_BOT_TOKEN=... python worker.py
+
+Задачу ставит main.file_handler. Воркер скачивает файл по file_id, выполняет тот же
+обработчик отчёта, что и main в обычном режиме, и отправляет ответы через Outbox:
+каждое сообщение задачи получает порядковый номер, и при повторной обработке
+(воркер упал, аренда истекла) уже отправленные номера не отправляются снова.
+"""
+import os
+import sys
+import socket
+import signal
+import asyncio
+import logging
+import tempfile
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from telegram import Bot
+
+from handlers import logging_setup, tracing
+from handlers.task_queue import QUEUE_LEASE_SECONDS, Job, TaskQueue, enabled
+
+logging_setup.configure()
+logger = logging.getLogger(__name__)
+
+# пауза между опросами пустой очереди
+QUEUE_POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", "1"))
+# как часто удалять старые выполненные задачи
+QUEUE_PURGE_SECONDS = float(os.getenv("QUEUE_PURGE_SECONDS", "3600"))
+# как часто продлевать аренду и заодно замечать отмену задачи (/cancel)
+QUEUE_CANCEL_CHECK_SECONDS = float(os.getenv("QUEUE_CANCEL_CHECK_SECONDS", "5"))
+
+
+class Outbox:
+    """Отправка сообщений задачи ровно один раз, даже если задачу обрабатывают повторно.
+
+    Обработчики детерминированы, поэтому n-е сообщение повтора совпадает с n-м сообщением
+    первой попытки. Исключение — архивы: файлы архива отправляются по мере готовности,
+    и при повторе их порядок может отличаться (сообщения не дублируются, но часть
+    результатов может прийти не под своим заголовком).
+    """
+
+    def __init__(self, bot: Bot, queue: TaskQueue, job_id: int, chat_id: int):
+        self.bot = bot
+        self.queue = queue
+        self.job_id = job_id
+        self.chat_id = chat_id
+        self.seq = 0
+
+    async def send(self, chat_id: int, text: str, seq: Optional[int] = None, **kwargs) -> Any:
+        if seq is None:
+            seq = self.seq
+            self.seq += 1
+        message_id = await asyncio.to_thread(self.queue.sent_message, self.job_id, seq)
+        if message_id is not None:
+            logger.info("Job %s: message #%d already sent, skipping", self.job_id, seq)
+            return SimpleNamespace(message_id=message_id, chat_id=chat_id)
+        sent = await self.bot.send_message(chat_id, text, **kwargs)
+        await asyncio.to_thread(self.queue.record_sent, self.job_id, seq, sent.message_id)
+        return sent
+
+
+class _OutboxMessage:
+    """Вместо update.message: reply_text уходит через Outbox."""
+
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+        self.chat_id = outbox.chat_id
+
+    async def reply_text(self, text: str, **kwargs) -> Any:
+        return await self.outbox.send(self.chat_id, text, **kwargs)
+
+
+class _OutboxBot:
+    """Вместо context.bot (report_runner.deliver отправляет через bot.send_message)."""
+
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> Any:
+        return await self.outbox.send(chat_id, text, **kwargs)
+
+
+def _keep_lease(queue: TaskQueue, job_id: int, worker: str, done: threading.Event,
+                on_lost: Callable[[], None]) -> None:
+    # в потоке: обработчики отчётов считают в цикле событий и надолго его занимают
+    while not done.wait(min(QUEUE_LEASE_SECONDS / 3, QUEUE_CANCEL_CHECK_SECONDS)):
+        if not queue.extend(job_id, worker):
+            # задачу отменили (/cancel) или её забрал другой воркер — дальше не обрабатываем
+            logger.warning("Job %s: lease lost", job_id)
+            on_lost()
+            return
+
+
+async def process_report(bot: Bot, queue: TaskQueue, job: Job) -> None:
+    from main import get_main_keyboard, load_handler
+
+    payload: Dict[str, Any] = job.payload
+    chat_id = payload['chat_id']
+    outbox = Outbox(bot, queue, job.id, chat_id)
+    message = _OutboxMessage(outbox)
+    update = SimpleNamespace(
+        message=message, effective_message=message, callback_query=None, effective_user=None,
+        effective_chat=SimpleNamespace(id=chat_id, type='private'),
+    )
+    context = SimpleNamespace(user_data=dict(payload.get('user_data') or {}), chat_data={}, bot_data={},
+                              args=[], bot=_OutboxBot(outbox))
+
+    suffix = os.path.splitext(payload.get('file_name') or '')[1].lower() or ".xlsx"
+    tmp = tempfile.NamedTemporaryFile(prefix="bot_", suffix=suffix, delete=False)
+    tmp_path = tmp.name
+    tmp.close()
+    try:
+        with tracing.span("telegram.download"):
+            file_obj = await bot.get_file(payload['file_id'])
+            await file_obj.download_to_drive(tmp_path)
+        with tracing.span("report.process", report_type=payload['report_type'], archive=bool(payload.get('is_archive'))):
+            if payload.get('is_archive'):
+                await load_handler("archive_handler").process_archive(update, context, tmp_path, payload['report_type'])
+            else:
+                await load_handler("report_runner").PROCESSORS[payload['report_type']](update, context, tmp_path)
+        await message.reply_text("✅ Готово! Выберите следующий отчёт:", reply_markup=get_main_keyboard())
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                logger.warning("Не удалось удалить временный файл: %s", tmp_path)
+
+
+async def run_job(bot: Bot, queue: TaskQueue, job: Job, worker: str) -> None:
+    logging_setup.clear()
+    logging_setup.bind(job_id=job.id, chat_id=job.payload.get('chat_id'), report_type=job.payload.get('report_type'))
+    logger.info("Job %s (%s, attempt %d) started", job.id, job.kind, job.attempts)
+    done = threading.Event()
+    lost = threading.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        # продолжение трассы процесса приёма (traceparent из задачи)
+        with tracing.span("worker.job", parent=job.payload.get('traceparent'), job_id=job.id, attempt=job.attempts):
+            work = asyncio.create_task(process_report(bot, queue, job))
+
+            def on_lost() -> None:
+                lost.set()
+                loop.call_soon_threadsafe(work.cancel)
+            threading.Thread(target=_keep_lease, args=(queue, job.id, worker, done, on_lost), daemon=True).start()
+            await work
+    except asyncio.CancelledError:
+        if not lost.is_set():
+            raise
+        # обработка прервана на ближайшем await; отправленное до этого остаётся
+        logger.info("Job %s dropped: cancelled or taken over by another worker", job.id)
+    except Exception as e:
+        logger.exception("Job %s failed", job.id)
+        final = await asyncio.to_thread(queue.fail, job.id, worker, repr(e))
+        if final:
+            # после последней попытки — сообщить пользователю (тоже один раз)
+            try:
+                await Outbox(bot, queue, job.id, job.payload['chat_id']).send(
+                    job.payload['chat_id'], "❌ Произошла ошибка при обработке файла.", seq=-1)
+            except Exception:
+                logger.exception("Job %s: не удалось отправить сообщение об ошибке", job.id)
+    else:
+        await asyncio.to_thread(queue.complete, job.id, worker)
+        logger.info("Job %s done", job.id)
+    finally:
+        done.set()
+
+
+async def run(token: str) -> None:
+    queue = TaskQueue()
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    last_purge = 0.0
+    async with Bot(token) as bot:
+        logger.info("Worker %s started", worker)
+        while not stop.is_set():
+            if loop.time() - last_purge > QUEUE_PURGE_SECONDS:
+                last_purge = loop.time()
+                purged = await asyncio.to_thread(queue.purge)
+                if purged:
+                    logger.info("Purged %d old jobs", purged)
+            job = await asyncio.to_thread(queue.claim, worker)
+            if job is None:
+                try:
+                    await asyncio.wait_for(stop.wait(), QUEUE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # текущую задачу доделываем и после SIGTERM
+            await run_job(bot, queue, job, worker)
+    logger.info("Worker %s stopped", worker)
+
+
+def main():
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set")
+        sys.exit(1)
+    if not enabled():
+        logger.error("QUEUE_DB environment variable is not set")
+        sys.exit(1)
+    asyncio.run(run(token))
+
+
+if __name__ == "__main__":
+    main()